@@ -0,0 +1,235 @@
+"""
+Crawls an acquisition tree, parses every Dragonfly metadata file with DF_metadata_extractor
+and keeps the results in a SQLite catalog, so questions like "which runs used the 40x
+objective with a 0.5 µm z-step" are a query instead of opening files by hand.
+
+The catalog has one row per acquisition (acquisitions), one row per channel (channels) and
+a files table holding each file's size/mtime. Re-running the crawl only re-parses files whose
+size or mtime changed, and drops rows for files that disappeared.
+
+Usage:
+    python DF_metadata_catalog.py crawl /Volumes/users/Hugo -d catalog.sqlite
+    python DF_metadata_catalog.py crawl /Volumes/users/Hugo -d catalog.sqlite -p "*.ims"   # straight from tiles
+    python DF_metadata_catalog.py query catalog.sqlite --where "objective_magnification = 40 AND z_step <= 0.5"
+    python DF_metadata_catalog.py query catalog.sqlite --channel 488
+"""
+
+import os
+import sys
+import time
+import json
+import fnmatch
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from DF_metadata_extractor import extract_image_metadata
+
+DEFAULT_PATTERNS = ["*metadata*.txt"]
+
+ACQUISITION_COLUMNS = [
+    ("width", "INTEGER"),
+    ("height", "INTEGER"),
+    ("num_z", "INTEGER"),
+    ("num_t", "INTEGER"),
+    ("num_channels", "INTEGER"),
+    ("z_step", "REAL"),
+    ("z_start", "REAL"),
+    ("z_end", "REAL"),
+    ("z_depth", "REAL"),
+    ("montage_rows", "INTEGER"),
+    ("montage_cols", "INTEGER"),
+    ("tile_overlap", "INTEGER"),
+    ("montage_source", "TEXT"),
+    ("objective_magnification", "REAL"),
+    ("objective_na", "REAL"),
+    ("immersion_type", "TEXT"),
+    ("immersion_ri", "REAL"),
+    ("pixel_size_x", "REAL"),
+    ("pixel_size_y", "REAL"),
+]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    parsed_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS acquisitions (
+    path TEXT PRIMARY KEY REFERENCES files(path) ON DELETE CASCADE,
+    folder TEXT,
+    {", ".join(f"{name} {kind}" for name, kind in ACQUISITION_COLUMNS)},
+    missing TEXT
+);
+CREATE TABLE IF NOT EXISTS channels (
+    path TEXT REFERENCES files(path) ON DELETE CASCADE,
+    channel_index INTEGER,
+    name TEXT,
+    exposure REAL,
+    bitdepth TEXT,
+    PRIMARY KEY (path, channel_index)
+);
+CREATE INDEX IF NOT EXISTS idx_acq_objective ON acquisitions(objective_magnification);
+CREATE INDEX IF NOT EXISTS idx_acq_z_step ON acquisitions(z_step);
+CREATE INDEX IF NOT EXISTS idx_acq_overlap ON acquisitions(tile_overlap);
+CREATE INDEX IF NOT EXISTS idx_channel_name ON channels(name);
+"""
+
+
+def open_catalog(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def find_metadata_files(root, patterns=DEFAULT_PATTERNS):
+    """Absolute paths of every file under root matching any of patterns."""
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for fname in filenames:
+            if any(fnmatch.fnmatch(fname, p) for p in patterns):
+                found.append(os.path.abspath(os.path.join(dirpath, fname)))
+    return sorted(found)
+
+
+def _parse_one(path):
+    """Worker: parse one file. Returns (path, result dict or None, error message or None)."""
+    try:
+        return path, extract_image_metadata(path, verbose=False), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def _store(conn, path, stat, result, error):
+    conn.execute("DELETE FROM files WHERE path = ?", (path,))  # cascades to acquisitions/channels
+    conn.execute(
+        "INSERT INTO files (path, size, mtime_ns, parsed_at, error) VALUES (?, ?, ?, ?, ?)",
+        (path, stat.st_size, stat.st_mtime_ns, time.time(), error),
+    )
+    if result is None:
+        return
+    names = [name for name, _ in ACQUISITION_COLUMNS]
+    conn.execute(
+        f"INSERT INTO acquisitions (path, folder, {', '.join(names)}, missing) "
+        f"VALUES ({', '.join('?' * (len(names) + 3))})",
+        [path, os.path.dirname(path)] + [result.get(name) for name in names] + [json.dumps(result.get("missing", []))],
+    )
+    conn.executemany(
+        "INSERT INTO channels (path, channel_index, name, exposure, bitdepth) VALUES (?, ?, ?, ?, ?)",
+        [(path, ch["index"], ch["name"], ch["exposure"], ch["bitdepth"]) for ch in result["channels"]],
+    )
+
+
+def crawl(root, db_path, patterns=DEFAULT_PATTERNS, workers=None):
+    """
+    Bring the catalog up to date with every metadata file under root.
+    Unchanged files (same size and mtime) are skipped; changed and new ones are parsed in a process pool.
+
+    Returns:
+        dict: counts of parsed, unchanged, failed and removed files.
+    """
+    t0 = time.perf_counter()
+    conn = open_catalog(db_path)
+    root = os.path.abspath(root)
+    paths = find_metadata_files(root, patterns)
+
+    # exact prefix test: LIKE would treat the "_" and "%" in paths as wildcards (and ignore case)
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    known = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in conn.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+    }
+    stats = {path: os.stat(path) for path in paths}
+    todo = [p for p in paths if known.get(p) != (stats[p].st_size, stats[p].st_mtime_ns)]
+    removed = sorted(set(known) - set(paths))
+
+    print(f"=== {len(paths)} metadata file(s) under {root}: {len(todo)} new/changed, {len(removed)} removed ===")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, (path, result, error) in enumerate(pool.map(_parse_one, todo, chunksize=16), 1):
+            if error:
+                failed += 1
+                print(f"[PARSE FAILED] {path} - {error}")
+            _store(conn, path, stats[path], result, error)
+            if i % 100 == 0:
+                conn.commit()
+                print(f"[{i}/{len(todo)}] parsed")
+
+    conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+    conn.commit()
+    conn.close()
+
+    summary = {"parsed": len(todo) - failed, "unchanged": len(paths) - len(todo), "failed": failed, "removed": len(removed)}
+    print(f"✅ Catalog {db_path} updated in {time.perf_counter() - t0:.1f} s: {summary}")
+    return summary
+
+
+def query(db_path, where=None, channel=None, limit=None):
+    """
+    Select acquisitions matching an SQL where clause over the acquisitions columns
+    and/or having a channel with the given name.
+
+    Returns:
+        list: sqlite3.Row results.
+    """
+    conn = open_catalog(db_path)
+    conn.row_factory = sqlite3.Row
+    sql = "SELECT a.* FROM acquisitions a"
+    clauses, params = [], []
+    if where:
+        clauses.append(f"({where})")
+    if channel:
+        clauses.append("EXISTS (SELECT 1 FROM channels c WHERE c.path = a.path AND c.name = ?)")
+        params.append(channel)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY a.path"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    t0 = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    conn.close()
+
+    for row in rows:
+        print(f"{row['path']}: {row['width']}×{row['height']}×{row['num_z']}, "
+              f"{row['objective_magnification']}× NA={row['objective_na']}, z-step {row['z_step']} µm, "
+              f"{row['montage_cols']}×{row['montage_rows']} tiles, overlap {row['tile_overlap']}%")
+    print(f"{len(rows)} acquisition(s) in {elapsed_ms:.1f} ms")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog Dragonfly acquisition metadata into SQLite.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    crawl_parser = subparsers.add_parser("crawl", help="Parse every metadata file under a directory into the catalog.")
+    crawl_parser.add_argument("root", help="Directory to walk.")
+    crawl_parser.add_argument("-d", "--db", default="df_metadata_catalog.sqlite", help="Catalog path.")
+    crawl_parser.add_argument("-p", "--pattern", action="append", default=None, help=f"Filename glob, repeatable (default: {DEFAULT_PATTERNS}).")
+    crawl_parser.add_argument("-j", "--workers", type=int, default=None, help="Parser processes (default: CPU count).")
+
+    query_parser = subparsers.add_parser("query", help="Find acquisitions in the catalog.")
+    query_parser.add_argument("db", help="Catalog path.")
+    query_parser.add_argument("-w", "--where", default=None, help="SQL condition on acquisitions columns, e.g. \"tile_overlap >= 10\".")
+    query_parser.add_argument("-c", "--channel", default=None, help="Only acquisitions with a channel of this name.")
+    query_parser.add_argument("-n", "--limit", type=int, default=None, help="Maximum rows.")
+
+    args = parser.parse_args()
+    if args.command == "crawl":
+        summary = crawl(args.root, args.db, args.pattern or DEFAULT_PATTERNS, args.workers)
+        if summary["failed"]:
+            sys.exit(1)
+    else:
+        query(args.db, args.where, args.channel, args.limit)
+
+
+if __name__ == "__main__":
+    main()
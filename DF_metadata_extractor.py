@@ -1,133 +1,703 @@
+import os
 import re
+import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+import numpy as np
 
-def extract_image_metadata(filepath):
+try:
+    import h5py  # only needed for the .ims backend
+except ImportError:
+    h5py = None
+
+# --- Section tree ---
+# The exported metadata is a list of "[Section]" headers (nested ones are tab-indented)
+# followed by "Key=Value" lines and "Description, Value=..." lines. It is tokenized in one
+# pass into a flat, document-ordered list of sections plus a key -> sections index, so every
+# field lookup is a dict hit instead of a regex scan over the whole file.
+
+_HEADER_RE = re.compile(r"^(\s*)\[([^\]]+)\]\s*$")
+
+
+class Section:
+    __slots__ = ("name", "depth", "index", "parent", "children", "entries")
+
+    def __init__(self, name, depth, index, parent=None):
+        self.name = name
+        self.depth = depth
+        self.index = index
+        self.parent = parent
+        self.children = []
+        self.entries = {}
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def __repr__(self):
+        return f"Section({self.name!r}, {len(self.entries)} entries, {len(self.children)} children)"
+
+
+class SectionTree:
+    __slots__ = ("root", "sections", "key_index")
+
+    def __init__(self):
+        self.root = Section("<root>", -1, -1)
+        self.sections = []  # every section in document order
+        self.key_index = {}  # key -> [section index, ...] in document order
+
+    def named(self, name):
+        """All sections called name, in document order."""
+        return [s for s in self.sections if s.name == name]
+
+    def first(self, name):
+        found = self.named(name)
+        return found[0] if found else None
+
+    def find_key(self, key):
+        """First section (document order) containing key, or None."""
+        hits = self.key_index.get(key)
+        return self.sections[hits[0]] if hits else None
+
+    def find_with_all(self, keys):
+        """First section containing every key in keys, or None."""
+        hits = set(self.key_index.get(keys[0], ()))
+        for key in keys[1:]:
+            hits &= set(self.key_index.get(key, ()))
+        return self.sections[min(hits)] if hits else None
+
+    def span(self, section, stop_name=None):
+        """
+        The section plus every section after it, up to the next one named stop_name
+        (default: the next section at the same or lower depth).
+        """
+        out = [section]
+        for s in self.sections[section.index + 1:]:
+            if stop_name is not None:
+                if s.name == stop_name:
+                    break
+            elif s.depth <= section.depth:
+                break
+            out.append(s)
+        return out
+
+
+def parse_sections(text):
     """
-    Extracts imaging metadata from a plain-text metadata file.
+    Tokenize metadata text into a SectionTree in a single pass over its lines.
+    Key=Value lines go to the most recent section; "Name, Value=x" lines are stored
+    under "Name" with everything up to the next comma as the value.
+    """
+    tree = SectionTree()
+    stack = [tree.root]
+    current = tree.root
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        header = _HEADER_RE.match(line)
+        if header:
+            depth = len(header.group(1).expandtabs(1))
+            while stack[-1].depth >= depth:
+                stack.pop()
+            current = Section(header.group(2).strip(), depth, len(tree.sections), stack[-1])
+            stack[-1].children.append(current)
+            stack.append(current)
+            tree.sections.append(current)
+            continue
+
+        value_pos = stripped.find(", Value=")
+        if value_pos != -1:
+            key = stripped[:value_pos]
+            key = key.rsplit("=", 1)[-1].strip()  # "Name=Pixel Width (µm)" -> "Pixel Width (µm)"
+            value = stripped[value_pos + len(", Value="):].split(",", 1)[0].strip()
+        elif "=" in stripped:
+            key, value = stripped.split("=", 1)
+            key, value = key.strip(), value.strip()
+        else:
+            continue
+
+        if key not in current.entries:
+            current.entries[key] = value
+            if current.index >= 0:
+                tree.key_index.setdefault(key, []).append(current.index)
+    return tree
+
+
+# --- Typed results ---
+
+@dataclass(slots=True)
+class ChannelInfo:
+    index: int
+    name: str
+    exposure: float | None = None
+    bitdepth: str = "Unknown"
+
+
+@dataclass(slots=True)
+class ImageMetadata:
+    width: int | None = None
+    height: int | None = None
+    num_z: int | None = None
+    num_t: int | None = None
+    num_channels: int | None = None
+    z_step: float | None = None
+    z_start: float | None = None
+    z_end: float | None = None
+    z_depth: float | None = None
+    montage_rows: int | None = None
+    montage_cols: int | None = None
+    tile_overlap: int | None = None
+    montage_source: str = "None"
+    objective_magnification: float | None = None
+    objective_na: float | None = None
+    immersion_type: str | None = None
+    immersion_ri: float | None = None
+    pixel_size_x: float | None = None
+    pixel_size_y: float | None = None
+    channels: list = field(default_factory=list)
+    stage_positions: list = field(default_factory=list)  # [x, y, z] stage µm per field, in acquisition order
+    missing: list = field(default_factory=list)  # optional fields that were absent or unparseable
+
+    def as_dict(self):
+        """The dict layout extract_image_metadata() has always returned (plus montage_source and missing)."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["channels"] = [ChannelInfo(**ch) for ch in data.get("channels", [])]
+        return cls(**data)
+
+
+REQUIRED_FIELDS = ("width", "height", "num_channels")
+
+
+def _typed(value, kind, name, missing, positive=False):
+    """Convert a raw string to kind, recording name in missing instead of raising."""
+    if value is None:
+        missing.append(name)
+        return None
+    try:
+        match = re.match(r"\s*(-?[\d.]+)", value) if kind in (int, float) else None
+        converted = kind(match.group(1) if match else value.strip())
+    except (ValueError, AttributeError):
+        missing.append(name)
+        return None
+    if positive and converted <= 0:
+        missing.append(name)
+        return None
+    return converted
+
+
+def _int(value, name, missing, positive=False):
+    # ints are written as "2048" but occasionally as "2048.0"
+    result = _typed(value, float, name, missing, positive)
+    return int(result) if result is not None else None
 
-    Parameters:
-        filepath (str): Path to the metadata text file.
+
+def extract_montage_layout(tree):
+    """
+    Extracts montage layout information (rows, cols, overlap) from either Edge or Field mode.
 
     Returns:
-        dict: A dictionary containing key metadata fields including image dimensions,
-              Z-stack details, montage layout, pixel size, objective specs, and channel info.
+        dict: Contains rows, cols, overlap, and source mode ("Edge", "Field", or "None").
     """
-    with open(filepath, "r", encoding="utf-8") as f:
-        metadata = f.read()
+    def _layout(section, source):
+        ignored = []
+        return {
+            "rows": _int(section.get("Rows"), "rows", ignored),
+            "cols": _int(section.get("Columns"), "cols", ignored),
+            "overlap": _int(section.get("Overlap"), "overlap", ignored),
+            "source": source,
+        }
+
+    # Edge montage, only when the protocol says it is enabled, valid and in Edge mode
+    protocol = tree.first("MontageProtocolSpecification")
+    if protocol is not None:
+        if (protocol.get("IsMontageEnabled") == "True"
+                and protocol.get("IsValid") == "True"
+                and protocol.get("CurrentMontageMode") == "Edge"):
+            edge = tree.first("EdgeMontageProtocolSpecification")
+            if edge is not None:
+                return _layout(edge, "Edge")
 
-    result = {}
+    # Fallback to Field montage
+    field_section = tree.first("FieldMontageProtocolSpecification")
+    if field_section is not None:
+        return _layout(field_section, "Field")
+
+    return {"rows": None, "cols": None, "overlap": None, "source": "None"}
+
+
+STAGE_KEYS = {
+    "x": ("StageX", "PositionX", "StagePositionX", "XPosition"),
+    "y": ("StageY", "PositionY", "StagePositionY", "YPosition"),
+    "z": ("StageZ", "PositionZ", "StagePositionZ", "ZPosition"),
+}
+# bare X=/Y=/Z= are also used for sizes, offsets and ROIs: they count only in sections named like a stage position
+BARE_STAGE_SECTIONS = ("stage", "position")
+ORDER_KEYS = ("FieldIndex", "FieldNumber", "AcquisitionOrder")
+
+
+def extract_stage_positions(tree):
+    """
+    Per-field stage coordinates: every section holding both an X and a Y stage key (StageX=,
+    PositionX=, ...; bare X=/Y= only in sections named *Stage* or *Position*) is one field.
+    Fields are returned in acquisition order, taken from a FieldIndex/AcquisitionOrder key when
+    present and from document order otherwise.
+
+    Returns:
+        list: [x, y, z] in µm per field (z is None when not recorded).
+    """
+    def _first(section, keys):
+        for key in keys:
+            value = _typed(section.get(key), float, key, [])
+            if value is not None:
+                return value
+        return None
+
+    fields = []
+    for section in tree.sections:
+        if "Width" in section.entries or "ExtMin0" in section.entries:
+            continue  # image size sections use X=/Y= for pixel counts, not positions
+        bare = any(tag in section.name.lower() for tag in BARE_STAGE_SECTIONS)
+        x, y, z = (_first(section, STAGE_KEYS[axis] + ((axis.upper(),) if bare else ())) for axis in "xyz")
+        if x is None or y is None:
+            continue
+        order = _first(section, ORDER_KEYS)
+        fields.append((order if order is not None else len(fields), x, y, z))
+    fields.sort(key=lambda f: f[0])
+    return [[x, y, z] for _, x, y, z in fields]
+
+
+def parse_image_metadata(text):
+    """
+    Build an ImageMetadata from metadata text. Each field is read from the section it belongs to
+    (e.g. the Z range and physical Z size from the section that holds StepSize) rather than from the
+    first match anywhere in the file. Optional fields that are missing end up in .missing.
+
+    Raises:
+        ValueError: if any of REQUIRED_FIELDS is missing.
+    """
+    tree = parse_sections(text)
+    missing = []
+    meta = ImageMetadata(missing=missing)
 
     # --- Basic Dimensions ---
-    result["width"] = int(re.search(r"Width=(\d+)", metadata).group(1))
-    result["height"] = int(re.search(r"Height=(\d+)", metadata).group(1))
-    result["num_z"] = int(re.search(r"NumberOfZPoints=(\d+)", metadata).group(1))
-    result["num_t"] = int(re.search(r"NumberOfTimePoints=(\d+)", metadata).group(1))
-    result["num_channels"] = int(re.search(r"NumberOfChannels=(\d+)", metadata).group(1))
-
-    # --- Z Step and Range ---
-    result["z_step"] = float(re.search(r"StepSize=([\d.]+)", metadata).group(1))
-    result["z_start"] = float(re.search(r"ActualStartPosition=(-?[\d.]+)", metadata).group(1))
-    result["z_end"] = float(re.search(r"ActualEndPosition=(-?[\d.]+)", metadata).group(1))
-    result["z_depth"] = float(re.search(r"Size=([\d.]+)", metadata).group(1))  # Physical Z span
+    dims = tree.find_with_all(["Width", "Height"])
+    meta.width = _int(dims.get("Width") if dims else None, "width", missing, positive=True)
+    meta.height = _int(dims.get("Height") if dims else None, "height", missing, positive=True)
+    for name, key in (("num_z", "NumberOfZPoints"), ("num_t", "NumberOfTimePoints"), ("num_channels", "NumberOfChannels")):
+        section = tree.find_key(key)
+        setattr(meta, name, _int(section.get(key) if section else None, name, missing, positive=True))
 
-    # --- Montage Layout ---
-    def extract_montage_layout(metadata):
-        """
-        Extracts montage layout information (rows, cols, overlap) from either Edge or Field mode.
+    # --- Z Step and Range --- (all from the Z stack section, so Size= can't come from elsewhere)
+    z_section = tree.find_key("StepSize")
+    z_get = z_section.get if z_section else (lambda key: None)
+    meta.z_step = _typed(z_get("StepSize"), float, "z_step", missing)
+    meta.z_start = _typed(z_get("ActualStartPosition"), float, "z_start", missing)
+    meta.z_end = _typed(z_get("ActualEndPosition"), float, "z_end", missing)
+    meta.z_depth = _typed(z_get("Size"), float, "z_depth", missing)  # Physical Z span
 
-        Returns:
-            dict: Contains rows, cols, overlap, and source mode ("Edge", "Field", or "None").
-        """
-        # Try to parse Edge montage mode
-        montage_mode_match = re.search(r"\[MontageProtocolSpecification\](.*?)(?=\n\[|\Z)", metadata, re.DOTALL)
-        if montage_mode_match:
-            montage_block = montage_mode_match.group(1)
-            is_enabled = re.search(r"IsMontageEnabled=True", montage_block)
-            is_valid = re.search(r"IsValid=True", montage_block)
-            current_mode = re.search(r"CurrentMontageMode=Edge", montage_block)
-
-            if all([is_enabled, is_valid, current_mode]):
-                edge_section = re.search(r"\[EdgeMontageProtocolSpecification\](.*?)(?=\n\[|\Z)", metadata, re.DOTALL)
-                if edge_section:
-                    edge_block = edge_section.group(1)
-                    rows = re.search(r"Rows=(\d+)", edge_block)
-                    cols = re.search(r"Columns=(\d+)", edge_block)
-                    overlap = re.search(r"Overlap=(\d+)", edge_block)
-                    return {
-                        "rows": int(rows.group(1)) if rows else None,
-                        "cols": int(cols.group(1)) if cols else None,
-                        "overlap": int(overlap.group(1)) if overlap else None,
-                        "source": "Edge"
-                    }
-
-        # Fallback to Field montage
-        field_section = re.search(r"\[FieldMontageProtocolSpecification\](.*?)(?=\n\[|\Z)", metadata, re.DOTALL)
-        if field_section:
-            field_block = field_section.group(1)
-            rows = re.search(r"Rows=(\d+)", field_block)
-            cols = re.search(r"Columns=(\d+)", field_block)
-            overlap = re.search(r"Overlap=(\d+)", field_block)
-            return {
-                "rows": int(rows.group(1)) if rows else None,
-                "cols": int(cols.group(1)) if cols else None,
-                "overlap": int(overlap.group(1)) if overlap else None,
-                "source": "Field"
-            }
-
-        return {"rows": None, "cols": None, "overlap": None, "source": "None"}
-
-    # Get montage layout info
-    montage_info = extract_montage_layout(metadata)
-    result["montage_rows"] = montage_info["rows"]
-    result["montage_cols"] = montage_info["cols"]
-    result["tile_overlap"] = montage_info["overlap"]
+    # --- Montage Layout ---
+    montage_info = extract_montage_layout(tree)
+    meta.montage_rows = montage_info["rows"]
+    meta.montage_cols = montage_info["cols"]
+    meta.tile_overlap = montage_info["overlap"]
+    meta.montage_source = montage_info["source"]
 
     # --- Objective & Pixel Size ---
-    sensor_pixel_um = float(re.search(r"Pixel Width \(\u00b5m\), Value=([\d.]+)", metadata).group(1))
-    magnification = float(re.search(r"TotalConsolidatedOpticalMagnification, Value=([\d.]+)", metadata).group(1))
+    def _value(key):
+        section = tree.find_key(key)
+        return section.get(key) if section else None
 
-    result["objective_magnification"] = magnification
-    result["objective_na"] = float(re.search(r"ConsolidatedLensNumericalAperture, Value=([\d.]+)", metadata).group(1))
-    result["immersion_type"] = re.search(r"ConsolidatedImmersionType, Value=([\w\s]+)", metadata).group(1).strip()
-    result["immersion_ri"] = float(re.search(r"ConsolidatedImmersionRefractiveIndex, Value=([\d.]+)", metadata).group(1))
+    sensor_pixel_um = _typed(_value("Pixel Width (\u00b5m)"), float, "sensor_pixel_um", missing, positive=True)
+    meta.objective_magnification = _typed(_value("TotalConsolidatedOpticalMagnification"), float, "objective_magnification", missing, positive=True)
+    meta.objective_na = _typed(_value("ConsolidatedLensNumericalAperture"), float, "objective_na", missing)
+    meta.immersion_type = _typed(_value("ConsolidatedImmersionType"), str, "immersion_type", missing)
+    meta.immersion_ri = _typed(_value("ConsolidatedImmersionRefractiveIndex"), float, "immersion_ri", missing)
 
     # Compute effective pixel size after magnification
-    result["pixel_size_x"] = sensor_pixel_um / magnification
-    result["pixel_size_y"] = sensor_pixel_um / magnification
-
-    # --- Channels ---
-    channel_sections = re.findall(r"\[Channel\](.*?)(?=\n\t*\[Channel|\Z)", metadata, re.DOTALL)
-    result["channels"] = []
-
-    for i, channel_block in enumerate(channel_sections, start=1):
-        # Extract channel name
-        name_match = re.search(r"^\s*Name=(.*)$", channel_block, re.MULTILINE)
-        name = name_match.group(1).strip() if name_match else f"Channel {i}"
-
-        # Extract exposure time
-        exposure_match = re.search(r"Exposure Time, Value=([\d.]+)", channel_block)
-        exposure = float(exposure_match.group(1)) if exposure_match else None
-
-        # Extract bit depth
-        bitdepth_match = re.search(r"Bit Depth, Value=([\w\s\-\(\)]+)", channel_block)
-        bitdepth = bitdepth_match.group(1).strip() if bitdepth_match else "Unknown"
-
-        result["channels"].append({
-            "index": i,
-            "name": name,
-            "exposure": exposure,
-            "bitdepth": bitdepth
-        })
-
-    # --- Console Summary Output ---
-    print(f"Image dimensions: {result['width']}×{result['height']}, Z: {result['num_z']}, T: {result['num_t']}, Channels: {result['num_channels']}")
-    print(f"Pixel size: {result['pixel_size_x']:.4f} µm × {result['pixel_size_y']:.4f} µm × {result['z_step']:.4f} µm")
-    print(f"Z range: {result['z_start']} µm to {result['z_end']} µm (total {result['z_depth']} µm)")
-    print(f"Montage layout: {result.get('montage_cols', '?')}×{result.get('montage_rows', '?')}, Tile overlap: {result.get('tile_overlap', '?')}%")
-    for ch in result["channels"]:
-        print(f"Channel {ch['index']}: {ch['name']}, {ch['exposure']} ms, {ch['bitdepth']}")
-    print(f"Objective: {result['objective_magnification']}× NA={result['objective_na']}, {result['immersion_type']} RI={result['immersion_ri']}")
-
-    return result
-
-# Usage example:
-metadata = extract_image_metadata("path_to_metadata.txt")
+    if sensor_pixel_um is not None and meta.objective_magnification is not None:
+        meta.pixel_size_x = sensor_pixel_um / meta.objective_magnification
+        meta.pixel_size_y = sensor_pixel_um / meta.objective_magnification
+    else:
+        missing.extend(["pixel_size_x", "pixel_size_y"])
+
+    # --- Channels --- (a channel owns every section up to the next [Channel])
+    for i, channel_section in enumerate(tree.named("Channel"), start=1):
+        entries = {}
+        for s in tree.span(channel_section, stop_name="Channel"):
+            for key, value in s.entries.items():
+                entries.setdefault(key, value)
+        ignored = []
+        meta.channels.append(ChannelInfo(
+            index=i,
+            name=entries.get("Name") or f"Channel {i}",
+            exposure=_typed(entries.get("Exposure Time"), float, "exposure", ignored),
+            bitdepth=entries.get("Bit Depth") or "Unknown",
+        ))
+
+    # --- Stage positions ---
+    meta.stage_positions = extract_stage_positions(tree)
+    if not meta.stage_positions:
+        missing.append("stage_positions")
+
+    missing_required = [name for name in REQUIRED_FIELDS if name in missing]
+    if missing_required:
+        raise ValueError(f"Metadata is missing required field(s): {', '.join(missing_required)}")
+    return meta
+
+
+def print_metadata_summary(meta):
+    print(f"Image dimensions: {meta.width}×{meta.height}, Z: {meta.num_z}, T: {meta.num_t}, Channels: {meta.num_channels}")
+    if meta.pixel_size_x is not None:
+        print(f"Pixel size: {meta.pixel_size_x:.4f} µm × {meta.pixel_size_y:.4f} µm × {meta.z_step} µm")
+    print(f"Z range: {meta.z_start} µm to {meta.z_end} µm (total {meta.z_depth} µm)")
+    print(f"Montage layout: {meta.montage_cols or '?'}×{meta.montage_rows or '?'}, Tile overlap: {meta.tile_overlap if meta.tile_overlap is not None else '?'}%")
+    for ch in meta.channels:
+        print(f"Channel {ch.index}: {ch.name}, {ch.exposure} ms, {ch.bitdepth}")
+    print(f"Objective: {meta.objective_magnification}× NA={meta.objective_na}, {meta.immersion_type} RI={meta.immersion_ri}")
+    if meta.missing:
+        print(f"Missing/unparseable fields: {', '.join(meta.missing)}")
+
+
+# --- .ims backend ---
+# Every Imaris tile already carries its acquisition metadata as attributes under /DataSetInfo,
+# so no text export is needed. Only attribute groups are read, never image datasets, and the
+# result is cached on disk per file keyed by (schema version, size, mtime), so re-reading a
+# 1000-tile run is mostly cache hits.
+
+IMS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fiji-friends", "ims_metadata")
+IMS_CACHE_SCHEMA = 2  # part of the cache key; bump when ImageMetadata gains or changes fields
+_ims_memo = {}  # abspath -> ((schema, size, mtime_ns), ImageMetadata), for repeat calls in one process
+
+
+def _attr_str(value):
+    """Imaris writes attributes as arrays of single chars; join them back into a str."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if getattr(value, "dtype", None) is not None and value.dtype.kind == "S":
+        return b"".join(value.ravel().tolist()).decode("utf-8", "replace")
+    return str(value)
+
+
+def read_ims_attributes(filepath):
+    """
+    Read every attribute group under /DataSetInfo without touching any dataset.
+
+    Returns:
+        dict: group name relative to /DataSetInfo (e.g. "Image", "Channel 0", "TimeInfo") -> {attribute: str}
+    """
+    if h5py is None:
+        raise RuntimeError("Reading .ims metadata needs h5py, pip install h5py")
+    groups = {}
+    with h5py.File(filepath, "r") as f:
+        info = f.get("DataSetInfo")
+        if info is None:
+            return groups
+
+        def _visit(name, obj):
+            if isinstance(obj, h5py.Group):
+                groups[name] = {key: _attr_str(obj.attrs[key]) for key in obj.attrs}
+
+        info.visititems(_visit)
+    return groups
+
+
+def ims_metadata_from_attributes(groups):
+    """
+    Build an ImageMetadata from /DataSetInfo attribute groups. If the acquisition software stored
+    the full text protocol in an attribute it is parsed like an exported metadata file; otherwise
+    the standard Imaris Image/Channel/TimeInfo attributes are used.
+    """
+    for attrs in groups.values():
+        for value in attrs.values():
+            if "StepSize=" in value and "[" in value:
+                try:
+                    return parse_image_metadata(value)
+                except ValueError:
+                    break
+
+    missing = []
+    ignored = []
+    meta = ImageMetadata(missing=missing)
+    image = groups.get("Image", {})
+
+    meta.width = _int(image.get("X"), "width", missing, positive=True)
+    meta.height = _int(image.get("Y"), "height", missing, positive=True)
+    meta.num_z = _int(image.get("Z"), "num_z", missing, positive=True)
+    time_info = groups.get("TimeInfo", {})
+    meta.num_t = _int(time_info.get("DatasetTimePoints") or time_info.get("FileTimePoints"), "num_t", missing, positive=True)
+
+    ext = {key: _typed(image.get(key), float, key, ignored) for key in ("ExtMin0", "ExtMin1", "ExtMin2", "ExtMax0", "ExtMax1", "ExtMax2")}
+    if meta.width and ext["ExtMin0"] is not None and ext["ExtMax0"] is not None:
+        meta.pixel_size_x = (ext["ExtMax0"] - ext["ExtMin0"]) / meta.width
+    else:
+        missing.append("pixel_size_x")
+    if meta.height and ext["ExtMin1"] is not None and ext["ExtMax1"] is not None:
+        meta.pixel_size_y = (ext["ExtMax1"] - ext["ExtMin1"]) / meta.height
+    else:
+        missing.append("pixel_size_y")
+    if meta.num_z and ext["ExtMin2"] is not None and ext["ExtMax2"] is not None:
+        meta.z_start = ext["ExtMin2"]
+        meta.z_end = ext["ExtMax2"]
+        meta.z_depth = ext["ExtMax2"] - ext["ExtMin2"]
+        meta.z_step = meta.z_depth / meta.num_z
+    else:
+        missing.extend(["z_step", "z_start", "z_end", "z_depth"])
+
+    missing.extend(["montage_rows", "montage_cols", "tile_overlap"])  # per-tile files don't know the grid
+
+    # A tile's extents are in stage coordinates, so its minimum corner is its stage position
+    if ext["ExtMin0"] is not None and ext["ExtMin1"] is not None:
+        meta.stage_positions = [[ext["ExtMin0"], ext["ExtMin1"], ext["ExtMin2"]]]
+    else:
+        missing.append("stage_positions")
+
+    channel_groups = sorted(
+        (int(m.group(1)), attrs)
+        for name, attrs in groups.items()
+        for m in [re.fullmatch(r"Channel (\d+)", name)] if m
+    )
+    for number, attrs in channel_groups:
+        meta.channels.append(ChannelInfo(
+            index=number + 1,
+            name=attrs.get("Name") or f"Channel {number + 1}",
+            exposure=_typed(attrs.get("ExposureTime") or attrs.get("Exposure Time"), float, "exposure", ignored),
+            bitdepth=attrs.get("BitDepth") or "Unknown",
+        ))
+    meta.num_channels = len(meta.channels) or _int(image.get("Noc"), "num_channels", missing, positive=True)
+
+    first_channel = channel_groups[0][1] if channel_groups else {}
+    meta.objective_magnification = _typed(image.get("LensPower") or first_channel.get("LensPower"), float, "objective_magnification", missing, positive=True)
+    meta.objective_na = _typed(image.get("NumericalAperture") or first_channel.get("NumericalAperture"), float, "objective_na", missing)
+    meta.immersion_type = _typed(image.get("ImmersionType"), str, "immersion_type", missing)
+    meta.immersion_ri = _typed(image.get("RefractionIndexImmersion") or first_channel.get("RefractionIndexImmersion"), float, "immersion_ri", missing)
+
+    missing_required = [name for name in REQUIRED_FIELDS if name in missing]
+    if missing_required:
+        raise ValueError(f"DataSetInfo is missing required field(s): {', '.join(missing_required)}")
+    return meta
+
+
+def _ims_cache_file(filepath):
+    return os.path.join(IMS_CACHE_DIR, hashlib.sha1(filepath.encode("utf-8")).hexdigest() + ".json")
+
+
+def extract_ims_metadata(filepath, use_cache=True):
+    """
+    ImageMetadata for one .ims tile, from its attributes, cached per file on (schema, size, mtime);
+    entries written by an older schema are re-parsed.
+
+    Parameters:
+        filepath (str): Path to the .ims file.
+        use_cache (bool): Read and write the on-disk cache in IMS_CACHE_DIR.
+    """
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    key = [IMS_CACHE_SCHEMA, stat.st_size, stat.st_mtime_ns]
+
+    memo = _ims_memo.get(filepath)
+    if memo is not None and memo[0] == key:
+        return memo[1]
+
+    cache_file = _ims_cache_file(filepath)
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                meta = ImageMetadata.from_dict(cached["metadata"])
+                _ims_memo[filepath] = (key, meta)
+                return meta
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # stale or half-written cache entry, re-read the file
+
+    meta = ims_metadata_from_attributes(read_ims_attributes(filepath))
+    _ims_memo[filepath] = (key, meta)
+
+    if use_cache:
+        os.makedirs(IMS_CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"path": filepath, "key": key, "metadata": meta.as_dict()}, f)
+        os.replace(tmp_file, cache_file)
+    return meta
+
+
+def extract_image_metadata(filepath, verbose=True):
+    """
+    Extracts imaging metadata from a plain-text metadata file, or from the
+    /DataSetInfo attributes of an .ims tile.
+
+    Parameters:
+        filepath (str): Path to the metadata text file or .ims file.
+        verbose (bool): Print a console summary.
+
+    Returns:
+        dict: A dictionary containing key metadata fields including image dimensions,
+              Z-stack details, montage layout, pixel size, objective specs, and channel info.
+              Fields that could not be found are None and listed under "missing".
+    """
+    if filepath.lower().endswith(".ims"):
+        meta = extract_ims_metadata(filepath)
+    else:
+        with open(filepath, "r", encoding="utf-8") as f:
+            metadata = f.read()
+        meta = parse_image_metadata(metadata)
+
+    if verbose:
+        print_metadata_summary(meta)
+    return meta.as_dict()
+
+
+def _folder_worker(path):
+    try:
+        return os.path.basename(path), extract_image_metadata(path, verbose=False), None
+    except Exception as e:
+        return os.path.basename(path), None, f"{type(e).__name__}: {e}"
+
+
+def extract_folder_metadata(folder, workers=None):
+    """
+    Metadata for every .ims tile in folder, read in a process pool
+    (h5py serializes calls within a process, so threads would not overlap the file opens).
+
+    Returns:
+        dict: tile filename -> result dict (same layout as extract_image_metadata).
+    """
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(".ims"))
+    t0 = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name, result, error in pool.map(_folder_worker, paths, chunksize=16):
+            if error:
+                print(f"[METADATA FAILED] {name} - {error}")
+            else:
+                results[name] = result
+    print(f"Read metadata for {len(results)}/{len(paths)} tile(s) in {time.perf_counter() - t0:.1f} s")
+    return results
+
+
+# --- Tile layout ---
+# A vectorized table of where every field really sits, so the live preview and the stitching
+# setup don't have to assume an ideal snake grid.
+
+TILE_LAYOUT_DTYPE = np.dtype([
+    ("field", "i4"),         # acquisition order
+    ("row", "i4"),
+    ("col", "i4"),
+    ("stage_x_um", "f8"),
+    ("stage_y_um", "f8"),
+    ("stage_z_um", "f8"),
+    ("px_x", "f8"),          # pixel offset from the top-left-most tile
+    ("px_y", "f8"),
+    ("overlap_left", "f4"),  # fraction of the tile shared with each neighbor, NaN if none
+    ("overlap_right", "f4"),
+    ("overlap_up", "f4"),
+    ("overlap_down", "f4"),
+])
+
+
+def _grid_index(coords, gap):
+    """Cluster 1D stage coordinates into grid indices: a jump larger than gap starts a new row/column."""
+    order = np.argsort(coords, kind="stable")
+    steps = np.concatenate([[0], np.cumsum(np.diff(coords[order]) > gap)])
+    index = np.empty(len(coords), dtype=np.int32)
+    index[order] = steps
+    return index
+
+
+def build_tile_layout(stage_positions, tile_width, tile_height, pixel_size_x, pixel_size_y=None, field_index=None):
+    """
+    Build the tile layout table from per-field stage positions.
+
+    Parameters:
+        stage_positions (array-like): (N, 2) or (N, 3) stage x, y[, z] in µm.
+        tile_width, tile_height (int): tile size in pixels.
+        pixel_size_x, pixel_size_y (float): µm per pixel (y defaults to x).
+        field_index (array-like): acquisition order per field (default 0..N-1).
+
+    Returns:
+        np.ndarray: structured array with TILE_LAYOUT_DTYPE, one row per field, in acquisition order.
+    """
+    pixel_size_y = pixel_size_y or pixel_size_x
+    positions = np.asarray(stage_positions, dtype=np.float64)
+    n = len(positions)
+    layout = np.zeros(n, dtype=TILE_LAYOUT_DTYPE)
+    if n == 0:
+        return layout
+
+    x, y = positions[:, 0], positions[:, 1]
+    z = positions[:, 2] if positions.shape[1] > 2 else np.full(n, np.nan)
+    tile_w_um = tile_width * pixel_size_x
+    tile_h_um = tile_height * pixel_size_y
+
+    layout["field"] = np.arange(n) if field_index is None else np.asarray(field_index)
+    layout["stage_x_um"], layout["stage_y_um"] = x, y
+    layout["stage_z_um"] = z
+    layout["px_x"] = (x - x.min()) / pixel_size_x
+    layout["px_y"] = (y - y.min()) / pixel_size_y
+    # neighbours are at least a quarter tile apart unless overlap is above 75%
+    layout["col"] = _grid_index(x, tile_w_um / 4)
+    layout["row"] = _grid_index(y, tile_h_um / 4)
+
+    grid = np.full((layout["row"].max() + 1, layout["col"].max() + 1), -1, dtype=np.int64)
+    grid[layout["row"], layout["col"]] = np.arange(n)
+
+    def _neighbour_overlap(d_row, d_col, axis_values, tile_um):
+        rows, cols = layout["row"] + d_row, layout["col"] + d_col
+        inside = (rows >= 0) & (rows < grid.shape[0]) & (cols >= 0) & (cols < grid.shape[1])
+        neighbour = np.full(n, -1, dtype=np.int64)
+        neighbour[inside] = grid[rows[inside], cols[inside]]
+        has = neighbour >= 0
+        overlap = np.full(n, np.nan, dtype=np.float32)
+        distance = np.abs(axis_values[neighbour[has]] - axis_values[has])
+        overlap[has] = np.clip((tile_um - distance) / tile_um, 0, 1)
+        return overlap
+
+    layout["overlap_left"] = _neighbour_overlap(0, -1, x, tile_w_um)
+    layout["overlap_right"] = _neighbour_overlap(0, 1, x, tile_w_um)
+    layout["overlap_up"] = _neighbour_overlap(-1, 0, y, tile_h_um)
+    layout["overlap_down"] = _neighbour_overlap(1, 0, y, tile_h_um)
+    return layout[np.argsort(layout["field"], kind="stable")]
+
+
+def extract_tile_layout(source, workers=None):
+    """
+    Tile layout from either an exported metadata text file (per-field stage positions)
+    or a folder of *_F<n>.ims tiles (each tile's stage position, field index from the filename).
+
+    Returns:
+        np.ndarray: structured array with TILE_LAYOUT_DTYPE (see build_tile_layout).
+    """
+    if os.path.isdir(source):
+        per_tile = extract_folder_metadata(source, workers)
+        names = [name for name in per_tile if per_tile[name]["stage_positions"]]
+        field_index = []
+        for i, name in enumerate(names):
+            match = re.search(r"_F(\d+)\.ims$", name)
+            field_index.append(int(match.group(1)) if match else i)
+        positions = [per_tile[name]["stage_positions"][0] for name in names]
+        positions = [[x, y, np.nan if z is None else z] for x, y, z in positions]
+        first = per_tile[names[0]] if names else {}
+    else:
+        first = extract_image_metadata(source, verbose=False)
+        positions = [[x, y, np.nan if z is None else z] for x, y, z in first["stage_positions"]]
+        field_index = None
+
+    if not positions:
+        raise ValueError(f"No stage positions found in {source}")
+    return build_tile_layout(positions, first["width"], first["height"],
+                             first["pixel_size_x"], first["pixel_size_y"], field_index)
+
+
+if __name__ == "__main__":
+    # Usage example:
+    metadata = extract_image_metadata(sys.argv[1] if len(sys.argv) > 1 else "path_to_metadata.txt")
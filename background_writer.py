@@ -0,0 +1,176 @@
+# Background image writer for the Fiji (Jython) scripts.
+#
+# FileSaver.saveAsPng / saveAsJpeg / IJ.saveAs block the script until the image is encoded and
+# on disk (often a network share), so the next ROI or file waits for every save. BackgroundWriter
+# hands finished ImagePlus snapshots to a small java.util.concurrent thread pool instead:
+#
+#   writer = BackgroundWriter()
+#   writer.save(montage, [png_path, jpg_path])      # returns as soon as the job is queued
+#   ...
+#   writer.finish()                                 # waits for the queue, prints any failures
+#
+# The queue is bounded: when it is full the calling thread writes the job itself, so a slow disk
+# slows the loop down instead of piling up images in memory.
+#
+# Several paths for one image share the work: an RGB/8-bit single plane is rendered to a
+# BufferedImage once and every PNG/JPEG is encoded from that. TIFFs (and anything else) go through
+# FileSaver as before. A script that saves a single image (the screening scripts) calls
+# write_image(imp, paths) directly: there is nothing to overlap with, only the shared render.
+#
+# NB: Fiji only; the script's folder must be on sys.path (see the import in cell_montages.py).
+
+import os
+
+from ij import ImagePlus, CompositeImage
+from ij.io import FileSaver
+from java.io import File
+from java.lang import Runnable
+from java.util.concurrent import ThreadPoolExecutor, ArrayBlockingQueue, ConcurrentLinkedQueue, TimeUnit
+from javax.imageio import ImageIO, ImageWriteParam, IIOImage
+
+DEFAULT_THREADS = 2
+DEFAULT_QUEUE_SIZE = 8  # images waiting to be written, per writer
+
+
+def snapshot(imp):
+    """
+    A copy of imp that later edits of imp can't touch: pixels, dimensions, calibration, overlay and
+    how it is displayed (composite mode, channel LUTs and display ranges), so it saves like imp would.
+    """
+    copy = ImagePlus(imp.getTitle(), imp.getStack().duplicate())
+    copy.setDimensions(imp.getNChannels(), imp.getNSlices(), imp.getNFrames())
+    copy.setCalibration(imp.getCalibration())
+    if imp.isComposite():
+        copy = CompositeImage(copy, imp.getMode())
+        for c, lut in enumerate(imp.getLuts()):
+            copy.setChannelLut(lut, c + 1)
+            copy.setPositionWithoutUpdate(c + 1, 1, 1)
+            copy.setDisplayRange(lut.min, lut.max)
+    elif imp.getBitDepth() != 24:  # an RGB display range would be applied to the pixels
+        copy.setLut(imp.getProcessor().getLut())
+        copy.setDisplayRange(imp.getDisplayRangeMin(), imp.getDisplayRangeMax())
+    copy.setPositionWithoutUpdate(imp.getC(), imp.getZ(), imp.getT())
+    if imp.getOverlay() is not None:
+        copy.setOverlay(imp.getOverlay().duplicate())
+    return copy
+
+
+def _extension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def write_jpeg(image, path, quality):
+    """Encode a BufferedImage as JPEG at quality (0-100, as FileSaver.getJpegQuality())."""
+    writer = ImageIO.getImageWritersByFormatName("jpeg").next()
+    param = writer.getDefaultWriteParam()
+    param.setCompressionMode(ImageWriteParam.MODE_EXPLICIT)
+    param.setCompressionQuality(quality / 100.0)
+    output = ImageIO.createImageOutputStream(File(path))
+    try:
+        writer.setOutput(output)
+        writer.write(None, IIOImage(image, None, None), param)
+    finally:
+        output.close()
+        writer.dispose()
+
+
+def write_image(imp, paths):
+    """
+    Write imp to every path, the format taken from the extension (.png, .jpg/.jpeg, .tif/.tiff).
+
+    Parameters:
+    - imp (ImagePlus): The image (or snapshot) to write.
+    - paths (list): Output paths.
+    """
+    shared = None
+    single_plane = imp.getStackSize() == 1 and imp.getBitDepth() in (8, 24)
+    for path in paths:
+        ext = _extension(path)
+        if ext in (".png", ".jpg", ".jpeg") and single_plane:
+            if shared is None:
+                # render once (overlay burned in, as FileSaver does) and encode every format from it
+                flat = imp.flatten() if imp.getOverlay() is not None else imp
+                shared = flat.getBufferedImage()
+            if ext == ".png":
+                ok = ImageIO.write(shared, "png", File(path))
+            else:
+                write_jpeg(shared, path, FileSaver.getJpegQuality())
+                ok = True
+        elif ext in (".tif", ".tiff"):
+            saver = FileSaver(imp)
+            ok = saver.saveAsTiffStack(path) if imp.getStackSize() > 1 else saver.saveAsTiff(path)
+        elif ext == ".png":
+            ok = FileSaver(imp).saveAsPng(path)
+        elif ext in (".jpg", ".jpeg"):
+            ok = FileSaver(imp).saveAsJpeg(path)
+        else:
+            raise ValueError("Unsupported output format: {}".format(path))
+        if not ok:
+            raise IOError("Could not write {}".format(path))
+
+
+class _WriteJob(Runnable):
+
+    def __init__(self, writer, imp, paths, close):
+        self.writer = writer
+        self.imp = imp
+        self.paths = paths
+        self.close = close
+
+    def run(self):
+        try:
+            write_image(self.imp, self.paths)
+            self.writer._done(self.paths)
+        except Exception as e:
+            self.writer.errors.add("{}: {}".format(", ".join(self.paths), e))
+        finally:
+            if self.close:
+                self.imp.flush()
+
+
+class BackgroundWriter(object):
+    """Bounded thread pool that encodes and writes ImagePlus snapshots while the main loop continues."""
+
+    def __init__(self, threads=DEFAULT_THREADS, queue_size=DEFAULT_QUEUE_SIZE, verbose=True):
+        self.verbose = verbose
+        self.errors = ConcurrentLinkedQueue()
+        self.written = ConcurrentLinkedQueue()
+        self._pool = ThreadPoolExecutor(threads, threads, 0, TimeUnit.MILLISECONDS,
+                                        ArrayBlockingQueue(queue_size), ThreadPoolExecutor.CallerRunsPolicy())
+
+    def save(self, imp, paths, copy=True):
+        """
+        Queue imp to be written to paths (a path or a list of paths).
+
+        Parameters:
+        - imp (ImagePlus): The finished image.
+        - paths (str or list): Output path(s); one render is shared by all PNG/JPEG paths.
+        - copy (bool): Snapshot imp first. Pass False when imp is not touched again (it is
+          flushed once written, so don't close it yourself).
+        """
+        if isinstance(paths, basestring):
+            paths = [paths]
+        job = _WriteJob(self, snapshot(imp) if copy else imp, list(paths), not copy)
+        self._pool.execute(job)
+
+    def _done(self, paths):
+        for path in paths:
+            self.written.add(path)
+            if self.verbose:
+                print("Saved{}".format(path))
+
+    def finish(self):
+        """
+        Wait for every queued image, then report failures.
+
+        Returns:
+        list: One message per failed job (empty when everything was written).
+        """
+        self._pool.shutdown()
+        while not self._pool.awaitTermination(1, TimeUnit.SECONDS):
+            pass
+        errors = list(self.errors)
+        print("Background writer: {} file(s) written, {} failed".format(self.written.size(), len(errors)))
+        for error in errors:
+            print("[WRITE FAILED] {}".format(error))
+        return errors
@@ -2,6 +2,10 @@
 # This creates a grayscale montage of each ROI with labels on each panel,
 # and saves it as a .png file. It saves an overview image with all channels and a montage of each individual channel.
 # the png image is a single frame from the center of the stack, ish. it's pretty ugly whoopsies.
+# ROIs are cropped and montaged straight from the ImagePlus (processROIsDirect), no windows are opened,
+# so it also runs headless on the cluster: fill in the HEADLESS CONFIGURATION block and run
+#   ImageJ-linux64 --headless --console --run cell_montages.py
+# With crop_from_disk the image is never loaded whole: only each ROI's box and slices are read (processROIsFromDisk).
 
 from ij import IJ, WindowManager
 #from ij import ImagePlus, StackConverter
@@ -14,8 +18,6 @@ from datetime import datetime
 from ij.gui import Overlay, TextRoi, Roi, GenericDialog
 from java.awt import Font, Color, FontMetrics
 
-#stuff for saving
-from ij.io import FileSaver
 import os
 
 # in fiji the dialog is nice because i otherwise hardcode everyhting
@@ -23,6 +25,52 @@ import os
 from ij import IJ, WindowManager
 from ij.gui import GenericDialog
 
+# stuff for the window-free path
+import time
+from ij import ImagePlus, ImageStack
+from ij.plugin import Duplicator, MontageMaker
+from ij.process import ImageProcessor
+from ij.io import RoiDecoder
+from java.awt import GraphicsEnvironment
+from java.io import FileInputStream, ByteArrayOutputStream
+from java.util.zip import ZipInputStream
+from jarray import zeros
+
+# montage_labels.py (label glyph cache) and background_writer.py (background saves) sit next to this
+# script. Fiji only defines __file__ for some ways of running a script (not from the script editor or
+# the Plugins menu), so set fiji_friends_dir to this repo's folder if they aren't found.
+fiji_friends_dir = r""
+
+for _folder in (fiji_friends_dir,
+                os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else "",
+                os.path.dirname(os.path.abspath(sys.argv[0])) if sys.argv and sys.argv[0] else ""):
+    if _folder and os.path.isfile(os.path.join(_folder, "montage_labels.py")) and _folder not in sys.path:
+        sys.path.append(_folder)
+try:
+    from montage_labels import shared_cache
+    from background_writer import BackgroundWriter
+except ImportError:
+    raise ImportError("montage_labels.py / background_writer.py not found: set fiji_friends_dir to this repo's folder")
+
+# stuff for reading ROI regions straight from disk (Bio-Formats, ships with Fiji)
+from loci.formats import ChannelSeparator
+from loci.plugins.util import ImageProcessorReader, LociPrefs
+
+# === HEADLESS CONFIGURATION ===
+# Used when Fiji runs without a display (no dialogs, no open image, no ROI manager), e.g.
+#   ImageJ-linux64 --headless --console --run cell_montages.py
+headless_image_path = r""  # the MIP / single-z image to montage
+headless_roi_set = r""  # RoiSet zip drawn on that image
+headless_channels = []  # channel names in order; "C1", "C2", ... if empty
+headless_sample_id = ""  # used in the output names; the image name if empty
+headless_downsampling_scale = 0.8
+headless_montage_rows = 1
+headless_pixel_adjust = 3
+headless_slice_range = 4
+crop_from_disk = True  # headless: read only each ROI's bounding box and slices with Bio-Formats, never the whole image
+use_window_manager = False  # True: the original IJ.run("Duplicate...") / "Make Montage..." path (GUI only)
+# ===========================
+
 # Function to create and show the dialog
 def showParametersDialog(image):
     """
@@ -188,9 +236,8 @@ def get_max_text_height(font_size):
     Returns:
     int: The maximum height of the text bounding box for the given font size.
     """
-    temp_roi = TextRoi(0, 0, "Sample Text", Font("SansSerif", Font.PLAIN, font_size))
-    temp_roi.setStrokeColor(Color(0, 0, 0, 0))
-    return temp_roi.getBounds().height
+    # measured once per size by the shared label cache instead of a throwaway TextRoi per ROI
+    return shared_cache().text_height(font_size)
 
 def define_widths(montage_file, montage_col, montage_row, offset,  annotation_font_size_percentage):
     """
@@ -212,8 +259,8 @@ def define_widths(montage_file, montage_col, montage_row, offset,  annotation_fo
     - Calculated font size and maximum text height for annotations.
     """
     # get the deets
-    montage_width = IJ.getImage().getWidth()
-    montage_height = IJ.getImage().getHeight()
+    montage_width = montage_file.getWidth()
+    montage_height = montage_file.getHeight()
     # figure out each individual space
     single_img_width = montage_width/montage_col
     single_img_height = montage_height/montage_row
@@ -336,6 +383,7 @@ def processROIs(image, sample_id,
     name = image.getTitle()  # Placeholder for later use
 
     default_n_chans = image.getNChannels() if image else 4
+    writer = BackgroundWriter()
 
     for i in range(0, roi_manager.getCount()):
     #for i in range(24, 29):
@@ -363,8 +411,7 @@ def processROIs(image, sample_id,
           #    "Duplicate...", "duplicate channels=1-" + str(n_chans) + " slices=" + str(start_slice) + "-" + str(end_slice))
         # # save the z stepped as a tiff to return back to this easily
         save_as_tiff = "{}/{}_{}_{}_{}".format(tiff_folder, sample_id, roi_id, z_pos_id, name)        
-        IJ.saveAs("Tiff", save_as_tiff)
-        print("Saved{}".format(save_as_tiff))
+        writer.save(IJ.getImage(), tiff_path(save_as_tiff))
         
         imp = IJ.getImage() # how does this shit work. what is an instance.
         # trim to get only the middle slice
@@ -390,13 +437,281 @@ def processROIs(image, sample_id,
         add_overlays(montage, overlay, channels, coordinates, font_size)
         
         save_as_png = "{}/{}_{}_{}_{}.png".format(png_folder, sample_id, roi_id, z_pos_id, name)        
-        FileSaver(montage).saveAsPng(save_as_png)
-        print("Saved{}".format(save_as_png))
+        writer.save(montage, save_as_png)
         imp.close()
         montage.close()
+    writer.finish()
     print("completed all rois!")
         
 
+def is_headless():
+    """True when Fiji runs without a display (--headless or no X server)."""
+    return GraphicsEnvironment.isHeadless()
+
+def load_roi_set(roi_zip_path):
+    """
+    Read every ROI from a RoiSet zip without going through the ROI Manager.
+
+    Parameters:
+    - roi_zip_path (str): Path to the RoiSet .zip (or a single .roi file).
+
+    Returns:
+    list: The Roi objects, in the order they were saved.
+    """
+    if roi_zip_path.lower().endswith(".roi"):
+        return [RoiDecoder(roi_zip_path).getRoi()]
+    rois = []
+    zin = ZipInputStream(FileInputStream(roi_zip_path))
+    buf = zeros(8192, "b")
+    try:
+        entry = zin.getNextEntry()
+        while entry is not None:
+            name = entry.getName()
+            if name.endswith(".roi"):
+                out = ByteArrayOutputStream()
+                n = zin.read(buf)
+                while n > 0:
+                    out.write(buf, 0, n)
+                    n = zin.read(buf)
+                roi = RoiDecoder(out.toByteArray(), name).getRoi()
+                if roi is not None:
+                    roi.setName(name[:-4])
+                    rois.append(roi)
+            entry = zin.getNextEntry()
+    finally:
+        zin.close()
+    return rois
+
+def roi_z_position(roi, n_chans, default_z=1):
+    """1-based Z slice a ROI was drawn on (default_z if the ROI has no position)."""
+    if roi.hasHyperStackPosition() and roi.getZPosition() > 0:
+        return roi.getZPosition()
+    if roi.getPosition() > 0:
+        # plain stack index, channels interleaved (CZT order)
+        return (roi.getPosition() - 1) // n_chans + 1
+    return default_z
+
+def scale_stack(imp, factor):
+    """Every slice scaled by an integer factor with no interpolation, like Size... interpolation=None."""
+    stack = imp.getStack()
+    width, height = int(imp.getWidth() * factor), int(imp.getHeight() * factor)
+    scaled = ImageStack(width, height)
+    for s in range(1, stack.getSize() + 1):
+        ip = stack.getProcessor(s)
+        ip.setInterpolationMethod(ImageProcessor.NONE)
+        scaled.addSlice(stack.getSliceLabel(s), ip.resize(width, height))
+    return ImagePlus(imp.getTitle(), scaled)
+
+def tiff_path(path):
+    return path if path.lower().endswith((".tif", ".tiff")) else path + ".tif"
+
+def processROIsDirect(image, sample_id, rois, n_chans, channels,
+                      tiff_folder, png_folder,
+                      montage_cols,
+                      montage_rows,
+                      downsampling_scale,
+                      pixel_adjust,
+                      slice_range=1):
+    """
+    Same outputs as processROIs, but working on the ImagePlus/ImageStack objects directly:
+    no IJ.selectWindow/IJ.run, no ROI Manager selection and no windows, so it runs under --headless.
+
+    Parameters:
+    - image (ImagePlus): The multi-channel image the ROIs were drawn on.
+    - sample_id (str): Prefix for the output file names.
+    - rois (list): Roi objects (RoiManager.getRoisAsArray() or load_roi_set()).
+    - n_chans (int): The number of channels.
+    - channels (list): Channel names used as panel labels.
+    - tiff_folder (str): The folder to save TIFF crops.
+    - png_folder (str): The folder to save PNG montages.
+    - montage_cols (int): Number of columns in the montage.
+    - montage_rows (int): Number of rows in the montage.
+    - downsampling_scale (float): Downsampling scale.
+    - pixel_adjust (float): Upscaling applied to the crop before montaging.
+    - slice_range (int): Slices kept above and below the ROI's slice.
+
+    Returns:
+    int: Number of ROIs processed.
+    """
+    name = image.getTitle()
+    n_slices = image.getNSlices()
+    duplicator = Duplicator()
+    writer = BackgroundWriter()
+    start_time = time.time()
+    skipped = []
+
+    for i, roi in enumerate(rois):
+        # Duplicator clips a ROI that crosses the edge, but one entirely outside has nothing to crop
+        bounds = roi.getBounds()
+        if (min(bounds.x + bounds.width, image.getWidth()) <= max(0, bounds.x) or
+                min(bounds.y + bounds.height, image.getHeight()) <= max(0, bounds.y)):
+            skipped.append(i)
+            print("[SKIPPED] ROI {} ({}) lies outside the image".format(i, roi.getName()))
+            continue
+        current_slice = roi_z_position(roi, n_chans, image.getZ())
+        start_slice = max(1, current_slice - slice_range)
+        end_slice = min(n_slices, current_slice + slice_range)
+
+        # crop the ROI bounds over all channels and the slice range
+        image.setRoi(roi, False)
+        crop = duplicator.run(image, 1, n_chans, start_slice, end_slice, 1, 1)
+        montage_crop(crop, "{}_ROI-{}_Zpos-{}_{}".format(sample_id, i, current_slice, name), n_chans, channels,
+                     tiff_folder, png_folder, montage_cols, montage_rows, downsampling_scale, pixel_adjust, writer)
+
+    image.deleteRoi()
+    writer.finish()
+    report_rate(len(rois) - len(skipped), start_time)
+    if skipped:
+        print("{} ROI(s) outside the image skipped: {}".format(len(skipped), skipped))
+    return len(rois) - len(skipped)
+
+def montage_crop(crop, out_name, n_chans, channels, tiff_folder, png_folder,
+                 montage_cols, montage_rows, downsampling_scale, pixel_adjust, writer):
+    """
+    Save one ROI crop as a TIFF, then montage its middle slice in memory, burn in the labels and save it as a PNG.
+
+    Parameters:
+    - crop (ImagePlus): Channels x slices of one ROI's bounding box.
+    - out_name (str): File name (without folder) for both outputs.
+    - writer (BackgroundWriter): Takes over crop and the montage; both are written in the background.
+    """
+    save_as_tiff = tiff_path("{}/{}".format(tiff_folder, out_name))
+
+    # only the middle slice, as a plain stack of channels
+    center_slice = int(crop.getNSlices() / 2 + 1)
+    center = Duplicator().run(crop, 1, n_chans, center_slice, center_slice, 1, 1)
+    center = ImagePlus(center.getTitle(), center.getStack())
+
+    # Resize to have enough pixels to write on, then montage in memory
+    center = scale_stack(center, pixel_adjust)
+    montage = MontageMaker().makeMontage2(center, montage_cols, montage_rows, downsampling_scale,
+                                          1, center.getStackSize(), 1, 6, False)
+
+    single_img_height, single_img_width, row_offset, col_offset, font_size = define_widths(montage, montage_cols, montage_rows, .03, None)
+    coordinates = generate_coordinates(montage_cols, montage_rows, single_img_width, single_img_height, row_offset, col_offset)
+    shared_cache().burn_labels(montage, channels, coordinates, font_size)
+
+    # neither image is used again, so the writer gets them without a copy
+    writer.save(crop, save_as_tiff, copy=False)
+    writer.save(montage, "{}/{}.png".format(png_folder, out_name), copy=False)
+
+def report_rate(n_rois, start_time):
+    elapsed = time.time() - start_time
+    print("completed all rois! {} ROIs in {:.1f} s ({:.2f} ROIs/sec), {}".format(
+        n_rois, elapsed, n_rois / elapsed if elapsed > 0 else 0.0, shared_cache().stats()))
+
+def open_region_reader(image_path):
+    """Bio-Formats reader for image_path; only the metadata is read here, pixels on demand."""
+    reader = ImageProcessorReader(ChannelSeparator(LociPrefs.makeImageReader()))
+    reader.setId(image_path)
+    return reader
+
+def read_roi_region(reader, roi, n_chans, start_slice, end_slice, title):
+    """
+    Read only a ROI's bounding box, channels 1..n_chans and slices start_slice..end_slice (1-based)
+    from disk, plane by plane.
+
+    Returns:
+    ImagePlus: A channels x slices hyperstack of the region, or None if the ROI lies entirely outside the image.
+    """
+    bounds = roi.getBounds()
+    x, y = max(0, bounds.x), max(0, bounds.y)
+    width = min(bounds.x + bounds.width, reader.getSizeX()) - x
+    height = min(bounds.y + bounds.height, reader.getSizeY()) - y
+    if width <= 0 or height <= 0:
+        return None
+    stack = ImageStack(width, height)
+    for z in range(start_slice, end_slice + 1):
+        for c in range(n_chans):
+            index = reader.getIndex(z - 1, c, 0)
+            stack.addSlice("c:{}/{} z:{}".format(c + 1, n_chans, z), reader.openProcessors(index, x, y, width, height)[0])
+    region = ImagePlus(title, stack)
+    region.setDimensions(n_chans, end_slice - start_slice + 1, 1)
+    return region
+
+def processROIsFromDisk(image_path, sample_id, rois, channels,
+                        tiff_folder, png_folder,
+                        montage_cols,
+                        montage_rows,
+                        downsampling_scale,
+                        pixel_adjust,
+                        slice_range=1):
+    """
+    Same outputs as processROIsDirect, but the image is never opened as a whole: each ROI's
+    bounding box and slice range is read from disk with Bio-Formats, so memory scales with the
+    ROI size instead of the image size.
+
+    Parameters:
+    - image_path (str): The multi-channel image file the ROIs were drawn on.
+    - rois (list): Roi objects, e.g. from load_roi_set().
+    Other parameters as for processROIsDirect.
+
+    Returns:
+    int: Number of ROIs processed.
+    """
+    name = os.path.basename(image_path)
+    reader = open_region_reader(image_path)
+    n_chans = reader.getSizeC()
+    n_slices = reader.getSizeZ()
+    print("Reading ROI regions from {} ({}x{}, {} channels, {} slices)".format(
+        name, reader.getSizeX(), reader.getSizeY(), n_chans, n_slices))
+    writer = BackgroundWriter()
+    start_time = time.time()
+    skipped = []
+    try:
+        for i, roi in enumerate(rois):
+            current_slice = roi_z_position(roi, n_chans, (n_slices + 1) // 2)
+            start_slice = max(1, current_slice - slice_range)
+            end_slice = min(n_slices, current_slice + slice_range)
+            out_name = "{}_ROI-{}_Zpos-{}_{}".format(sample_id, i, current_slice, name)
+            crop = read_roi_region(reader, roi, n_chans, start_slice, end_slice, out_name)
+            if crop is None:
+                skipped.append(i)
+                print("[SKIPPED] ROI {} ({}) lies outside the image".format(i, roi.getName()))
+                continue
+            montage_crop(crop, out_name, n_chans, channels, tiff_folder, png_folder,
+                         montage_cols, montage_rows, downsampling_scale, pixel_adjust, writer)
+    finally:
+        reader.close()
+        writer.finish()
+    report_rate(len(rois) - len(skipped), start_time)
+    if skipped:
+        print("{} ROI(s) outside the image skipped: {}".format(len(skipped), skipped))
+    return len(rois) - len(skipped)
+
+if is_headless():
+    # no dialogs, windows or ROI manager: everything comes from the HEADLESS CONFIGURATION block
+    rois = load_roi_set(headless_roi_set)
+    montage_rows = headless_montage_rows
+    directory = os.path.dirname(os.path.abspath(headless_image_path))
+    tiff_folder, png_folder = createOutputFolders(directory)
+    if crop_from_disk:
+        reader = open_region_reader(headless_image_path)
+        n_chans = reader.getSizeC()
+        reader.close()
+        image_title = os.path.basename(headless_image_path)
+    else:
+        active_image = IJ.openImage(headless_image_path)
+        if active_image is None:
+            print("Could not open headless_image_path: {}".format(headless_image_path))
+            sys.exit()
+        n_chans = active_image.getNChannels()
+        image_title = active_image.getTitle()
+    montage_cols = n_chans/montage_rows
+    channels = headless_channels or ["C{}".format(c + 1) for c in range(n_chans)]
+    sample_id = headless_sample_id or os.path.splitext(image_title)[0]
+    print("Headless: {} ROIs from {} on {}".format(len(rois), headless_roi_set, image_title))
+
+    if crop_from_disk:
+        processROIsFromDisk(headless_image_path, sample_id, rois, channels, tiff_folder, png_folder,
+                            montage_cols, montage_rows, headless_downsampling_scale,
+                            headless_pixel_adjust, headless_slice_range)
+    else:
+        processROIsDirect(active_image, sample_id, rois, n_chans, channels, tiff_folder, png_folder,
+                          montage_cols, montage_rows, headless_downsampling_scale,
+                          headless_pixel_adjust, headless_slice_range)
+    sys.exit()
+
 # Show the parameters dialog
 active_image = IJ.getImage() #handle for referring to image
 parameters = showParametersDialog(active_image)
@@ -441,6 +756,11 @@ if parameters is not None:
 
 ## now we have made the paramters. hooray.
 
-processROIs(active_image,sample_id, roi_manager, n_chans, tiff_folder,
-            montage_cols, montage_rows, downsampling_scale, 
-            pixel_adjust, annotation_font_size, 4)
+if use_window_manager:
+    processROIs(active_image,sample_id, roi_manager, n_chans, tiff_folder,
+                montage_cols, montage_rows, downsampling_scale, 
+                pixel_adjust, annotation_font_size, 4)
+else:
+    processROIsDirect(active_image, sample_id, list(roi_manager.getRoisAsArray()), n_chans, channels,
+                      tiff_folder, png_folder, montage_cols, montage_rows, downsampling_scale,
+                      pixel_adjust, 4)
@@ -1,8 +1,26 @@
 import os
+import sys
+import argparse
+import csv
+import hashlib
+import json
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import numpy as np
 
+try:
+    import xxhash  # pip install xxhash -- several GB/s, much faster than hashlib on big tiles
+except ImportError:
+    xxhash = None
+
+try:
+    import hdf5plugin  # pip install hdf5plugin -- registers the LZ4/Zstd HDF5 filters
+except ImportError:
+    hdf5plugin = None
+
 # === USER CONFIGURATION ===
 ims_folder = r"/Volumes/users/Hugo/HD71"  # Update as needed
 resolution_level = 5
@@ -11,32 +29,74 @@ z_index = 1
 time_index = 0
 h5repack_path = "h5repack"  # Adjust if needed
 max_allowed_level = 5
+checksum_workers = 8  # files hashed in parallel, raise for network shares
+checksum_block_size = 16 * 1024 * 1024  # 16 MB sequential reads
+transcode_codec = None  # None keeps the acquisition compression, or e.g. "gzip:4", "lz4", "zstd:3"
+transcode_chunks = None  # None keeps the chunk shape, or a (z, y, x) tuple e.g. (16, 256, 256)
 # ===========================
 
-def is_corrupt(filepath):
+def check_file(filepath):
+    """
+    Run the integrity check on one tile and record what happened.
+
+    Returns:
+        dict: health record with the tier that failed (open, dataset, shape, read, dtype)
+              or "passed", the reason, the dataset path, bytes read and open/read timings.
+    """
+    dataset_path = f"/DataSet/ResolutionLevel {resolution_level}/TimePoint {time_index}/Channel {channel_index}/Data"
+    record = {
+        "file": os.path.basename(filepath),
+        "size_bytes": os.path.getsize(filepath) if os.path.exists(filepath) else None,
+        "status": "ok",
+        "tier": "open",
+        "reason": "",
+        "dataset_path": dataset_path,
+        "bytes_read": 0,
+        "open_s": None,
+        "read_s": None,
+        "repack_s": None,
+        "action": "none",
+        "transcode": None,  # "ok" / "failed" when a codec was applied
+        "transcode_s": None,
+    }
     try:
+        t0 = time.perf_counter()
         with h5py.File(filepath, 'r') as f:
-            dataset_path = f"/DataSet/ResolutionLevel {resolution_level}/TimePoint {time_index}/Channel {channel_index}/Data"
+            record["open_s"] = time.perf_counter() - t0
 
+            record["tier"] = "dataset"
             if dataset_path not in f:
                 raise ValueError("Missing dataset")
 
             dset = f[dataset_path]
 
+            record["tier"] = "shape"
             if dset.shape[0] <= z_index:
                 raise ValueError("Z index out of bounds")
 
+            record["tier"] = "read"
+            t0 = time.perf_counter()
             slice_data = dset[z_index, :, :]
+            record["read_s"] = time.perf_counter() - t0
+            record["bytes_read"] = slice_data.nbytes
             if slice_data.size == 0:
                 raise ValueError("Empty slice")
 
+            record["tier"] = "dtype"
             if not np.issubdtype(slice_data.dtype, np.integer) and not np.issubdtype(slice_data.dtype, np.floating):
                 raise TypeError(f"Unsupported dtype: {slice_data.dtype}")
 
-        return False
+        record["tier"] = "passed"
     except Exception as e:
+        if record["tier"] == "open":
+            record["open_s"] = time.perf_counter() - t0
+        record["status"] = "corrupt"
+        record["reason"] = str(e)
         print(f"[CORRUPTED] {os.path.basename(filepath)} - {str(e)}")
-        return True
+    return record
+
+def is_corrupt(filepath):
+    return check_file(filepath)["status"] != "ok"
 
 def repack_file(src, dest):
     print(f"[REPACKING] {os.path.basename(src)}")
@@ -67,43 +127,450 @@ def strip_extra_resolution_levels(ims_path, max_level):
     except Exception as e:
         print(f"[STRIP FAILED] {ims_path} - {e}")
 
-def main():
-    ims_files = [f for f in os.listdir(ims_folder) if f.endswith(".ims")]
-    corrupted = []
-    replaced = []
-
-    print("=== Scanning for corrupted .ims files ===")
-    for i, ims in enumerate(ims_files, 1):
-        full_path = os.path.join(ims_folder, ims)
-        print(f"[{i}/{len(ims_files)}] Checking: {ims}")
-        if is_corrupt(full_path):
-            corrupted.append(ims)
-
-    if not corrupted:
-        print("\n✅ All tiles passed integrity check.")
-        return
-
-    print(f"\n=== Found {len(corrupted)} corrupted tile(s). Starting repair... ===\n")
+def repair_files(folder, corrupted, codec=None, chunks=None, records=None):
+    """
+    Repack each corrupted tile to a temp file, re-check it and swap it in.
+    If codec is given, the repacked tile is also transcoded before the swap; if that fails the
+    repacked tile is swapped in with its original compression and the failure is recorded.
+    If records (name -> health record) is given, the repack time, action and transcode result are filled in.
 
+    Returns:
+        list: names of the tiles that were replaced.
+    """
+    replaced = []
     for i, ims in enumerate(corrupted, 1):
         print(f"\n=== [{i}/{len(corrupted)}] Processing {ims} ===")
-        src = os.path.join(ims_folder, ims)
+        src = os.path.join(folder, ims)
         tmp_fixed = src.replace(".ims", "_fixed.ims")
+        record = records.get(ims, {}) if records is not None else {}
 
+        t0 = time.perf_counter()
         repacked_ok = repack_file(src, tmp_fixed)
+        record["repack_s"] = time.perf_counter() - t0
 
         if os.path.exists(tmp_fixed) and not is_corrupt(tmp_fixed):
             strip_extra_resolution_levels(tmp_fixed, max_allowed_level)
+            if codec is not None:
+                t0 = time.perf_counter()
+                transcoded = transcode_in_place(tmp_fixed, codec, chunks)
+                record["transcode_s"] = time.perf_counter() - t0
+                record["transcode"] = "ok" if transcoded else "failed"
+                if not transcoded:
+                    print(f"[TRANSCODE FAILED] {ims} - swapping in the repacked tile with its original compression")
             try:
                 os.replace(tmp_fixed, src)
                 print(f"[FIXED] {ims} has been repacked and cleaned.")
                 replaced.append(ims)
+                record["action"] = "repacked"
             except Exception as e:
                 print(f"[REPLACE FAILED] {ims} - {e}")
+                record["action"] = "replace_failed"
         else:
             print(f"[FAILED] {ims} could not be recovered properly.")
+            record["action"] = "repack_failed"
             if os.path.exists(tmp_fixed):
                 os.remove(tmp_fixed)
+    return replaced
+
+# === TRANSCODING ===
+# h5repack -f applies one filter to every dataset and cannot clamp chunk shapes to the
+# small resolution levels, so datasets are rewritten through h5py instead.
+
+def codec_filter_kwargs(codec):
+    """
+    Turn a codec string into create_dataset() keyword arguments.
+    Accepts "none", "gzip[:level]", "lz4" and "zstd[:level]" (the last two need hdf5plugin).
+    """
+    name, _, level = codec.lower().partition(":")
+    if name == "none":
+        return {}
+    if name == "gzip":
+        return {"compression": "gzip", "compression_opts": int(level or 4), "shuffle": True}
+    if name in ("lz4", "zstd"):
+        if hdf5plugin is None:
+            raise RuntimeError(f"{name} needs the HDF5 filter plugins, pip install hdf5plugin")
+        if name == "lz4":
+            return dict(hdf5plugin.LZ4())
+        return dict(hdf5plugin.Zstd(clevel=int(level or 3)))
+    raise ValueError(f"Unknown codec: {codec}")
+
+def parse_chunks(text):
+    """'16,256,256' -> (16, 256, 256)"""
+    return tuple(int(c) for c in text.split(",")) if text else None
+
+def copy_attrs(src, dst):
+    # Imaris stores attributes as fixed length char arrays, keep the exact on-disk type
+    for key in src.attrs:
+        dst.attrs.create(key, src.attrs[key], dtype=src.attrs.get_id(key).dtype)
+
+def transcode_file(src_path, dest_path, codec, chunks=None, min_size=64 * 1024):
+    """
+    Rewrite every image dataset of src_path into dest_path with the given codec and chunk shape.
+    Datasets smaller than min_size bytes (thumbnails, histograms) are copied unchanged.
+    Data is streamed one chunk-row of planes at a time, so memory stays at a few chunks.
+
+    Returns:
+        int: uncompressed bytes written through the new filter.
+    """
+    filter_kwargs = codec_filter_kwargs(codec)
+    written = 0
+
+    with h5py.File(src_path, "r") as src, h5py.File(dest_path, "w") as dst:
+        copy_attrs(src, dst)
+
+        def _copy(name, obj):
+            nonlocal written
+            if isinstance(obj, h5py.Group):
+                copy_attrs(obj, dst.require_group(name))
+                return
+            if obj.ndim < 2 or obj.nbytes < min_size:
+                src.copy(obj, dst, name=name)
+                return
+            if chunks:
+                new_chunks = tuple(min(c, s) for c, s in zip(chunks[-obj.ndim:], obj.shape))
+            else:
+                new_chunks = obj.chunks or True
+            out = dst.create_dataset(name, shape=obj.shape, dtype=obj.dtype, chunks=new_chunks, **filter_kwargs)
+            copy_attrs(obj, out)
+            step = out.chunks[0]
+            for start in range(0, obj.shape[0], step):
+                block = obj[start:start + step]
+                out[start:start + step] = block
+                written += block.nbytes
+
+        src.visititems(_copy)
+    return written
+
+def transcode_in_place(ims_path, codec, chunks=None):
+    """Transcode ims_path through a temp file and swap it in if the result passes is_corrupt()."""
+    tmp_path = ims_path.replace(".ims", "_transcoded.ims")
+    print(f"[TRANSCODING] {os.path.basename(ims_path)} -> {codec}, chunks={chunks or 'unchanged'}")
+    try:
+        transcode_file(ims_path, tmp_path, codec, chunks)
+    except Exception as e:
+        print(f"[TRANSCODE FAILED] {os.path.basename(ims_path)} - {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    if is_corrupt(tmp_path):
+        print(f"[TRANSCODE FAILED] {os.path.basename(ims_path)} - transcoded file failed integrity check")
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, ims_path)
+    return True
+
+def middle_slice_latency(ims_path, repeats=5):
+    """Median seconds to open a tile and read the middle z slice of full resolution channel 0."""
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        with h5py.File(ims_path, "r") as f:
+            dset = f[f"/DataSet/ResolutionLevel 0/TimePoint {time_index}/Channel 0/Data"]
+            dset[dset.shape[0] // 2, :, :]
+        timings.append(time.perf_counter() - t0)
+    return float(np.median(timings))
+
+def benchmark_codecs(ims_path, codecs, chunks=None, report_path=None, work_dir=None):
+    """
+    Transcode one tile with each codec and report file size, write throughput and
+    middle-slice read latency next to the original. Writes a CSV if report_path is given.
+    Note the OS page cache makes read latencies optimistic, compare codecs against each other.
+
+    Returns:
+        list: one dict per codec (plus the original).
+    """
+    original_size = os.path.getsize(ims_path)
+    rows = [{
+        "codec": "original",
+        "chunks": "unchanged",
+        "size_mb": original_size / 1e6,
+        "ratio_vs_original": 1.0,
+        "write_mb_s": None,
+        "middle_slice_ms": middle_slice_latency(ims_path) * 1000,
+    }]
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for codec in codecs:
+            out_path = os.path.join(tmp, f"bench_{codec.replace(':', '_')}.ims")
+            print(f"[BENCHMARK] {os.path.basename(ims_path)} -> {codec}")
+            t0 = time.perf_counter()
+            try:
+                written = transcode_file(ims_path, out_path, codec, chunks)
+            except Exception as e:
+                print(f"[BENCHMARK FAILED] {codec} - {e}")
+                continue
+            elapsed = time.perf_counter() - t0
+            size = os.path.getsize(out_path)
+            rows.append({
+                "codec": codec,
+                "chunks": ",".join(str(c) for c in chunks) if chunks else "unchanged",
+                "size_mb": size / 1e6,
+                "ratio_vs_original": size / original_size,
+                "write_mb_s": written / 1e6 / elapsed,
+                "middle_slice_ms": middle_slice_latency(out_path) * 1000,
+            })
+            os.remove(out_path)
+
+    print(f"\n=== Codec benchmark: {os.path.basename(ims_path)} ===")
+    print(f"{'codec':<10} {'chunks':<12} {'size MB':>9} {'ratio':>6} {'write MB/s':>11} {'mid-slice ms':>13}")
+    for row in rows:
+        write = f"{row['write_mb_s']:.1f}" if row["write_mb_s"] is not None else "-"
+        print(f"{row['codec']:<10} {row['chunks']:<12} {row['size_mb']:>9.1f} {row['ratio_vs_original']:>6.2f} {write:>11} {row['middle_slice_ms']:>13.1f}")
+
+    if report_path:
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"✅ Benchmark report written to {report_path}")
+    return rows
+
+# === CHECKSUMS ===
+# is_corrupt() only reads one slice, so a tile that was truncated or bit-flipped on the
+# way to shared storage can still pass. These hash every byte of every tile instead.
+
+def default_hash_algorithm():
+    return "xxh3_64" if xxhash is not None else "blake2b_64"
+
+def new_hasher(algorithm):
+    if algorithm == "xxh3_64":
+        if xxhash is None:
+            raise RuntimeError("Manifest was written with xxh3_64, pip install xxhash to verify it")
+        return xxhash.xxh3_64()
+    if algorithm == "blake2b_64":
+        return hashlib.blake2b(digest_size=8)
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+def hash_file(filepath, algorithm, block_size=checksum_block_size):
+    """
+    Hash a whole file with large sequential reads into one reused buffer.
+
+    Returns:
+        tuple: (hex digest, number of bytes read)
+    """
+    hasher = new_hasher(algorithm)
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    total = 0
+    with open(filepath, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+            total += n
+    return hasher.hexdigest(), total
+
+def find_ims_files(folder):
+    """All .ims files under folder, as sorted paths relative to it."""
+    rel_paths = []
+    for dirpath, _, filenames in os.walk(folder):
+        for fname in filenames:
+            if fname.endswith(".ims"):
+                rel_paths.append(os.path.relpath(os.path.join(dirpath, fname), folder))
+    return sorted(rel_paths)
+
+def hash_files(folder, rel_paths, algorithm, workers=checksum_workers):
+    """
+    Hash files in parallel. Reads are I/O bound and both hashers release the GIL,
+    so threads are enough to keep several network reads in flight.
+
+    Returns:
+        dict: relative path -> (digest, size), or (None, error message) if the file could not be read.
+    """
+    def _one(rel_path):
+        try:
+            return rel_path, hash_file(os.path.join(folder, rel_path), algorithm)
+        except OSError as e:
+            return rel_path, (None, str(e))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, (rel_path, result) in enumerate(pool.map(_one, rel_paths), 1):
+            results[rel_path] = result
+            print(f"[{i}/{len(rel_paths)}] Hashed: {rel_path}")
+    return results
+
+def write_manifest(folder, manifest_path, workers=checksum_workers):
+    """Hash every .ims file under folder and write a tab separated manifest (path, size, digest)."""
+    algorithm = default_hash_algorithm()
+    rel_paths = find_ims_files(folder)
+    print(f"=== Hashing {len(rel_paths)} .ims file(s) with {algorithm} ===")
+    results = hash_files(folder, rel_paths, algorithm, workers)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        f.write(f"# algorithm: {algorithm}\n")
+        f.write("path\tsize\tdigest\n")
+        for rel_path in rel_paths:
+            digest, size = results[rel_path]
+            if digest is None:
+                print(f"[UNREADABLE] {rel_path} - {size}")
+                continue
+            f.write(f"{rel_path}\t{size}\t{digest}\n")
+    print(f"✅ Manifest written to {manifest_path}")
+
+def read_manifest(manifest_path):
+    """Returns (algorithm, {relative path: (size, digest)})."""
+    algorithm = None
+    entries = {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("# algorithm:"):
+                algorithm = line.split(":", 1)[1].strip()
+                continue
+            if not line or line.startswith("#") or line == "path\tsize\tdigest":
+                continue
+            rel_path, size, digest = line.split("\t")
+            entries[rel_path] = (int(size), digest)
+    if algorithm is None:
+        raise ValueError(f"{manifest_path} has no '# algorithm:' header")
+    return algorithm, entries
+
+def verify_manifest(manifest_path, dest_folder, queue_path=None, repack=False, workers=checksum_workers):
+    """
+    Check a destination tree against a manifest. Files that are missing, the wrong size or
+    hash differently are written to a re-copy queue (tab separated: path, reason).
+    With repack=True, mismatched files that still open as HDF5 are sent through the repack path.
+
+    Returns:
+        list: (relative path, reason) for every file that failed.
+    """
+    algorithm, entries = read_manifest(manifest_path)
+    failed = []
+    to_hash = []
+    for rel_path, (size, _) in entries.items():
+        dest = os.path.join(dest_folder, rel_path)
+        if not os.path.exists(dest):
+            failed.append((rel_path, "missing"))
+        elif os.path.getsize(dest) != size:
+            failed.append((rel_path, "size mismatch"))
+        else:
+            to_hash.append(rel_path)
+
+    print(f"=== Verifying {len(to_hash)} file(s) against {os.path.basename(manifest_path)} ({algorithm}) ===")
+    results = hash_files(dest_folder, to_hash, algorithm, workers)
+    for rel_path in to_hash:
+        digest, _ = results[rel_path]
+        if digest is None:
+            failed.append((rel_path, "unreadable"))
+        elif digest != entries[rel_path][1]:
+            failed.append((rel_path, "checksum mismatch"))
+
+    if not failed:
+        print(f"\n✅ All {len(entries)} file(s) match the manifest.")
+        return failed
+
+    if queue_path is None:
+        queue_path = os.path.splitext(manifest_path)[0] + "_requeue.tsv"
+    with open(queue_path, "w", encoding="utf-8") as f:
+        f.write("path\treason\n")
+        for rel_path, reason in sorted(failed):
+            print(f"[MISMATCH] {rel_path} - {reason}")
+            f.write(f"{rel_path}\t{reason}\n")
+    print(f"\n⚠️ {len(failed)} file(s) queued for re-copy in {queue_path}")
+
+    if repack:
+        candidates = [p for p, reason in failed if reason == "checksum mismatch"]
+        corrupted = [p for p in candidates if is_corrupt(os.path.join(dest_folder, p))]
+        if corrupted:
+            print(f"\n=== {len(corrupted)} mismatched tile(s) fail the integrity check. Starting repair... ===\n")
+            repair_files(dest_folder, corrupted, transcode_codec, transcode_chunks)
+    return failed
+
+# === HEALTH REPORT ===
+
+def summarize_health(records, scan_seconds, n_slowest=10):
+    """Totals, read throughput and the slowest files, to tell slow storage apart from corruption."""
+    bytes_read = sum(r["bytes_read"] for r in records)
+    read_s = sum(r["read_s"] or 0 for r in records)
+    open_times = [r["open_s"] for r in records if r["open_s"] is not None]
+    by_tier = {}
+    for r in records:
+        if r["status"] != "ok":
+            by_tier[r["tier"]] = by_tier.get(r["tier"], 0) + 1
+    slowest = sorted(records, key=lambda r: (r["open_s"] or 0) + (r["read_s"] or 0), reverse=True)[:n_slowest]
+    return {
+        "files": len(records),
+        "corrupt": sum(r["status"] != "ok" for r in records),
+        "failures_by_tier": by_tier,
+        "actions": {a: sum(r["action"] == a for r in records) for a in sorted({r["action"] for r in records})},
+        "scan_s": scan_seconds,
+        "transcode_s": sum(r["transcode_s"] or 0 for r in records),
+        "bytes_read": bytes_read,
+        "read_mb_s": bytes_read / 1e6 / read_s if read_s else None,
+        "files_per_s": len(records) / scan_seconds if scan_seconds else None,
+        "open_s_median": float(np.median(open_times)) if open_times else None,
+        "open_s_p95": float(np.percentile(open_times, 95)) if open_times else None,
+        "slowest": [
+            {"file": r["file"], "open_s": r["open_s"], "read_s": r["read_s"], "status": r["status"]}
+            for r in slowest
+        ],
+    }
+
+def write_health_report(records, summary, report_path):
+    """Write per-file records as JSON (with the summary) or CSV (summary goes to <report>_summary.json)."""
+    if report_path.endswith(".csv"):
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0].keys()) if records else ["file"])
+            writer.writeheader()
+            writer.writerows(records)
+        summary_path = os.path.splitext(report_path)[0] + "_summary.json"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "files": records}, f, indent=2)
+    print(f"✅ Health report written to {report_path}")
+
+def print_health_summary(summary):
+    print("\n=== Health Summary ===")
+    print(f"Files: {summary['files']}, corrupt: {summary['corrupt']} {summary['failures_by_tier'] or ''}")
+    if summary["read_mb_s"] is not None:
+        print(f"Read throughput: {summary['read_mb_s']:.1f} MB/s, {summary['files_per_s']:.2f} files/s")
+    if summary["transcode_s"]:
+        print(f"Scan: {summary['scan_s']:.1f} s, transcoding: {summary['transcode_s']:.1f} s")
+    if summary["open_s_median"] is not None:
+        print(f"Open latency: median {summary['open_s_median'] * 1000:.1f} ms, p95 {summary['open_s_p95'] * 1000:.1f} ms")
+    print("Slowest files:")
+    for r in summary["slowest"]:
+        print(f"  {r['file']}: open {(r['open_s'] or 0) * 1000:.1f} ms, read {(r['read_s'] or 0) * 1000:.1f} ms ({r['status']})")
+
+def scan_and_repair(folder, codec=transcode_codec, chunks=transcode_chunks, transcode_all=False, report_path=None):
+    ims_files = [f for f in os.listdir(folder) if f.endswith(".ims")]
+    corrupted = []
+    records = {}
+
+    print("=== Scanning for corrupted .ims files ===")
+    scan_start = time.perf_counter()
+    for i, ims in enumerate(ims_files, 1):
+        full_path = os.path.join(folder, ims)
+        print(f"[{i}/{len(ims_files)}] Checking: {ims}")
+        record = check_file(full_path)
+        records[ims] = record
+        if record["status"] != "ok":
+            corrupted.append(ims)
+        elif transcode_all and codec is not None:
+            t0 = time.perf_counter()
+            transcoded = transcode_in_place(full_path, codec, chunks)
+            record["transcode_s"] = time.perf_counter() - t0
+            record["transcode"] = "ok" if transcoded else "failed"
+            record["action"] = "transcoded" if transcoded else "transcode_failed"
+    # transcodes run inside the scan loop but are not part of the scan
+    scan_seconds = time.perf_counter() - scan_start - sum(r["transcode_s"] or 0 for r in records.values())
+
+    if corrupted:
+        print(f"\n=== Found {len(corrupted)} corrupted tile(s). Starting repair... ===\n")
+        replaced = repair_files(folder, corrupted, codec, chunks, records)
+
+    summary = summarize_health(list(records.values()), scan_seconds)
+    print_health_summary(summary)
+    if report_path:
+        write_health_report(list(records.values()), summary, report_path)
+
+    if not corrupted:
+        print("\n✅ All tiles passed integrity check.")
+        return
 
     if replaced:
         print("\n=== Summary of Replaced Files ===")
@@ -114,5 +581,55 @@ def main():
 
     print("\n=== DONE: All corrupted files have been processed ===")
 
+def main():
+    parser = argparse.ArgumentParser(description="Check, repair and checksum .ims tiles. With no command, scans the configured ims_folder.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    check_parser = subparsers.add_parser("check", help="Scan a folder for corrupted tiles and repack them.")
+    check_parser.add_argument("folder", nargs="?", default=ims_folder, help="Folder of .ims tiles (default: ims_folder).")
+    check_parser.add_argument("--codec", default=transcode_codec, help="Transcode repaired tiles, e.g. gzip:4, lz4, zstd:3.")
+    check_parser.add_argument("--chunks", type=parse_chunks, default=transcode_chunks, help="Chunk shape for transcoded datasets, e.g. 16,256,256.")
+    check_parser.add_argument("--transcode-all", action="store_true", default=False, help="Transcode healthy tiles too, not just repaired ones.")
+    check_parser.add_argument("-r", "--report", default=None, help="Write a per-file health report (.json, or .csv plus _summary.json).")
+
+    bench_parser = subparsers.add_parser("benchmark", help="Compare size, write throughput and read latency across codecs for one tile.")
+    bench_parser.add_argument("ims_file", help="Tile to benchmark.")
+    bench_parser.add_argument("--codecs", nargs="+", default=["gzip:1", "gzip:4", "lz4", "zstd:3"], help="Codecs to try.")
+    bench_parser.add_argument("--chunks", type=parse_chunks, default=transcode_chunks, help="Chunk shape, e.g. 16,256,256.")
+    bench_parser.add_argument("-o", "--output", default=None, help="CSV report path.")
+    bench_parser.add_argument("--work-dir", default=None, help="Where to write the temporary transcoded copies (default: system temp).")
+
+    checksum_parser = subparsers.add_parser("checksum", help="Whole-file checksums for verifying transfers.")
+    checksum_sub = checksum_parser.add_subparsers(dest="checksum_command", required=True)
+
+    manifest_parser = checksum_sub.add_parser("manifest", help="Hash every .ims file under a folder.")
+    manifest_parser.add_argument("folder", help="Source folder (e.g. the acquisition PC copy).")
+    manifest_parser.add_argument("-o", "--output", default=None, help="Manifest path (default: <folder>/checksums.tsv).")
+    manifest_parser.add_argument("-j", "--workers", type=int, default=checksum_workers, help="Files hashed in parallel.")
+
+    verify_parser = checksum_sub.add_parser("verify", help="Check a destination tree against a manifest.")
+    verify_parser.add_argument("manifest", help="Manifest written by 'checksum manifest'.")
+    verify_parser.add_argument("folder", help="Destination folder (e.g. /Volumes/users/... or /shared/s3/...).")
+    verify_parser.add_argument("-q", "--queue", default=None, help="Re-copy queue path (default: <manifest>_requeue.tsv).")
+    verify_parser.add_argument("--repack", action="store_true", default=False, help="Also repack mismatched tiles that fail the integrity check.")
+    verify_parser.add_argument("-j", "--workers", type=int, default=checksum_workers, help="Files hashed in parallel.")
+
+    args = parser.parse_args()
+
+    if args.command == "checksum":
+        if args.checksum_command == "manifest":
+            output = args.output or os.path.join(args.folder, "checksums.tsv")
+            write_manifest(args.folder, output, args.workers)
+        else:
+            failed = verify_manifest(args.manifest, args.folder, args.queue, args.repack, args.workers)
+            if failed:
+                sys.exit(1)
+    elif args.command == "benchmark":
+        benchmark_codecs(args.ims_file, args.codecs, args.chunks, args.output, args.work_dir)
+    elif args.command == "check":
+        scan_and_repair(args.folder, args.codec, args.chunks, args.transcode_all, args.report)
+    else:
+        scan_and_repair(ims_folder)
+
 if __name__ == "__main__":
     main()
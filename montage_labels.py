@@ -0,0 +1,194 @@
+# Label glyph cache shared by the montage scripts, in Fiji (Jython) and plain Python.
+#
+# Every montage panel gets a short yellow label on a semi-transparent black box. Building a new
+# Font + TextRoi for each label (and a throwaway TextRoi just to measure the text height) costs the
+# same for every ROI and every slice. Here each distinct (text, font size) is rendered once into a
+# small bitmap and kept; labelling a montage is then only a blit per panel, burned straight into
+# the pixels so the saved PNG/JPG needs no overlay flattening.
+#
+#   Fiji:    the bitmaps are ARGB BufferedImages, drawn onto the montage with Graphics2D
+#            (AWT does the alpha compositing); burn_labels(imp, ...) replaces the montage processor
+#            with the labelled RGB one.
+#   Python:  the bitmaps are premultiplied RGBA NumPy arrays (rendered with Pillow) blended into an
+#            (H, W, 3) uint8 array; burn_labels(rgb, ...) works in place.
+#
+# Fiji does not put the script's folder on the Jython path; the scripts that use this add it
+# (see the import at the top of cell_montages.py).
+#
+# NB: parsed by Jython 2.7 too, so no f-strings.
+
+try:
+    from java.awt import Font, Color, RenderingHints
+    from java.awt.image import BufferedImage
+    from ij.process import ColorProcessor
+    IN_FIJI = True
+except ImportError:
+    IN_FIJI = False
+    import numpy as np
+    try:
+        from PIL import Image, ImageDraw, ImageFont  # pip install pillow
+    except ImportError:
+        Image = ImageDraw = ImageFont = None
+
+LABEL_COLOR = (255, 255, 0)  # yellow text ...
+LABEL_BACKGROUND = (0, 0, 0, 128)  # ... on semi-transparent black, as the TextRoi overlays were
+
+
+class _LabelCacheBase(object):
+    """Rendering is per runtime; the caching is shared."""
+
+    def __init__(self, font_name, color=LABEL_COLOR, background=LABEL_BACKGROUND):
+        self.font_name = font_name
+        self.color = color
+        self.background = background
+        self._fonts = {}
+        self._glyphs = {}
+        self.renders = 0
+        self.blits = 0
+
+    def font(self, size):
+        if size not in self._fonts:
+            self._fonts[size] = self._make_font(size)
+        return self._fonts[size]
+
+    def glyph(self, text, size):
+        """The cached bitmap for text at size, rendered on first use."""
+        key = (text, size)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            glyph = self._render(text, self.font(size))
+            self._glyphs[key] = glyph
+            self.renders += 1
+        return glyph
+
+    def burn_labels(self, target, labels, coordinates, size):
+        """
+        Burn labels[i] into target with its top-left corner at coordinates[i].
+
+        Parameters:
+        - target: ImagePlus (Fiji) or (H, W, 3) uint8 array (Python).
+        - labels (list): One string per panel; extra coordinates are ignored.
+        - coordinates (list): (x, y) per panel, e.g. from generate_coordinates().
+        - size (int): Font size.
+
+        Returns:
+        The labelled target.
+        """
+        canvas = self._begin(target)
+        for text, (x, y) in zip(labels, coordinates):
+            if text:
+                self._blit(canvas, self.glyph(text, size), int(x), int(y))
+                self.blits += 1
+        return self._end(target, canvas)
+
+    def stats(self):
+        return "{} labels drawn from {} rendered glyphs".format(self.blits, self.renders)
+
+
+if IN_FIJI:
+
+    class LabelCache(_LabelCacheBase):
+        """Glyphs as ARGB BufferedImages, composited with Graphics2D."""
+
+        def __init__(self, font_name="SansSerif", color=LABEL_COLOR, background=LABEL_BACKGROUND):
+            _LabelCacheBase.__init__(self, font_name, color, background)
+            self._scratch = BufferedImage(1, 1, BufferedImage.TYPE_INT_ARGB).createGraphics()
+
+        def _make_font(self, size):
+            return Font(self.font_name, Font.PLAIN, size)
+
+        def text_height(self, size):
+            """Line height of the font at size (what get_max_text_height measured with a TextRoi)."""
+            return self._scratch.getFontMetrics(self.font(size)).getHeight()
+
+        def _render(self, text, font):
+            metrics = self._scratch.getFontMetrics(font)
+            width, height = max(1, metrics.stringWidth(text)), max(1, metrics.getHeight())
+            image = BufferedImage(width, height, BufferedImage.TYPE_INT_ARGB)
+            g = image.createGraphics()
+            g.setRenderingHint(RenderingHints.KEY_TEXT_ANTIALIASING, RenderingHints.VALUE_TEXT_ANTIALIAS_ON)
+            g.setColor(Color(*self.background))
+            g.fillRect(0, 0, width, height)
+            g.setColor(Color(*self.color))
+            g.setFont(font)
+            g.drawString(text, 0, metrics.getAscent())
+            g.dispose()
+            return image
+
+        def _begin(self, imp):
+            image = imp.getProcessor().convertToRGB().getBufferedImage()
+            return image, image.createGraphics()
+
+        def _blit(self, canvas, glyph, x, y):
+            canvas[1].drawImage(glyph, x, y, None)
+
+        def _end(self, imp, canvas):
+            image, g = canvas
+            g.dispose()
+            imp.setOverlay(None)
+            imp.setProcessor(ColorProcessor(image))
+            return imp
+
+else:
+
+    class LabelCache(_LabelCacheBase):
+        """Glyphs as premultiplied RGBA float arrays, blended with NumPy."""
+
+        def __init__(self, font_name="DejaVuSans.ttf", color=LABEL_COLOR, background=LABEL_BACKGROUND):
+            if Image is None:
+                raise ImportError("montage labels need pillow outside Fiji (pip install pillow)")
+            _LabelCacheBase.__init__(self, font_name, color, background)
+
+        def _make_font(self, size):
+            try:
+                return ImageFont.truetype(self.font_name, size)
+            except (IOError, OSError):
+                return ImageFont.load_default(size)
+
+        def text_height(self, size):
+            ascent, descent = self.font(size).getmetrics()
+            return ascent + descent
+
+        def _render(self, text, font):
+            ascent, descent = font.getmetrics()
+            width = max(1, int(font.getlength(text)))
+            mask = Image.new("L", (width, ascent + descent), 0)
+            ImageDraw.Draw(mask).text((0, 0), text, font=font, fill=255)
+            text_alpha = np.asarray(mask, dtype=np.float32)[:, :, None] / 255.0
+            box_alpha = self.background[3] / 255.0
+            # text over the box, as one (premultiplied color, coverage) pair so a blit is one blend
+            coverage = 1 - (1 - box_alpha) * (1 - text_alpha)
+            premultiplied = (np.asarray(self.background[:3], dtype=np.float32) * box_alpha * (1 - text_alpha)
+                             + np.asarray(self.color, dtype=np.float32) * text_alpha)
+            return premultiplied, coverage
+
+        def _begin(self, rgb):
+            return rgb
+
+        def _blit(self, rgb, glyph, x, y):
+            premultiplied, coverage = glyph
+            # clip the glyph to the target, so a label can straddle the edge of a band or tile
+            gy, gx = max(0, -y), max(0, -x)
+            x, y = max(0, x), max(0, y)
+            height = min(coverage.shape[0] - gy, rgb.shape[0] - y)
+            width = min(coverage.shape[1] - gx, rgb.shape[1] - x)
+            if height <= 0 or width <= 0:
+                return
+            region = rgb[y:y + height, x:x + width]
+            blended = (region * (1 - coverage[gy:gy + height, gx:gx + width])
+                       + premultiplied[gy:gy + height, gx:gx + width])
+            region[...] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+        def _end(self, rgb, canvas):
+            return rgb
+
+
+_shared = None
+
+
+def shared_cache():
+    """One LabelCache per process, so every montage of a run reuses the same glyphs."""
+    global _shared
+    if _shared is None:
+        _shared = LabelCache()
+    return _shared
@@ -0,0 +1,734 @@
+"""
+ROI montages outside Fiji: the same crops and labelled channel montages as cell_montages.py
+(and duplicate_montage_save_ROIs.ijm), in plain NumPy so it runs on the Linux compute nodes.
+
+For every ROI in a RoiSet.zip drawn on a multi-channel MIP / z-stack:
+  - the ROI's bounding box over all channels and slice_range slices around its Z is saved as
+    <sample>_ROI-<i>_Zpos-<z>_<image>.tif in tiffs/,
+  - the middle slice of that crop is tiled channel by channel into a grid (6 px borders, upscaled by
+    pixel_adjust, downsampled by scale), each panel labelled with its channel name, and saved as a
+    PNG with the same name in pngs/.
+
+The image is opened as a memmap (TIFF), page by page (compressed TIFF, see tiff_planes.py) or lazily
+(ND2), so each worker only reads the ROI windows.
+ROIs are split across a process pool; labels come from the montage_labels glyph cache, rendered
+once per string and size in each worker.
+
+With -f h5 / -f zarr nothing is written per ROI: all crops go into <sample>_rois.h5 (or .zarr) under
+crops/ROI-<i>, the montages are packed into <sample>_montages_<page>.png sprite sheets, and
+<sample>_rois_index.json/.csv give each ROI's Z, bounding box, crop path and sprite-sheet rectangle.
+
+With --batch the first argument is a folder: every image in it (recursively) is paired with the
+RoiSet_<ID>.zip next to it, channel names are read from the ch token of the file name, pairs run in
+parallel within --memory-gb, and pairs whose <image>.roi_montages.json stamp matches their inputs
+and settings, and whose recorded outputs all still exist, are skipped. h5/zarr outputs are named
+after the image (<image>_rois.h5, ...) rather than the sample, since a MIP and its z-stack share
+one ID/FOV and RoiSet.
+
+Usage:
+    python roi_montages.py ID-i1264-s03_FOV-2_MIP.tif RoiSet_ID-i1264-s03.zip -c DAPI 488 561 640
+    python roi_montages.py scan.nd2 RoiSet.zip -o /scratch/montages --rows 2 -j 16
+    python roi_montages.py ID-i1264-s03_FOV-2_MIP.tif RoiSet_ID-i1264-s03.zip -f h5
+    python roi_montages.py /Volumes/users/Hugo/screen-240612 --batch -j 4 --memory-gb 32
+
+Dependencies:
+    pip install numpy tifffile pillow
+    pip install nd2   # .nd2 input
+    pip install h5py  # -f h5  (or zarr for -f zarr)
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import struct
+import fnmatch
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+try:
+    import tifffile  # pip install tifffile
+except ImportError:
+    tifffile = None
+
+try:
+    import nd2  # pip install nd2
+except ImportError:
+    nd2 = None
+
+try:
+    import h5py  # pip install h5py, for --format h5
+except ImportError:
+    h5py = None
+
+try:
+    import zarr  # pip install zarr, for --format zarr
+except ImportError:
+    zarr = None
+
+try:
+    from PIL import Image  # pip install pillow
+except ImportError:
+    Image = None
+
+from montage_labels import shared_cache
+from tiff_planes import TiffPlanes
+
+# === USER CONFIGURATION ===
+downsampling_scale = 0.8  # "Make Montage... scale="
+pixel_adjust = 3  # crop upscaling before montaging, like "Size..." in cell_montages.py
+montage_border = 6  # px between panels
+slice_range = 4  # slices kept above and below each ROI's slice in the saved TIFF
+display_percentiles = (0.1, 99.9)  # per-panel contrast for the PNG
+label_fraction = 0.1  # label height as a fraction of the panel size, as in define_widths
+roi_page_cache = 16  # decoded planes kept per worker for compressed TIFFs (neighbouring ROIs share slices)
+# ===========================
+
+
+# --- RoiSet.zip ---
+# Only what the montages need from ImageJ's binary .roi format (see ij.io.RoiDecoder):
+# the bounding box and the C/Z/T position.
+
+ROI_MAGIC = b"Iout"
+ROI_VERSION, ROI_TOP, ROI_POSITION, ROI_HEADER2 = 4, 8, 56, 60
+HEADER2_C, HEADER2_Z, HEADER2_T, HEADER2_NAME_OFFSET, HEADER2_NAME_LENGTH = 4, 8, 12, 16, 20
+
+
+def decode_roi(data, name=""):
+    """
+    Bounding box and position of one ImageJ .roi.
+
+    Returns:
+        dict: name, top, left, bottom, right, position (stack index, 0 if unset), c, z, t (0 if unset).
+    """
+    if data[:4] != ROI_MAGIC:
+        raise ValueError(f"{name}: not an ImageJ ROI")
+    version = struct.unpack_from(">h", data, ROI_VERSION)[0]
+    # signed: ROIs that cross the top or left edge have negative coordinates
+    top, left, bottom, right = struct.unpack_from(">hhhh", data, ROI_TOP)
+    roi = {"name": os.path.splitext(name)[0], "top": top, "left": left, "bottom": bottom, "right": right,
+           "position": 0, "c": 0, "z": 0, "t": 0}
+    if version >= 218:
+        roi["position"] = struct.unpack_from(">i", data, ROI_POSITION)[0]
+        header2 = struct.unpack_from(">i", data, ROI_HEADER2)[0]
+        if 0 < header2 and header2 + 24 <= len(data):
+            roi["c"], roi["z"], roi["t"] = struct.unpack_from(">iii", data, header2 + HEADER2_C)
+            name_offset, name_length = struct.unpack_from(">ii", data, header2 + HEADER2_NAME_OFFSET)
+            if name_offset > 0 and name_length > 0 and name_offset + 2 * name_length <= len(data):
+                roi["name"] = data[name_offset:name_offset + 2 * name_length].decode("utf-16-be")
+    return roi
+
+
+def read_roi_set(path):
+    """Every ROI in a RoiSet .zip (or a single .roi file), in the order they were saved."""
+    if path.lower().endswith(".roi"):
+        with open(path, "rb") as f:
+            return [decode_roi(f.read(), os.path.basename(path))]
+    with zipfile.ZipFile(path) as zf:
+        return [decode_roi(zf.read(entry), entry) for entry in zf.namelist() if entry.endswith(".roi")]
+
+
+def roi_z(roi, n_channels, n_slices):
+    """1-based Z slice of a ROI: its Z position, else its (CZT) stack position, else the middle slice."""
+    if roi["z"] > 0:
+        return min(roi["z"], n_slices)
+    if roi["position"] > 0:
+        return min((roi["position"] - 1) // n_channels + 1, n_slices)
+    return (n_slices + 1) // 2
+
+
+# --- Image access ---
+
+def _to_zcyx(array, axes):
+    """View of array as (Z, C, Y, X): first time point, RGB samples as channels, missing axes added."""
+    axes = axes.upper().replace("S", "C") if "C" not in axes.upper() else axes.upper()
+    index = tuple(0 if ax not in "ZCYX" else slice(None) for ax in axes)
+    array = array[index]
+    axes = "".join(ax for ax in axes if ax in "ZCYX")
+    for ax in "ZC":
+        if ax not in axes:
+            array = array[np.newaxis]
+            axes = ax + axes
+    return np.transpose(array, [axes.index(ax) for ax in "ZCYX"])
+
+
+def open_image(path):
+    """
+    The image as a lazily-read (Z, C, Y, X) array: a memmap for uncompressed TIFFs, a TiffPlanes
+    view for compressed ones (decodes only the pages a ROI window touches), a dask array for ND2.
+    """
+    if path.lower().endswith(".nd2"):
+        if nd2 is None:
+            raise ImportError("nd2 is required for .nd2 images (pip install nd2)")
+        with nd2.ND2File(path) as f:
+            axes = "".join(f.sizes)
+        return _to_zcyx(nd2.imread(path, dask=True), axes)
+    if tifffile is None:
+        raise ImportError("tifffile is required for TIFF images (pip install tifffile)")
+    with tifffile.TiffFile(path) as tif:
+        axes = tif.series[0].axes
+    try:
+        return _to_zcyx(tifffile.memmap(path, mode="r"), axes)
+    except ValueError:
+        pass
+    try:
+        # compressed: pages decode independently, so read one Z/C plane at a time
+        return TiffPlanes(path, stack_axes="Z", cache_pages=roi_page_cache)
+    except ValueError as e:
+        print(f"[WARN] {e}: reading the whole image")
+        return _to_zcyx(tifffile.imread(path), axes)
+
+
+# --- Montage ---
+
+def to_uint8(panels, percentiles=display_percentiles):
+    """Per-panel percentile contrast stretch of (C, Y, X) to uint8."""
+    panels = panels.astype(np.float32)
+    low, high = np.percentile(panels.reshape(len(panels), -1), percentiles, axis=1)
+    scale = 255.0 / np.maximum(high - low, 1e-6)
+    out = (panels - low[:, None, None]) * scale[:, None, None]
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def resample_panels(panels, factor):
+    """Nearest-neighbour resize of every (C, Y, X) panel by factor."""
+    height, width = panels.shape[1:]
+    new_h, new_w = max(1, int(height * factor)), max(1, int(width * factor))
+    rows = (np.arange(new_h) * height // new_h)
+    cols = (np.arange(new_w) * width // new_w)
+    return panels[:, rows[:, None], cols[None, :]]
+
+
+def tile_panels(panels, n_cols, n_rows, border=montage_border, fill=255):
+    """
+    Place (C, Y, X) panels on an n_rows x n_cols grid in one reshape, with border px between panels.
+
+    Returns:
+        np.ndarray: (n_rows * (Y + border) - border, n_cols * (X + border) - border) montage.
+    """
+    n, height, width = panels.shape
+    grid = np.full((n_rows * n_cols, height + border, width + border), fill, dtype=panels.dtype)
+    n = min(n, n_rows * n_cols)
+    grid[:n, :height, :width] = panels[:n]
+    montage = grid.reshape(n_rows, n_cols, height + border, width + border).transpose(0, 2, 1, 3)
+    montage = montage.reshape(n_rows * (height + border), n_cols * (width + border))
+    return montage[:montage.shape[0] - border, :montage.shape[1] - border]
+
+
+# --- Labels ---
+
+def label_montage(montage, names, n_cols, n_rows, panel_h, panel_w, border=montage_border):
+    """RGB copy of a grayscale montage with each panel's name at its lower left, like add_overlays."""
+    labels = shared_cache()
+    rgb = np.repeat(montage[:, :, None], 3, axis=2)
+    size = max(6, int(min(panel_w, panel_h) * label_fraction))
+    text_h = labels.text_height(size)
+    coordinates = [(col * (panel_w + border) + 0.03 * panel_w, row * (panel_h + border) + panel_h - text_h)
+                   for row in range(n_rows) for col in range(n_cols)]
+    return labels.burn_labels(rgb, names, coordinates, size)
+
+
+# --- Per-ROI work ---
+
+_image = None
+
+
+def _init_worker(image_path):
+    global _image
+    _image = open_image(image_path)
+
+
+def render_roi(i, roi, opts):
+    """
+    Crop one ROI and build its labelled montage.
+
+    Returns:
+        dict: index, name, z, z_start, z_end, top, left, bottom, right, crop (Z, C, Y, X) and
+        montage (H, W, 3 uint8), or None if the ROI lies outside the image.
+    """
+    n_slices, n_channels, height, width = _image.shape
+    z = roi_z(roi, n_channels, n_slices)
+    z0, z1 = max(1, z - opts["slice_range"]), min(n_slices, z + opts["slice_range"])
+    top, bottom = max(0, roi["top"]), min(height, roi["bottom"])
+    left, right = max(0, roi["left"]), min(width, roi["right"])
+    if bottom <= top or right <= left:
+        return None
+
+    crop = np.asarray(_image[z0 - 1:z1, :, top:bottom, left:right])
+    center = crop[len(crop) // 2]  # same middle slice as cell_montages (n/2 + 1, 1-based)
+    panels = resample_panels(to_uint8(center), opts["pixel_adjust"] * opts["scale"])
+    montage = tile_panels(panels, opts["cols"], opts["rows"])
+    rgb = label_montage(montage, opts["channels"], opts["cols"], opts["rows"], panels.shape[1], panels.shape[2])
+    return {"index": i, "name": roi["name"], "z": z, "z_start": z0, "z_end": z1,
+            "top": top, "left": left, "bottom": bottom, "right": right, "crop": crop, "montage": rgb}
+
+
+def montage_roi(job):
+    """
+    Worker: crop and montage one ROI. In "files" mode the TIFF and PNG are written here;
+    otherwise the arrays are returned for the parent's ContainerWriter.
+
+    Parameters:
+        job (tuple): (index, roi dict, options dict).
+
+    Returns:
+        (int, str or dict, float, str): index, output name / render_roi() record (None on failure), seconds,
+        and the error (None on success), so one bad ROI doesn't stop the others.
+    """
+    i, roi, opts = job
+    t0 = time.perf_counter()
+    try:
+        record = render_roi(i, roi, opts)
+        if record is None:
+            return i, None, time.perf_counter() - t0, f"ROI outside image ({roi['name']})"
+        out_name = f"{opts['sample_id']}_ROI-{i}_Zpos-{record['z']}_{opts['image_name']}"
+        if opts["format"] != "files":
+            return i, record, time.perf_counter() - t0, None
+        tifffile.imwrite(os.path.join(opts["tiff_folder"], os.path.splitext(out_name)[0] + ".tif"), record["crop"],
+                         imagej=True, metadata={"axes": "ZCYX"})
+        Image.fromarray(record["montage"]).save(os.path.join(opts["png_folder"], out_name + ".png"), compress_level=1)
+        return i, out_name, time.perf_counter() - t0, None
+    except Exception as e:
+        return i, None, time.perf_counter() - t0, f"{type(e).__name__}: {e} ({roi['name']})"
+
+
+# --- Single-container output ---
+# Instead of one TIFF + one PNG per ROI: every crop goes into one chunked HDF5/Zarr container,
+# the montages are packed into a few large sprite-sheet PNGs, and an index (JSON + CSV) says
+# where each ROI's crop and montage are.
+
+SPRITE_PAGE_SIZE = (4096, 4096)  # (height, width) of a sprite-sheet page
+INDEX_FIELDS = ["roi", "name", "z", "z_start", "z_end", "top", "left", "bottom", "right",
+                "crop", "sheet", "sheet_x", "sheet_y", "sheet_w", "sheet_h"]
+
+
+class SpriteSheet:
+    """Shelf-packs montages onto fixed-size pages, writing each page as soon as it is full."""
+
+    def __init__(self, path_pattern, page_size=SPRITE_PAGE_SIZE):
+        self.path_pattern = path_pattern  # e.g. ".../sample_montages_{:03d}.png"
+        self.page_h, self.page_w = page_size
+        self.pages = []
+        self._page = None
+        self._x = self._y = self._shelf_h = 0
+
+    def _new_page(self, min_h, min_w):
+        self.flush()
+        self._page = np.zeros((max(self.page_h, min_h), max(self.page_w, min_w), 3), dtype=np.uint8)
+        self._x = self._y = self._shelf_h = 0
+
+    def add(self, rgb):
+        """Place one montage. Returns (sheet file name, x, y, w, h)."""
+        h, w = rgb.shape[:2]
+        if self._page is not None and self._x + w > self._page.shape[1]:
+            self._x, self._y, self._shelf_h = 0, self._y + self._shelf_h, 0
+        if self._page is None or self._y + h > self._page.shape[0]:
+            self._new_page(h, w)
+        self._page[self._y:self._y + h, self._x:self._x + w] = rgb
+        placed = (os.path.basename(self.path_pattern.format(len(self.pages))), self._x, self._y, w, h)
+        self._x += w
+        self._shelf_h = max(self._shelf_h, h)
+        return placed
+
+    def flush(self):
+        if self._page is None:
+            return
+        used_h = self._y + self._shelf_h
+        path = self.path_pattern.format(len(self.pages))
+        Image.fromarray(self._page[:used_h]).save(path, compress_level=1)
+        self.pages.append(path)
+        self._page = None
+
+
+class ContainerWriter:
+    """Appends ROI crops to one HDF5 (.h5) or Zarr (.zarr) container and montages to a SpriteSheet."""
+
+    def __init__(self, output_dir, sample_id, container_format, attrs):
+        self.format = container_format
+        self.path = os.path.join(output_dir, f"{sample_id}_rois.{'h5' if container_format == 'h5' else 'zarr'}")
+        if container_format == "h5":
+            if h5py is None:
+                raise ImportError("h5py is required for --format h5 (pip install h5py)")
+            self._store = h5py.File(self.path, "w")
+        else:
+            if zarr is None:
+                raise ImportError("zarr is required for --format zarr (pip install zarr)")
+            self._store = zarr.open_group(self.path, mode="w")
+        self._store.attrs.update(attrs)
+        self._crops = self._store.create_group("crops")
+        self.sheet = SpriteSheet(os.path.join(output_dir, f"{sample_id}_montages_{{:03d}}.png"))
+        self.index_base = os.path.join(output_dir, f"{sample_id}_rois_index")
+        self.rows = []
+
+    def add(self, record):
+        key = f"ROI-{record['index']:04d}"
+        crop = record["crop"]
+        if self.format == "h5":
+            dataset = self._crops.create_dataset(key, data=crop, chunks=crop.shape, compression="gzip",
+                                                 compression_opts=1, shuffle=True)
+        else:
+            dataset = self._crops.create_dataset(key, data=crop, chunks=crop.shape)
+        fields = {k: record[k] for k in ("name", "z", "z_start", "z_end", "top", "left", "bottom", "right")}
+        dataset.attrs.update(fields)
+        sheet, x, y, w, h = self.sheet.add(record["montage"])
+        self.rows.append(dict(roi=record["index"], crop=f"crops/{key}", sheet=sheet,
+                              sheet_x=x, sheet_y=y, sheet_w=w, sheet_h=h, **fields))
+
+    def close(self):
+        self.sheet.flush()
+        if self.format == "h5":
+            self._store.close()
+        with open(self.index_base + ".json", "w") as f:
+            json.dump({"container": os.path.basename(self.path), "sheets": [os.path.basename(p) for p in self.sheet.pages],
+                       "rois": self.rows}, f, indent=1)
+        with open(self.index_base + ".csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+def _map_rois(jobs, image_path, workers):
+    """montage_roi over jobs, in a process pool; in this process when workers == 1 (batch mode parallelises over images)."""
+    if workers == 1:
+        _init_worker(image_path)
+        yield from map(montage_roi, jobs)
+        return
+    chunksize = max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(image_path,)) as pool:
+        yield from pool.map(montage_roi, jobs, chunksize=chunksize)
+
+
+def make_roi_montages(image_path, roi_path, output_dir=None, channels=None, rows=1, sample_id=None,
+                      scale=downsampling_scale, pixel_adjust_factor=pixel_adjust, slices=slice_range, workers=None,
+                      output_format="files", container_name=None):
+    """
+    Crop and montage every ROI of roi_path on image_path.
+
+    Parameters:
+        output_format (str): "files" (tiffs/ + pngs/, one of each per ROI), or "h5"/"zarr"
+            (one crop container, sprite-sheet PNGs and a JSON/CSV index).
+        container_name (str): Prefix of the h5/zarr container, sprite sheets and index (default: the sample ID).
+
+    Returns:
+        list: (index, output name or None, seconds, error or None) per ROI.
+    """
+    if Image is None or tifffile is None:
+        raise ImportError("roi_montages needs pillow and tifffile (pip install pillow tifffile)")
+    t0 = time.perf_counter()
+    image = open_image(image_path)
+    n_slices, n_channels = image.shape[:2]
+    rois = read_roi_set(roi_path)
+    output_dir = output_dir or os.path.dirname(os.path.abspath(image_path))
+    tiff_folder, png_folder = os.path.join(output_dir, "tiffs"), os.path.join(output_dir, "pngs")
+    for folder in (tiff_folder, png_folder) if output_format == "files" else (output_dir,):
+        os.makedirs(folder, exist_ok=True)
+
+    names = list(channels or [])
+    names += [f"C{c + 1}" for c in range(len(names), n_channels)]
+    opts = {
+        "sample_id": sample_id or os.path.splitext(os.path.basename(image_path))[0],
+        "image_name": os.path.basename(image_path),
+        "tiff_folder": tiff_folder,
+        "png_folder": png_folder,
+        "channels": names,
+        "rows": rows,
+        "cols": -(-n_channels // rows),
+        "scale": scale,
+        "pixel_adjust": pixel_adjust_factor,
+        "slice_range": slices,
+        "format": output_format,
+    }
+    print(f"=== {len(rois)} ROIs on {opts['image_name']} ({n_slices} slices, {n_channels} channels, "
+          f"{image.shape[3]}x{image.shape[2]}) ===")
+
+    writer = None
+    if output_format != "files":
+        writer = ContainerWriter(output_dir, container_name or opts["sample_id"], output_format,
+                                 {"image": opts["image_name"], "roi_set": os.path.basename(roi_path),
+                                  "channels": names, "axes": "ZCYX"})
+
+    jobs = [(i, roi, opts) for i, roi in enumerate(rois)]
+    results = []
+    for i, result, seconds, error in _map_rois(jobs, image_path, workers):
+        if writer is not None and result is not None:
+            writer.add(result)
+            result = f"crops/ROI-{i:04d}"
+        results.append((i, result, seconds, error))
+    if writer is not None:
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    destination = png_folder if writer is None else f"{writer.path} + {len(writer.sheet.pages)} sprite sheet(s)"
+    print(f"✅ {len(rois)} ROIs in {elapsed:.1f} s ({len(rois) / elapsed:.1f} ROIs/sec) -> {destination}")
+    return results
+
+# --- Batch mode ---
+# Every image under a folder is paired with the RoiSet_<ID>.zip next to it (the ID- token of the
+# image name, as cell_montages.py's dialog defaults it), channel names come from the ch token, and
+# the pairs run in parallel without dialogs. A stamp per image records what its outputs were made
+# from and which files they are, so re-running only redoes new or changed pairs and pairs whose
+# outputs were deleted.
+
+IMAGE_PATTERNS = ("*.tif", "*.tiff", "*.nd2")
+OUTPUT_FOLDERS = ("tiffs", "pngs")  # never searched for input images
+DEFAULT_MEMORY_GB = 8.0
+
+
+def extract_string_with_prefix(input_string, prefix="ch"):
+    """The first "_"-separated token of input_string starting with prefix, or None (as in cell_montages.py)."""
+    for part in input_string.split("_"):
+        if part.startswith(prefix):
+            return part
+    return None
+
+
+def channels_from_name(image_path):
+    """Channel names from the ch token of the file name, e.g. ..._chs-DAPI-488-561-640_... -> [DAPI, 488, 561, 640]."""
+    token = extract_string_with_prefix(os.path.splitext(os.path.basename(image_path))[0], "ch")
+    if not token or "-" not in token:
+        return None
+    return [name for name in token.split("-")[1:] if name]
+
+
+def sample_id_from_name(image_path):
+    """ID-<sample>_FOV-<n> (cell_montages.py's image identifier) from the file name; None without an ID- token."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    tokens = [extract_string_with_prefix(stem, prefix) for prefix in ("ID-", "FOV-")]
+    return "_".join(t for t in tokens if t) if tokens[0] else None
+
+
+def find_roi_set(image_path):
+    """RoiSet_<ID>_FOV-<n>.zip if present, else RoiSet_<ID>.zip, next to the image; None if neither exists."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    sample = extract_string_with_prefix(stem, "ID-")
+    if sample is None:
+        return None
+    fov = extract_string_with_prefix(stem, "FOV-")
+    folder = os.path.dirname(image_path)
+    names = ([f"RoiSet_{sample}_{fov}.zip"] if fov else []) + [f"RoiSet_{sample}.zip"]
+    for name in names:
+        if os.path.isfile(os.path.join(folder, name)):
+            return os.path.join(folder, name)
+    return None
+
+
+def find_pairs(root):
+    """
+    (image, RoiSet) pairs under root, recursively, and the images with no RoiSet.
+
+    Returns:
+        (list, list): sorted (image path, roi path) pairs; sorted unmatched image paths.
+    """
+    pairs, unmatched = [], []
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        dirnames[:] = sorted(d for d in dirnames if d not in OUTPUT_FOLDERS)
+        for fname in sorted(filenames):
+            if not any(fnmatch.fnmatch(fname.lower(), p) for p in IMAGE_PATTERNS):
+                continue
+            image_path = os.path.join(dirpath, fname)
+            roi_path = find_roi_set(image_path)
+            if roi_path:
+                pairs.append((image_path, roi_path))
+            else:
+                unmatched.append(image_path)
+    return pairs, unmatched
+
+
+def estimate_memory(image_path):
+    """Bytes one pair may hold: the whole image for lazy/chunked readers, a few ROI windows for memmapped or page-read TIFFs."""
+    image = open_image(image_path)
+    full = int(np.prod(image.shape)) * image.dtype.itemsize
+    return full // 16 if isinstance(image, (np.memmap, TiffPlanes)) else full
+
+
+def stamp_path(image_path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + ".roi_montages.json")
+
+
+def pair_stamp(image_path, roi_path, settings):
+    """What a pair's outputs depend on: size and mtime of both inputs, plus the montage settings."""
+    stamp = {"settings": settings}
+    for key, path in (("image", image_path), ("rois", roi_path)):
+        st = os.stat(path)
+        stamp[key] = [os.path.basename(path), st.st_size, st.st_mtime_ns]
+    return stamp
+
+
+def pair_outputs(results, output_dir, output_format, container_name):
+    """Files a pair wrote, relative to output_dir: per-ROI TIFFs and PNGs, or the container, index and sprite sheets."""
+    if output_format == "files":
+        return [path for _, out_name, _, error in results if error is None
+                for path in (os.path.join("tiffs", os.path.splitext(out_name)[0] + ".tif"),
+                             os.path.join("pngs", out_name + ".png"))]
+    index_base = f"{container_name}_rois_index"
+    with open(os.path.join(output_dir, index_base + ".json")) as f:
+        index = json.load(f)
+    return [index["container"], index_base + ".json", index_base + ".csv"] + index["sheets"]
+
+
+def failed_pair(image_path, roi_path, error=None):
+    """Batch record of a pair that produced nothing (montage_pair() fills it in as it goes)."""
+    return {"image": image_path, "rois": roi_path, "status": "failed", "n_rois": None, "skipped": 0,
+            "seconds": 0.0, "error": error}
+
+
+def montage_pair(image_path, roi_path, output_dir, settings, force=False):
+    """
+    Batch worker: montage one image/RoiSet pair in this process, unless its stamp says the outputs are current.
+
+    Returns:
+        dict: image, rois, status ("montaged", "up to date" or "failed"), n_rois, skipped, seconds, error.
+    """
+    t0 = time.perf_counter()
+    output_dir = output_dir or os.path.dirname(image_path)
+    record = failed_pair(image_path, roi_path)
+    try:
+        stamp = pair_stamp(image_path, roi_path, settings)
+        stamp_file = stamp_path(image_path, output_dir)
+        if not force and os.path.isfile(stamp_file):
+            with open(stamp_file) as f:
+                previous = json.load(f)
+            # current only if the inputs and settings match and nothing it wrote has been deleted since
+            outputs = previous.get("outputs")
+            if ({k: previous.get(k) for k in stamp} == json.loads(json.dumps(stamp)) and outputs is not None
+                    and all(os.path.exists(os.path.join(output_dir, path)) for path in outputs)):
+                record.update(status="up to date", n_rois=previous.get("n_rois"))
+                return record
+
+        channels = settings["channels"] or channels_from_name(image_path)
+        # a MIP and its z-stack share ID/FOV and RoiSet: keep their containers apart
+        container_name = os.path.splitext(os.path.basename(image_path))[0]
+        results = make_roi_montages(image_path, roi_path, output_dir, channels, settings["rows"], sample_id_from_name(image_path),
+                                    settings["scale"], settings["pixel_adjust"], settings["slice_range"],
+                                    workers=1, output_format=settings["format"], container_name=container_name)
+        skipped = sum(error is not None for _, _, _, error in results)
+        stamp["n_rois"] = len(results)
+        stamp["outputs"] = pair_outputs(results, output_dir, settings["format"], container_name)
+        with open(stamp_file, "w") as f:
+            json.dump(stamp, f, indent=1)
+        record.update(status="montaged", n_rois=len(results), skipped=skipped)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        record["seconds"] = time.perf_counter() - t0
+    return record
+
+
+def run_batch(root, output_dir=None, settings=None, workers=None, memory_gb=DEFAULT_MEMORY_GB, force=False):
+    """
+    Montage every image/RoiSet pair under root, one pair per process, never starting a pair that would
+    take the estimated memory of the running pairs over memory_gb. Prints a summary table.
+
+    Parameters:
+        settings (dict): channels (None: from each file name), rows, scale, pixel_adjust, slice_range, format.
+
+    Returns:
+        list: montage_pair() records.
+    """
+    t0 = time.perf_counter()
+    pairs, unmatched = find_pairs(root)
+    print(f"=== Batch: {len(pairs)} image/RoiSet pair(s) under {root}, {len(unmatched)} image(s) without a RoiSet ===")
+    budget = memory_gb * 1e9
+    cost = {}
+    for image_path, _ in pairs:
+        try:
+            cost[image_path] = estimate_memory(image_path)
+        except Exception:
+            cost[image_path] = 0  # unreadable: let montage_pair report it
+    # biggest first, so the large pairs don't end up running alone at the end
+    queue = sorted(pairs, key=lambda pair: -cost[pair[0]])
+
+    records = []
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while queue or running:
+            while queue:
+                image_path, roi_path = queue[0]
+                in_use = sum(cost[p] for p, _ in running.values())
+                if running and in_use + cost[image_path] > budget:
+                    break
+                queue.pop(0)
+                try:
+                    future = pool.submit(montage_pair, image_path, roi_path, output_dir, settings, force)
+                except BrokenProcessPool as e:
+                    records.append(failed_pair(image_path, roi_path, f"{type(e).__name__}: {e}"))
+                    continue
+                running[future] = (image_path, roi_path)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_path, roi_path = running.pop(future)
+                try:
+                    records.append(future.result())
+                except Exception as e:
+                    # a worker killed outright (OOM killer, os._exit) breaks the pool: the pairs it takes
+                    # down and any not yet started are recorded as failed, the finished ones are kept
+                    records.append(failed_pair(image_path, roi_path, f"{type(e).__name__}: {e}"))
+    records.sort(key=lambda r: r["image"])
+
+    common = os.path.commonpath([r["image"] for r in records]) if len(records) > 1 else os.path.dirname(records[0]["image"]) if records else ""
+    print(f"{'image':<60} {'status':<11} {'ROIs':>5} {'skipped':>7} {'time (s)':>9}")
+    for r in records:
+        name = os.path.relpath(r["image"], common) if common else r["image"]
+        n_rois = "" if r["n_rois"] is None else r["n_rois"]
+        print(f"{name:<60} {r['status']:<11} {n_rois:>5} {r['skipped']:>7} {r['seconds']:>9.2f}")
+        if r["error"]:
+            print(f"    [FAILED] {r['error']}")
+    for image_path in unmatched:
+        print(f"[NO ROISET] {image_path}")
+    counts = {status: sum(r["status"] == status for r in records) for status in ("montaged", "up to date", "failed")}
+    print(f"✅ {counts['montaged']} montaged, {counts['up to date']} up to date, {counts['failed']} failed "
+          f"in {time.perf_counter() - t0:.1f} s")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop and montage every ROI of an ImageJ RoiSet, outside Fiji.")
+    parser.add_argument("image", help="Multi-channel MIP or z-stack (.tif or .nd2); with --batch, a folder.")
+    parser.add_argument("rois", nargs="?", default=None, help="RoiSet .zip (or a single .roi) drawn on the image.")
+    parser.add_argument("-o", "--output", default=None, help="Folder for tiffs/ and pngs/ (default: the image's folder).")
+    parser.add_argument("-c", "--channels", nargs="+", default=None,
+                        help="Channel names, in order (batch default: the ch token of each file name).")
+    parser.add_argument("--rows", type=int, default=1, help="Montage rows.")
+    parser.add_argument("--sample-id", default=None, help="Output name prefix (default: the image name).")
+    parser.add_argument("--scale", type=float, default=downsampling_scale, help="Montage downsampling scale.")
+    parser.add_argument("--pixel-adjust", type=float, default=pixel_adjust, help="Upscaling before montaging.")
+    parser.add_argument("--slice-range", type=int, default=slice_range, help="Slices saved above and below each ROI.")
+    parser.add_argument("-f", "--format", choices=["files", "h5", "zarr"], default="files",
+                        help="files: a TIFF and a PNG per ROI; h5/zarr: one crop container + sprite sheets + index.")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Worker processes (default: CPU count); with --batch, pairs run in parallel.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Montage every image under the folder that has a RoiSet_<ID>.zip next to it.")
+    parser.add_argument("--memory-gb", type=float, default=DEFAULT_MEMORY_GB,
+                        help="Batch: estimated memory the parallel pairs may use together.")
+    parser.add_argument("--force", action="store_true", help="Batch: redo pairs whose outputs are up to date.")
+    args = parser.parse_args()
+
+    if args.batch:
+        settings = {"channels": args.channels, "rows": args.rows, "scale": args.scale, "pixel_adjust": args.pixel_adjust,
+                    "slice_range": args.slice_range, "format": args.format}
+        records = run_batch(args.image, args.output, settings, args.workers, args.memory_gb, args.force)
+        if any(r["status"] == "failed" for r in records):
+            sys.exit(1)
+        return
+    if args.rois is None:
+        parser.error("rois is required unless --batch is given")
+
+    results = make_roi_montages(args.image, args.rois, args.output, args.channels, args.rows, args.sample_id,
+                                args.scale, args.pixel_adjust, args.slice_range, args.workers, args.format)
+    failed = [(i, error) for i, _, _, error in results if error]
+    for i, error in failed:
+        print(f"[SKIPPED] ROI {i}: {error}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,9 +23,24 @@ import re
 from ij.gui import Overlay, TextRoi, Roi, GenericDialog
 from java.awt import Font, Color
 
-#stuff for saving
-from ij.io import FileSaver
 import os
+import sys
+
+# montage_labels.py (label glyph cache) and background_writer.py (image saving) sit next to this
+# script. Fiji only defines __file__ for some ways of running a script (not from the script editor or
+# the Plugins menu), so set fiji_friends_dir to this repo's folder if they aren't found.
+fiji_friends_dir = r""
+
+for _folder in (fiji_friends_dir,
+                os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else "",
+                os.path.dirname(os.path.abspath(sys.argv[0])) if sys.argv and sys.argv[0] else ""):
+    if _folder and os.path.isfile(os.path.join(_folder, "montage_labels.py")) and _folder not in sys.path:
+        sys.path.append(_folder)
+try:
+    from montage_labels import shared_cache
+    from background_writer import write_image
+except ImportError:
+    raise ImportError("montage_labels.py / background_writer.py not found: set fiji_friends_dir to this repo's folder")
 
 active_image = IJ.getImage() #handle for referring to image
 originalName = active_image.getTitle() # Get the title of the currently open window
@@ -220,19 +235,9 @@ def set_channel_names(sample_id, start_slice, end_slice, skip_size):
 # imp = IJ.getImage()
 # overlay = Overlay()
 
-def add_overlays(imp, overlay, channels, coordinates, annotation_text_size):
-    font = Font("SanSerif", Font.PLAIN, annotation_text_size) #this is set for everything
-
-    for i, (x, y) in enumerate(coordinates):
-        channel_name = channels[i]
-        roi = TextRoi(int(y), int(x), channel_name, font)
-        roi.setStrokeColor(Color.yellow)
-        roi.setFillColor(Color(0,0,0,0.5))  
-        overlay.add(roi)
-        imp.setRoi(roi)
-            
-    #imp.overlay.add(roi)
-    imp.setOverlay(overlay)
+def add_overlays(imp, channels, coordinates, annotation_text_size):
+    # labels are burned into the montage from the shared glyph cache (coordinates here are (y, x))
+    shared_cache().burn_labels(imp, channels, [(y, x) for (x, y) in coordinates], annotation_text_size)
     imp.show()
 
 
@@ -247,8 +252,7 @@ print("Names set: {}".format(channels))
 print("\nTime to add overlays...")
 # Add overlays
 imp = IJ.getImage()
-overlay = Overlay()
-add_overlays(imp, overlay, channels, coordinates, annotation_text_size)
+add_overlays(imp, channels, coordinates, annotation_text_size)
 print("Overlays of sample reference information done.")
 
 ## everything above this works! ok. yay!
@@ -267,10 +271,7 @@ else:
     save_as_png = os.path.join(os.path.join(directory, originalNameWithoutExt + "_annotated.png"))
     save_as_jpg = os.path.join(os.path.join(directory, originalNameWithoutExt + "_annotated.jpg"))
 
-FileSaver(IJ.getImage()).saveAsPng(save_as_png)
-print("Saved PNG....")
-
-# # Save as JPEG
-FileSaver(IJ.getImage()).saveAsJpeg(save_as_jpg)
-print("Saved jpg. Done!")
+# # Save as PNG and JPEG, both encoded from one render
+write_image(IJ.getImage(), [save_as_png, save_as_jpg])
+print("Saved PNG and jpg. Done!")
 
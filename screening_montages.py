@@ -0,0 +1,907 @@
+"""
+Screening montages without Fiji: the same annotated slice montages as screening_montage_nikon.py,
+for a whole screening directory at once, with no open image and no dialogs.
+
+Every parameter the Fiji script asks for comes from the file name, through the same
+extract_variables_from_filename():
+    YYMMDD_ID-iXXXX_slice-sA-sB_obj-..._chs-DAPI-488-561.nd2
+        -> sample ID-iXXXX, slices A..B (one stack plane each), channels DAPI/488/561.
+The planes are composited in colour, tiled 2 (up to 11 slices) or 3 columns wide with a 40 px
+border, downsampled by scale, labelled s<A>, s<A+1>, ... (the first one with the sample ID), and
+saved as <name>_annotated.png and .jpg next to the input.
+
+Planes are downsampled as they are read (k x k block averages, or every k-th pixel with
+--read-mode stride) and the montage is assembled from those, so a worker holds about one
+full-resolution frame (one strip of a plane for uncompressed TIFFs, one page for compressed ones,
+which are decoded page by page through tiff_planes.py) plus the montage.
+
+For scales near 1 the montage is too big for one PNG/JPEG: --pyramid tiff|zarr writes it as a
+tiled, pyramidal BigTIFF (<name>_annotated.ome.tif) or OME-Zarr, labels included, rendered and
+written one band of tile rows at a time, plus a <name>_annotated_overview.jpg for browsing.
+
+The montage-resolution planes are cached in <output folder>/.montage_cache, keyed by the file's
+size, mtime and a sampled fingerprint plus scale and read mode, so re-running with other
+--columns, --offset or --label-size reads only the cache (--no-cache to bypass it).
+
+Contrast is set per channel from percentiles of a fixed-size histogram of a strided sample of the
+montage-resolution planes (no full-resolution pass), and written to <name>_annotated_lut.json
+next to the output; --lut reuse picks those up again (edit them to adjust by hand) and --lut FILE
+applies one LUT to a whole screen. --layout channels makes the single-image channel montage of
+screening_single-img_nikon.py instead of the slice montage, saved as <name>_annotated_channels.*
+so the two layouts don't overwrite each other.
+
+Files run in parallel worker processes, each capped at --memory-gb of address space so one huge
+stack fails on its own instead of taking the machine down. A run summary (per-file status and
+read/montage/save timings) is printed and written to screening_montages_<YYMMDD-HHMMSS>.csv.
+
+Usage:
+    python screening_montages.py /Volumes/users/Hugo/screen-240612
+    python screening_montages.py E:\\screen-240612 -j 6 --memory-gb 6 --scale 0.2
+    python screening_montages.py 240612_ID-i1264_slice-s1-s22_obj-10x_chs-DAPI-488.nd2
+    python screening_montages.py /Volumes/users/Hugo/screen-240612 --scale 1 --pyramid tiff
+    python screening_montages.py /Volumes/users/Hugo/screen-240612 --columns 4 --label-size 250   # from the cache
+    python screening_montages.py /Volumes/users/Hugo/single-240612 --layout channels --lut reference_lut.json
+
+Dependencies:
+    pip install numpy tifffile pillow
+    pip install nd2   # .nd2 input
+    pip install zarr  # --pyramid zarr
+"""
+
+import os
+import sys
+import csv
+import time
+import json
+import fnmatch
+import hashlib
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import resource  # not on Windows: no per-worker memory cap there
+except ImportError:
+    resource = None
+
+try:
+    import tifffile  # pip install tifffile
+except ImportError:
+    tifffile = None
+
+try:
+    import nd2  # pip install nd2
+except ImportError:
+    nd2 = None
+
+try:
+    import zarr  # pip install zarr, for --pyramid zarr
+except ImportError:
+    zarr = None
+
+try:
+    from PIL import Image  # pip install pillow
+except ImportError:
+    Image = None
+
+from montage_labels import shared_cache
+from tiff_planes import TiffPlanes
+
+# === USER CONFIGURATION ===
+downsampling_scale = 0.1  # "Make Montage... scale=", as in the Fiji dialog
+offset = 0.1  # label offset from the panel's bottom-left corner, as a fraction of the panel
+skip_size = 1  # label step between consecutive planes
+montage_border = 40  # px between panels ("border=40")
+border_color = (255, 255, 255)  # "use" foreground colour
+display_percentiles = (0.1, 99.9)  # per-channel auto-contrast limits, in place of the hand-set B&C
+contrast_samples = 1_000_000  # pixels per channel the auto-contrast histograms are built from
+histogram_bins = 4096
+jpeg_quality = 85
+memory_limit_gb = 4.0  # address-space cap per worker process
+read_mode = "block"  # "block": k x k block averages at read time; "stride": every k-th pixel (fastest, aliased)
+read_strip_rows = 64  # montage rows reduced per read from a memmapped TIFF
+pyramid_tile = 512  # px, tiles of the pyramidal BigTIFF / OME-Zarr output
+pyramid_band_tiles = 4  # tile rows rendered at once (a power of two)
+overview_width = 2048  # px, the overview JPEG written next to a pyramid
+cache_folder = ".montage_cache"  # in the output folder; montage-resolution planes for re-layout runs
+fingerprint_blocks = 16  # 64 KB blocks sampled per file for the cache key
+cache_version = 2  # part of the cache key; bump when what is stored changes
+IMAGE_PATTERNS = ("*.nd2", "*.tif", "*.tiff")
+# channel colours by name; unknown names take Fiji's composite order
+CHANNEL_COLORS = {
+    "DAPI": (0, 0, 255), "405": (0, 0, 255), "Hoechst": (0, 0, 255),
+    "488": (0, 255, 0), "GFP": (0, 255, 0), "FITC": (0, 255, 0),
+    "561": (255, 0, 0), "568": (255, 0, 0), "594": (255, 0, 0), "mCherry": (255, 0, 0),
+    "640": (255, 0, 255), "647": (255, 0, 255), "Cy5": (255, 0, 255),
+}
+DEFAULT_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (128, 128, 128), (0, 255, 255), (255, 0, 255), (255, 255, 0)]
+# ===========================
+
+
+# --- File name parsing (as in screening_montage_nikon.py) ---
+
+def remove_non_numeric(string):
+    return ''.join(c for c in string if c.isdigit() or c == '.')
+
+def extract_variables_from_filename(filename):
+    """
+    Parse ID-, slice- and chs- tokens from a screening file name.
+
+    Returns:
+        (str or None, float or None, float or None, list, dict): sample ID, start slice, end slice,
+        channel names and every key-value pair of the name.
+    """
+    filename, _ = os.path.splitext(os.path.basename(filename))
+    pairs = {}
+    for element in filename.split("_"):
+        key_value = element.split("-", 1)
+        if len(key_value) == 2:
+            key, value = key_value
+            pairs[key] = value
+
+    sample_id = pairs.get('ID')
+
+    start_slice, end_slice = None, None
+    slice_values = pairs.get('slice')
+    if slice_values:
+        slices = slice_values.split('-')
+        start_slice_str = remove_non_numeric(slices[0])
+        end_slice_str = remove_non_numeric(slices[1]) if len(slices) > 1 else None
+        try:
+            start_slice = float(start_slice_str)
+            end_slice = float(end_slice_str) if end_slice_str else None
+        except (ValueError, TypeError):
+            print(f"Error: Unable to convert start or end slice to float ({filename}).")
+
+    channels = pairs.get('chs')
+    channels = channels.split("-") if channels else []
+    return sample_id, start_slice, end_slice, channels, pairs
+
+
+def define_montage(num_slices, columns=None):
+    """(columns, rows): columns if given, else 2 up to 11 slices and 3 above; enough rows for every slice."""
+    montage_col = columns or (2 if num_slices <= 11 else 3)
+    return montage_col, -(-num_slices // montage_col)
+
+
+def define_ch_montage(num_channels, columns=None):
+    """(columns, rows) for a channel montage: one row up to 4 channels, else 3 columns (screening_single-img_nikon.py)."""
+    montage_col = columns or (num_channels if num_channels <= 4 else 3)
+    return montage_col, -(-num_channels // montage_col)
+
+
+def set_ch_names(sample_id, start_slice, channels, n_channels):
+    """Channel-montage labels: the channel names, the first one as <sample>-<start>_<name>."""
+    names = [channels[c] if c < len(channels) else f"C{c + 1}" for c in range(n_channels)]
+    if names:
+        names[0] = f"{sample_id}-{start_slice}_{names[0]}"
+    return names
+
+
+def set_channel_names(sample_id, start_slice, num_slices, skip_size=skip_size):
+    """Panel labels s<start>, s<start+skip>, ...; the first one prefixed with the sample ID."""
+    names = [f"s{start_slice + i * skip_size}" for i in range(num_slices)]
+    if names:
+        names[0] = f"{sample_id}_{names[0]}"
+    return names
+
+
+# --- Image access ---
+
+def _to_ncyx(array, axes):
+    """
+    View of array as (N, C, Y, X): N is the first of position/time/Z with more than one plane
+    (Fiji shows the slices as either; it doesn't matter), the other stack axes at index 0.
+    """
+    axes = axes.upper().replace("S", "C") if "C" not in axes.upper() else axes.upper()
+    sizes = dict(zip(axes, array.shape))
+    stack_axis = next((ax for ax in "PTZQ" if sizes.get(ax, 1) > 1), None)
+    index = tuple(slice(None) if ax in "CYX" or ax == stack_axis else 0 for ax in axes)
+    array = array[index]
+    kept = "".join(ax for ax in axes if ax in "CYX" or ax == stack_axis)
+    if stack_axis is None:
+        array, kept, stack_axis = array[np.newaxis], "N" + kept, "N"
+    if "C" not in kept:
+        array, kept = array[np.newaxis], "C" + kept
+    return np.transpose(array, [kept.index(ax) for ax in (stack_axis, "C", "Y", "X")])
+
+
+def open_stack(path):
+    """The screening stack as a lazily-read (N, C, Y, X) array (memmap / TiffPlanes / dask), one N per slice."""
+    if path.lower().endswith(".nd2"):
+        if nd2 is None:
+            raise ImportError("nd2 is required for .nd2 images (pip install nd2)")
+        with nd2.ND2File(path) as f:
+            axes = "".join(f.sizes)
+        return _to_ncyx(nd2.imread(path, dask=True), axes)
+    if tifffile is None:
+        raise ImportError("tifffile is required for TIFF images (pip install tifffile)")
+    with tifffile.TiffFile(path) as tif:
+        axes = tif.series[0].axes
+    try:
+        return _to_ncyx(tifffile.memmap(path, mode="r"), axes)
+    except ValueError:
+        pass
+    try:
+        # compressed: no memmap, but every (slice, channel) plane is its own page, decoded on demand
+        return TiffPlanes(path, stack_axes="PTZQ")
+    except ValueError as e:
+        print(f"[WARN] {e}: reading the whole stack")
+        return _to_ncyx(tifffile.imread(path), axes)
+
+
+# --- Montage ---
+
+def channel_colors(names, n_channels):
+    colors = []
+    for c in range(n_channels):
+        name = names[c] if c < len(names) else ""
+        colors.append(CHANNEL_COLORS.get(name, DEFAULT_COLORS[c % len(DEFAULT_COLORS)]))
+    return np.asarray(colors, dtype=np.float32) / 255.0
+
+
+# --- Auto-contrast ---
+# Replaces the hand-set B&C the Fiji scripts assume. The planes it sees are already at montage
+# resolution (a coarse level of the stack, block-averaged or strided at read time); on top of that
+# each channel is strided down to contrast_samples pixels and binned into a fixed-size histogram,
+# so the cost doesn't grow with the file or the scale. The limits are written to
+# <name>_annotated_lut.json and can be reused (--lut reuse) or shared across a screen (--lut FILE).
+
+def channel_histograms(planes, max_samples=contrast_samples, bins=histogram_bins):
+    """
+    Fixed-size histogram per channel of a strided sample of (N, C, h, w) planes.
+
+    Returns:
+        (np.ndarray, np.ndarray, int): (C, bins) counts, (C, 2) value range the bins span, pixels sampled per channel.
+    """
+    n, n_channels, height, width = planes.shape
+    k = max(1, int(np.ceil(np.sqrt(n * height * width / max_samples))))
+    sample = np.moveaxis(planes[:, :, ::k, ::k], 1, 0).reshape(n_channels, -1)
+    spans = np.stack([sample.min(axis=1), sample.max(axis=1)], axis=1).astype(np.float64)
+    width_per_bin = np.maximum(spans[:, 1] - spans[:, 0], 1e-6) / bins
+    index = ((sample - spans[:, :1]) / width_per_bin[:, None]).astype(np.int64).clip(0, bins - 1)
+    hists = np.stack([np.bincount(row, minlength=bins) for row in index])
+    return hists, spans, sample.shape[1]
+
+
+def histogram_percentiles(hists, spans, percentiles):
+    """(C, len(percentiles)) values at the given percentiles of each channel's histogram."""
+    bins = hists.shape[1]
+    cdf = np.cumsum(hists, axis=1) / np.maximum(hists.sum(axis=1, keepdims=True), 1)
+    out = np.empty((len(hists), len(percentiles)), dtype=np.float32)
+    for c in range(len(hists)):
+        index = np.minimum(np.searchsorted(cdf[c], np.asarray(percentiles) / 100.0), bins - 1)
+        out[c] = spans[c, 0] + (index + 0.5) * (spans[c, 1] - spans[c, 0]) / bins  # bin centres
+    return out
+
+
+def display_ranges(planes, percentiles=display_percentiles, max_samples=contrast_samples):
+    """(C, 2) low/high display limits per channel of (N, C, h, w) montage planes, from sampled histograms."""
+    hists, spans, _ = channel_histograms(planes, max_samples)
+    return histogram_percentiles(hists, spans, percentiles)
+
+
+def lut_path(base):
+    return base + "_lut.json"
+
+
+def write_lut(path, image_path, names, colors, ranges, source="auto", percentiles=None):
+    """
+    Write the LUT a montage was made with.
+
+    Parameters:
+        source (str): "auto" when the limits are percentiles of this image (recorded in "percentiles"),
+            else the LUT JSON they were taken from.
+    """
+    channels = [{"name": names[c] if c < len(names) else f"C{c + 1}",
+                 "color": [int(round(v * 255)) for v in colors[c]],
+                 "min": round(float(ranges[c, 0]), 3), "max": round(float(ranges[c, 1]), 3)}
+                for c in range(len(ranges))]
+    lut = {"image": os.path.basename(image_path), "source": source}
+    if percentiles is not None:
+        lut["percentiles"] = list(percentiles)
+    lut["channels"] = channels
+    with open(path, "w") as f:
+        json.dump(lut, f, indent=1)
+
+
+def read_lut(path, n_channels):
+    """(names, colors (C, 3) in 0-1, ranges (C, 2)) from a LUT JSON written by write_lut()."""
+    with open(path) as f:
+        channels = json.load(f)["channels"]
+    if len(channels) < n_channels:
+        raise ValueError(f"{path} has {len(channels)} channel(s), the image has {n_channels}")
+    channels = channels[:n_channels]
+    names = [ch.get("name", f"C{c + 1}") for c, ch in enumerate(channels)]
+    colors = np.asarray([ch["color"] for ch in channels], dtype=np.float32) / 255.0
+    ranges = np.asarray([[ch["min"], ch["max"]] for ch in channels], dtype=np.float32)
+    return names, colors, ranges
+
+
+def composite(planes, colors, ranges):
+    """(C, Y, X) planes -> (Y, X, 3) uint8, additive colour composite like Fiji's composite mode."""
+    low, high = ranges[:, 0], ranges[:, 1]
+    scaled = (planes.astype(np.float32) - low[:, None, None]) / np.maximum(high - low, 1e-6)[:, None, None]
+    rgb = np.tensordot(np.clip(scaled, 0, 1), colors, axes=(0, 0))
+    return np.clip(rgb * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def panel_size(stack, scale):
+    return max(1, int(stack.shape[2] * scale)), max(1, int(stack.shape[3] * scale))
+
+
+def _block_mean(plane, k):
+    """Mean of every k x k block of a 2D plane (edge rows/columns that don't fill a block are dropped)."""
+    height, width = (plane.shape[0] // k) * k, (plane.shape[1] // k) * k
+    return plane[:height, :width].reshape(height // k, k, width // k, k).mean(axis=(1, 3), dtype=np.float32)
+
+
+def read_plane_downsampled(plane, scale, mode=read_mode, strip_rows=read_strip_rows):
+    """
+    One (Y, X) channel plane read at scale, without holding the full-resolution plane when it is a memmap.
+
+    Parameters:
+        plane (array): Lazily-read plane (memmap view, or dask array for ND2).
+        mode (str): "block": average k x k blocks (k = 1 / scale, rounded down), read in strips of
+            strip_rows output rows; "stride": every k-th pixel only, so only those rows are read.
+
+    Returns:
+        np.ndarray: (int(Y * scale), int(X * scale)) float32.
+    """
+    height, width = plane.shape
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    k = max(1, int(1 / scale))
+    if mode == "stride":
+        small = np.asarray(plane[::k, ::k], dtype=np.float32)
+    elif isinstance(plane, np.ndarray):
+        # memmap: reduce strip by strip, so only strip_rows * k full-resolution rows are ever in memory
+        step = strip_rows * k
+        small = np.concatenate([_block_mean(np.asarray(plane[y:y + step]), k)
+                                for y in range(0, (height // k) * k, step)])
+    else:
+        # dask/ND2 chunks are whole frames: read the frame once, reduce it, let it go
+        small = _block_mean(np.asarray(plane), k)
+    if small.shape[::-1] != size:
+        small = np.asarray(Image.fromarray(small).resize(size, Image.BILINEAR))
+    return small
+
+
+def read_montage_planes(stack, scale, mode=read_mode, n_planes=None):
+    """
+    Every (slice, channel) plane of stack at montage resolution, read one slice at a time.
+
+    Returns:
+        np.ndarray: (N, C, panel height, panel width) float32, about the size of the montage itself.
+    """
+    n_planes, n_channels = min(n_planes or stack.shape[0], stack.shape[0]), stack.shape[1]
+    planes = np.empty((n_planes, n_channels) + panel_size(stack, scale), dtype=np.float32)
+    for i in range(n_planes):
+        # ND2 (dask) chunks are whole multi-channel frames: decode each frame once for all its channels;
+        # a memmap slice stays lazy and is reduced strip by strip per channel; a compressed TIFF
+        # decodes one (slice, channel) page at a time
+        if isinstance(stack, TiffPlanes):
+            for c in range(n_channels):
+                planes[i, c] = read_plane_downsampled(stack[i, c], scale, mode)
+            continue
+        frame = stack[i] if isinstance(stack, np.ndarray) else np.asarray(stack[i])
+        for c in range(n_channels):
+            planes[i, c] = read_plane_downsampled(frame[c], scale, mode)
+    return planes
+
+
+def build_montage(planes, labels, colors, ranges, scale=downsampling_scale, label_offset=offset, columns=None,
+                  label_size=None, layout="slices"):
+    """
+    Composite and tile every plane into the montage canvas, one slice at a time, then burn in the labels.
+
+    Parameters:
+        planes (np.ndarray): (N, C, h, w) planes already at montage resolution (read_montage_planes()).
+        labels (list): One label per plane, e.g. from set_channel_names().
+        scale (float): The downsampling scale, for the label size.
+        columns (int): Montage columns (default: define_montage()'s choice).
+        label_size (int): Label font size at scale 1 (default: 400, as in the Fiji script).
+        layout (str): "slices": one composite panel per plane (screening_montage_nikon.py);
+            "channels": one panel per channel of the first plane, each in its own colour
+            (screening_single-img_nikon.py).
+
+    Returns:
+        np.ndarray: (H, W, 3) uint8 montage.
+    """
+    if layout == "channels":
+        n_panels = planes.shape[1]
+        cols, rows = define_ch_montage(n_panels, columns)
+        panel = lambda i: composite(planes[0, i:i + 1], colors[i:i + 1], ranges[i:i + 1])
+    else:
+        n_panels = planes.shape[0]
+        cols, rows = define_montage(n_panels, columns)
+        panel = lambda i: composite(planes[i], colors, ranges)
+    panel_h, panel_w = planes.shape[2:]
+    step_h, step_w = panel_h + montage_border, panel_w + montage_border
+    canvas = np.empty((rows * step_h - montage_border, cols * step_w - montage_border, 3), dtype=np.uint8)
+    canvas[...] = border_color
+    for i in range(n_panels):
+        row, col = divmod(i, cols)
+        canvas[row * step_h:row * step_h + panel_h, col * step_w:col * step_w + panel_w] = panel(i)
+
+    size, coordinates = label_positions(cols, rows, panel_h, panel_w, scale, label_offset, label_size)
+    return shared_cache().burn_labels(canvas, labels, coordinates, size)
+
+
+def label_positions(cols, rows, panel_h, panel_w, scale, label_offset=offset, label_size=None):
+    """
+    Label font size and top-left corner per panel: near the bottom-left of each panel, offset inwards
+    by label_offset of the panel, as add_overlays placed them.
+    """
+    size = max(6, int((label_size or 400) * scale))
+    text_h = shared_cache().text_height(size)
+    step_h, step_w = panel_h + montage_border, panel_w + montage_border
+    coordinates = [(col * step_w + label_offset * panel_w, row * step_h + (1 - label_offset) * panel_h - text_h)
+                   for row in range(rows) for col in range(cols)]
+    return size, coordinates
+
+
+# --- Pyramidal output ---
+# At a scale near 1 the montage is gigapixel: it is never held whole. It is rendered in bands of
+# band_tiles tile rows straight from the stack (labels burned into each band), and every band is
+# written as tiles to level 0 and halved into each coarser level as it goes. OME-Zarr levels are
+# written in place; for BigTIFF, levels 1+ wait in temporary memmaps until level 0 is done.
+
+def _resize_area(plane, size):
+    """(rows, cols) float32 plane resized to size (width, height) by area averaging."""
+    if plane.shape[::-1] == tuple(size):
+        return plane
+    return np.asarray(Image.fromarray(plane).resize(size, Image.BOX))
+
+
+def render_band(stack, y0, y1, cols, panel_h, panel_w, scale, colors, ranges, labels, label_size, coordinates,
+                frames=None, timings=None):
+    """
+    Montage rows y0:y1, read from the stack at scale, with the labels burned in.
+
+    Parameters:
+        frames (dict): Decoded frames by slice index, kept across calls for dask/ND2 and compressed TIFF
+            stacks so a frame is decoded once per panel row rather than once per band and channel;
+            frames of rows the band doesn't touch are dropped.
+        timings (dict): If given, "read_s" is increased by the time spent reading the stack.
+
+    Returns:
+        np.ndarray: (y1 - y0, montage width, 3) uint8.
+    """
+    n_planes, n_channels, height = stack.shape[:3]
+    step_h, step_w = panel_h + montage_border, panel_w + montage_border
+    band = np.empty((y1 - y0, cols * step_w - montage_border, 3), dtype=np.uint8)
+    band[...] = border_color
+    rows = range(y0 // step_h, (y1 - 1) // step_h + 1)
+    lazy = not isinstance(stack, np.ndarray)
+    if lazy and frames is not None:
+        keep = {row * cols + col for row in rows for col in range(cols)}
+        for i in [i for i in frames if i not in keep]:
+            del frames[i]
+    for row in rows:
+        top = row * step_h
+        py0, py1 = max(0, y0 - top), min(panel_h, y1 - top)
+        if py1 <= py0:
+            continue  # the band only crosses the border below this row
+        sy0 = min(height - 1, int(py0 / scale))
+        sy1 = min(height, max(sy0 + 1, int(round(py1 / scale))))
+        for col in range(cols):
+            i = row * cols + col
+            if i >= n_planes:
+                break
+            t = time.perf_counter()
+            if not lazy:
+                rows_read = np.asarray(stack[i, :, sy0:sy1], dtype=np.float32)  # memmap: just these rows
+            else:
+                if frames is None or i not in frames:
+                    frame = np.asarray(stack[i])  # whole dask chunks / TIFF pages: all channels in one go
+                    if frames is not None:
+                        frames[i] = frame
+                else:
+                    frame = frames[i]
+                rows_read = frame[:, sy0:sy1].astype(np.float32)
+            if timings is not None:
+                timings["read_s"] += time.perf_counter() - t
+            planes = np.stack([_resize_area(rows_read[c], (panel_w, py1 - py0)) for c in range(n_channels)])
+            band[top + py0 - y0:top + py1 - y0, col * step_w:col * step_w + panel_w] = composite(planes, colors, ranges)
+    return shared_cache().burn_labels(band, labels, [(int(x), int(y) - y0) for x, y in coordinates], label_size)
+
+
+def _halve(band):
+    """2 x 2 mean of an (H, W, 3) uint8 band, odd edges padded by repetition."""
+    if band.shape[0] % 2 or band.shape[1] % 2:
+        band = np.pad(band, ((0, band.shape[0] % 2), (0, band.shape[1] % 2), (0, 0)), mode="edge")
+    summed = band.reshape(band.shape[0] // 2, 2, band.shape[1] // 2, 2, 3).sum(axis=(1, 3), dtype=np.uint16)
+    return ((summed + 2) // 4).astype(np.uint8)
+
+
+def pyramid_shapes(height, width, tile=pyramid_tile):
+    """(H, W) per level, halving until the whole level fits in one tile."""
+    shapes = [(height, width)]
+    while max(shapes[-1]) > tile:
+        h, w = shapes[-1]
+        shapes.append((-(-h // 2), -(-w // 2)))
+    return shapes
+
+
+def _tiles(bands, tile):
+    """(tile, tile, 3) tiles of a sequence of bands, row-major, edge tiles zero-padded (as TIFF tiles are)."""
+    for band in bands:
+        for ty in range(0, band.shape[0], tile):
+            for tx in range(0, band.shape[1], tile):
+                block = band[ty:ty + tile, tx:tx + tile]
+                if block.shape[:2] != (tile, tile):
+                    block = np.pad(block, ((0, tile - block.shape[0]), (0, tile - block.shape[1]), (0, 0)))
+                yield block
+
+
+def write_pyramid(path, stack, scale, colors, ranges, labels, label_offset=offset, container="tiff",
+                  columns=None, label_size=None, tile=pyramid_tile, band_tiles=pyramid_band_tiles, timings=None):
+    """
+    Write the full montage at scale as a tiled, pyramidal BigTIFF (.ome.tif) or OME-Zarr (.ome.zarr),
+    one band of band_tiles tile rows at a time.
+
+    Parameters:
+        timings (dict): If given, "read_s" and "montage_s" are increased by the time spent reading the
+            stack and rendering bands (the rest of the call is writing).
+
+    Returns:
+        list: (H, W) of every level written.
+    """
+    n_planes = stack.shape[0]
+    cols, rows = define_montage(n_planes, columns)
+    panel_h, panel_w = panel_size(stack, scale)
+    height = rows * (panel_h + montage_border) - montage_border
+    width = cols * (panel_w + montage_border) - montage_border
+    shapes = pyramid_shapes(height, width, tile)
+    label_size, coordinates = label_positions(cols, rows, panel_h, panel_w, scale, label_offset, label_size)
+    band_h = tile * band_tiles  # a multiple of 2 ** (levels - 1) as long as band_tiles is a power of two
+
+    frames = {}  # decoded dask/ND2/compressed TIFF frames of the panel rows the current band crosses
+
+    def bands():
+        """Level-0 bands; each one is halved into the coarser levels as a side effect."""
+        for y0 in range(0, height, band_h):
+            t, spent = time.perf_counter(), {"read_s": 0.0}
+            band = render_band(stack, y0, min(height, y0 + band_h), cols, panel_h, panel_w, scale,
+                               colors, ranges, labels, label_size, coordinates, frames, spent)
+            if timings is not None:
+                timings["read_s"] += spent["read_s"]
+                timings["montage_s"] += time.perf_counter() - t - spent["read_s"]
+            halved, y = band, y0
+            for level in levels[1:]:
+                halved, y = _halve(halved), y // 2
+                level[y:y + halved.shape[0]] = halved
+            yield band
+
+    if container == "zarr":
+        if zarr is None:
+            raise ImportError("zarr is required for OME-Zarr output (pip install zarr)")
+        group = zarr.open_group(path, mode="w")
+        arrays = [group.create_dataset(str(l), shape=(3,) + shape, chunks=(3, tile, tile), dtype="u1")
+                  for l, shape in enumerate(shapes)]
+        group.attrs["multiscales"] = [{
+            "version": "0.4",
+            "axes": [{"name": "c", "type": "channel"}, {"name": "y", "type": "space"}, {"name": "x", "type": "space"}],
+            "datasets": [{"path": str(l), "coordinateTransformations": [{"type": "scale", "scale": [1, 2 ** l, 2 ** l]}]}
+                         for l in range(len(shapes))],
+        }]
+        levels = [None] + [_ChannelFirst(array) for array in arrays[1:]]
+        for y0, band in zip(range(0, height, band_h), bands()):
+            arrays[0][:, y0:y0 + band.shape[0]] = band.transpose(2, 0, 1)
+        return shapes
+
+    if tifffile is None:
+        raise ImportError("tifffile is required for BigTIFF output (pip install tifffile)")
+    temp = [path + f".level{l}.tmp" for l in range(1, len(shapes))]
+    levels = [None] + [np.memmap(t, dtype=np.uint8, mode="w+", shape=shape + (3,)) for t, shape in zip(temp, shapes[1:])]
+    try:
+        options = dict(tile=(tile, tile), photometric="rgb", compression="zlib")
+        with tifffile.TiffWriter(path, bigtiff=True, ome=True) as tif:
+            tif.write(_tiles(bands(), tile), shape=shapes[0] + (3,), dtype=np.uint8, subifds=len(shapes) - 1,
+                      metadata={"axes": "YXS"}, **options)
+            for level in levels[1:]:
+                level.flush()
+                tif.write(_tiles((level[y:y + band_h] for y in range(0, level.shape[0], band_h)), tile),
+                          shape=level.shape, dtype=np.uint8, subfiletype=1, **options)
+    finally:
+        del levels
+        for t in temp:
+            if os.path.exists(t):
+                os.remove(t)
+    return shapes
+
+
+class _ChannelFirst:
+    """Lets write_pyramid assign (H, W, 3) bands into a (3, H, W) OME-Zarr level."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def __setitem__(self, rows, band):
+        self.array[:, rows] = band.transpose(2, 0, 1)
+
+
+# --- Plane cache ---
+# The montage-resolution planes of a file are all a re-layout or re-annotation needs, so they are
+# kept in <output folder>/.montage_cache/<file>.<key>.npz. The key is a fingerprint sampled from
+# the file (size plus a few spread-out blocks, so multi-GB ND2s aren't read in full) together with
+# the scale and read mode; a changed file or scale is simply a cache miss.
+
+def file_fingerprint(path, n_blocks=fingerprint_blocks, block_size=64 * 1024):
+    """
+    sha1 of the file size and mtime and n_blocks blocks spread evenly over the file, first and last
+    included: the mtime catches an in-place rewrite that changes only bytes between the sampled blocks.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    h = hashlib.sha1(f"{size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        for k in range(n_blocks):
+            f.seek(max(0, (size - block_size) * k // max(1, n_blocks - 1)))
+            h.update(f.read(block_size))
+    return h.hexdigest()[:16]
+
+
+def cache_path(image_path, cache_dir, scale, mode, n_planes=None):
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    first = f"_first{n_planes}" if n_planes else ""
+    return os.path.join(cache_dir, f"{name}.{file_fingerprint(image_path)}_s{scale:g}_{mode}{first}_v{cache_version}.npz")
+
+
+def cached_montage_planes(image_path, scale, mode, cache_dir=None, stack=None, n_planes=None):
+    """
+    read_montage_planes() through the cache: a hit doesn't touch the image beyond its fingerprint.
+
+    Returns:
+        (np.ndarray, str): (N, C, h, w) float32 planes and "hit", "miss" or "off".
+    """
+    if not cache_dir:
+        return read_montage_planes(stack if stack is not None else open_stack(image_path), scale, mode, n_planes), "off"
+    path = cache_path(image_path, cache_dir, scale, mode, n_planes)
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return cached["planes"].astype(np.float32), "hit"
+    stack = stack if stack is not None else open_stack(image_path)
+    planes = read_montage_planes(stack, scale, mode, n_planes)
+    os.makedirs(cache_dir, exist_ok=True)
+    # block means of integer data lose next to nothing as uint16 (half the size of float32);
+    # float data (e.g. 0-1 intensities) would be flattened by rounding, so it is stored as is
+    if np.issubdtype(stack.dtype, np.integer) and planes.min() >= 0 and planes.max() < 65536:
+        planes = np.round(planes).astype(np.uint16)
+    temp = path + ".tmp.npz"
+    np.savez_compressed(temp, planes=planes)
+    os.replace(temp, path)
+    # what a later hit will load, so the first run and re-runs give the same output
+    return planes.astype(np.float32), "miss"
+
+
+# --- Per-file work ---
+
+def _limit_memory(limit_bytes):
+    """Worker initializer: cap the address space so an oversized stack raises MemoryError in its own worker."""
+    if resource is not None and limit_bytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (int(limit_bytes), hard))
+        except (ValueError, OSError) as e:
+            # macOS rejects RLIMIT_AS below the current mapping; run uncapped rather than not at all
+            print(f"[WARN] could not cap worker memory at {limit_bytes / 1e9:g} GB ({e}); running without a cap")
+
+
+def failed_record(image_path, error=None):
+    """Summary record of a file that produced nothing (montage_file() fills it in as it goes)."""
+    return {"image": image_path, "status": "failed", "slices": None, "cache": None, "read_s": 0.0,
+            "montage_s": 0.0, "save_s": 0.0, "total_s": 0.0, "output": None, "error": error}
+
+
+def output_base(image_path, output_dir=None, layout="slices"):
+    """Output path without extension: <name>_annotated, or <name>_annotated_channels for the channels layout."""
+    name = os.path.splitext(os.path.basename(image_path))[0] + "_annotated"
+    if layout != "slices":
+        name += "_" + layout
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(image_path)), name)
+
+
+def montage_file(image_path, output_dir=None, scale=downsampling_scale, label_offset=offset, mode=read_mode,
+                 pyramid=None, columns=None, label_size=None, cache_dir=cache_folder, layout="slices",
+                 lut="auto", percentiles=display_percentiles):
+    """
+    Worker: montage one screening file with everything taken from its name.
+
+    Parameters:
+        pyramid (str): None for PNG + JPEG; "tiff" or "zarr" for a pyramidal <name>_annotated.ome.tif /
+            .ome.zarr plus a <name>_annotated_overview.jpg.
+        columns, label_size: Layout and annotation overrides (see build_montage()).
+        cache_dir (str): Plane cache folder, relative to the output folder; None to read the image every time.
+        layout (str): "slices" (a panel per plane) or "channels" (a panel per channel of a single image).
+        lut (str): "auto" (sampled auto-contrast at percentiles), "reuse" (this file's existing
+            <name>_annotated_lut.json, else auto) or the path of a LUT JSON to apply. The file's
+            _lut.json is rewritten unless it is the one the limits came from.
+
+    Returns:
+        dict: image, status ("done" or "failed"), slices, read/montage/save/total seconds, output, error.
+    """
+    t0 = time.perf_counter()
+    record = failed_record(image_path)
+    try:
+        sample_id, start_slice, end_slice, channels, _ = extract_variables_from_filename(image_path)
+        sample_id = sample_id or os.path.splitext(os.path.basename(image_path))[0]
+        base = output_base(image_path, output_dir, layout)
+        cache = os.path.join(os.path.dirname(base), cache_dir) if cache_dir else None
+        if pyramid:
+            # the overview doubles as the sample the display ranges come from
+            stack = open_stack(image_path)
+            cols = define_montage(stack.shape[0], columns)[0]
+            overview_scale = min(scale, overview_width / (cols * stack.shape[3]))
+            planes, record["cache"] = cached_montage_planes(image_path, overview_scale, "stride", cache, stack)
+        else:
+            first = 1 if layout == "channels" else None
+            planes, record["cache"] = cached_montage_planes(image_path, scale, mode, cache, n_planes=first)
+        n_planes = planes.shape[0]
+        start = int(start_slice) if start_slice is not None else 1
+        if layout == "channels":
+            labels = set_ch_names(sample_id, start, channels, planes.shape[1])
+        else:
+            if end_slice is not None and int(end_slice) - start + 1 != n_planes * skip_size:
+                print(f"[WARNING] {os.path.basename(image_path)}: name says slices {start}-{int(end_slice)}, "
+                      f"stack has {n_planes} planes; labelling from s{start}")
+            labels = set_channel_names(sample_id, start, n_planes)
+
+        own_lut = lut_path(base)
+        lut_file = own_lut if lut == "reuse" else lut
+        if lut_file != "auto" and os.path.isfile(lut_file):
+            names, colors, ranges = read_lut(lut_file, planes.shape[1])
+            if os.path.abspath(lut_file) != os.path.abspath(own_lut):
+                # keep the names and limits of the applied LUT, and say where they came from
+                write_lut(own_lut, image_path, names, colors, ranges, source=os.path.abspath(lut_file))
+        elif lut not in ("auto", "reuse"):
+            raise FileNotFoundError(f"LUT file not found: {lut}")
+        else:
+            colors = channel_colors(channels, planes.shape[1])
+            ranges = display_ranges(planes, percentiles)
+            write_lut(own_lut, image_path, channels, colors, ranges, "auto", percentiles)
+        t1 = time.perf_counter()
+
+        pyramid_timings = {"read_s": 0.0, "montage_s": 0.0}
+        if pyramid:
+            overview = build_montage(planes, labels, colors, ranges, overview_scale, label_offset, columns, label_size)
+            t2 = time.perf_counter()
+            Image.fromarray(overview).save(base + "_overview.jpg", quality=jpeg_quality)
+            output = base + (".ome.zarr" if pyramid == "zarr" else ".ome.tif")
+            # reading and rendering are interleaved with writing: split them out of save_s
+            write_pyramid(output, stack, scale, colors, ranges, labels, label_offset, pyramid, columns, label_size,
+                          timings=pyramid_timings)
+        else:
+            rgb = build_montage(planes, labels, colors, ranges, scale, label_offset, columns, label_size, layout)
+            t2 = time.perf_counter()
+            image = Image.fromarray(rgb)
+            output = base + ".png"
+            image.save(output, compress_level=1)
+            image.save(base + ".jpg", quality=jpeg_quality)
+        t3 = time.perf_counter()
+        record.update(status="done", slices=n_planes, read_s=t1 - t0 + pyramid_timings["read_s"],
+                      montage_s=t2 - t1 + pyramid_timings["montage_s"],
+                      save_s=t3 - t2 - pyramid_timings["read_s"] - pyramid_timings["montage_s"], output=output)
+    except MemoryError:
+        record["error"] = "MemoryError: over the per-worker memory cap (--memory-gb)"
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["total_s"] = time.perf_counter() - t0
+    return record
+
+
+# --- Batch ---
+
+def find_images(root, patterns=IMAGE_PATTERNS):
+    """Screening files directly in root, not our own outputs (a single file is returned as is)."""
+    if os.path.isfile(root):
+        return [os.path.abspath(root)]
+    return sorted(os.path.join(os.path.abspath(root), f) for f in os.listdir(root)
+                  if any(fnmatch.fnmatch(f.lower(), p) for p in patterns) and "_annotated" not in f)
+
+
+SUMMARY_FIELDS = ["image", "status", "slices", "cache", "read_s", "montage_s", "save_s", "total_s", "output", "error"]
+
+
+def write_summary(records, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for r in records:
+            writer.writerow({k: round(v, 3) if isinstance(v, float) else v for k, v in r.items() if k in SUMMARY_FIELDS})
+
+
+def run_batch(root, output_dir=None, workers=None, memory_gb=memory_limit_gb, **options):
+    """
+    Montage every screening file in root in a process pool and write the run summary.
+
+    Parameters:
+        options: montage_file() keyword arguments (scale, label_offset, mode, pyramid, columns, label_size,
+            cache_dir, layout, lut, percentiles).
+
+    Returns:
+        list: montage_file() records.
+    """
+    t0 = time.perf_counter()
+    images = find_images(root)
+    print(f"=== {len(images)} screening file(s) in {root}, scale {options.get('scale', downsampling_scale)}, "
+          f"{memory_gb:g} GB per worker ===")
+    records = []
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    summary_dir = output_dir or (root if os.path.isdir(root) else os.path.dirname(os.path.abspath(root)))
+    summary_path = os.path.join(summary_dir, f"screening_montages_{datetime.now().strftime('%y%m%d-%H%M%S')}.csv")
+    try:
+        if images:
+            limit = memory_gb * 1e9 if memory_gb else None
+            with ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory, initargs=(limit,)) as pool:
+                futures = {pool.submit(montage_file, p, output_dir, **options): p for p in images}
+                for future, path in futures.items():
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # a worker killed outright (OOM killer, os._exit) breaks the pool: every file
+                        # still pending fails with BrokenProcessPool, but the finished ones are kept
+                        record = failed_record(path, f"{type(e).__name__}: {e}")
+                    records.append(record)
+                    marker = "✅" if record["status"] == "done" else "[FAILED]"
+                    print(f"{marker} {os.path.basename(record['image'])} ({record['total_s']:.1f} s)")
+    finally:
+        print(f"{'file':<60} {'status':<7} {'slices':>6} {'cache':>5} {'read':>7} {'montage':>8} {'save':>7} {'total':>7}")
+        for r in records:
+            slices = "" if r["slices"] is None else r["slices"]
+            print(f"{os.path.basename(r['image']):<60} {r['status']:<7} {slices:>6} {r['cache'] or '':>5} {r['read_s']:>7.2f} "
+                  f"{r['montage_s']:>8.2f} {r['save_s']:>7.2f} {r['total_s']:>7.2f}")
+            if r["error"]:
+                print(f"    [FAILED] {r['error']}")
+        write_summary(records, summary_path)
+        done = sum(r["status"] == "done" for r in records)
+        print(f"✅ {done} montaged, {len(records) - done} failed in {time.perf_counter() - t0:.1f} s "
+              f"(summary: {summary_path})")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotated screening montages for a whole directory, without Fiji.")
+    parser.add_argument("root", help="Screening directory (or a single .nd2/.tif).")
+    parser.add_argument("-o", "--output", default=None, help="Output folder (default: next to each input).")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--memory-gb", type=float, default=memory_limit_gb,
+                        help="Address-space cap per worker, 0 for none (ignored on Windows).")
+    parser.add_argument("--scale", type=float, default=downsampling_scale, help="Montage downsampling scale.")
+    parser.add_argument("--offset", type=float, default=offset, help="Label offset as a fraction of the panel.")
+    parser.add_argument("--read-mode", choices=["block", "stride"], default=read_mode,
+                        help="Downsample at read time by block averaging (default) or striding.")
+    parser.add_argument("--pyramid", choices=["tiff", "zarr"], default=None,
+                        help="Write a tiled pyramidal BigTIFF / OME-Zarr (+ overview JPEG) instead of PNG + JPEG.")
+    parser.add_argument("--columns", type=int, default=None, help="Montage columns (default: 2 up to 11 slices, else 3).")
+    parser.add_argument("--label-size", type=float, default=None, help="Label font size at scale 1 (default: 400).")
+    parser.add_argument("--cache-dir", default=cache_folder,
+                        help="Plane cache folder, relative to the output folder (default: %(default)s).")
+    parser.add_argument("--no-cache", action="store_true", help="Always read the images; don't use or fill the cache.")
+    parser.add_argument("--layout", choices=["slices", "channels"], default="slices",
+                        help="slices: a composite panel per plane; channels: a panel per channel of one image "
+                             "(as screening_single-img_nikon.py).")
+    parser.add_argument("--lut", default="auto",
+                        help="auto: sampled percentile auto-contrast; reuse: each file's existing _lut.json; "
+                             "or a LUT JSON applied to every file.")
+    parser.add_argument("--percentiles", nargs=2, type=float, default=display_percentiles, metavar=("LOW", "HIGH"),
+                        help="Auto-contrast percentiles (default: %(default)s).")
+    args = parser.parse_args()
+    if args.layout == "channels" and args.pyramid:
+        parser.error("--pyramid is only available for the slices layout")
+
+    if Image is None:
+        raise SystemExit("screening_montages needs pillow (pip install pillow)")
+    records = run_batch(args.root, args.output, args.workers, args.memory_gb, scale=args.scale, label_offset=args.offset,
+                        mode=args.read_mode, pyramid=args.pyramid, columns=args.columns, label_size=args.label_size,
+                        cache_dir=None if args.no_cache else args.cache_dir, layout=args.layout, lut=args.lut,
+                        percentiles=tuple(args.percentiles))
+    if any(r["status"] != "done" for r in records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
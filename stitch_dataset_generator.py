@@ -0,0 +1,205 @@
+"""
+Writes a BigStitcher SpimData XML (stitch-dataset.xml) for a folder of Dragonfly .ims tiles
+without going through BigStitcher's interactive "Define Dataset" import.
+
+Everything comes from the tiles themselves via DF_metadata_extractor:
+  - one ViewSetup per (tile, channel), ids tile-major so a tile's channels are consecutive
+    (the layout stitch_settings_generator.py expects),
+  - voxel sizes from the .ims extents (or an exported metadata text file with -m),
+  - channel names as channel attributes,
+  - one "Translation from stage" ViewTransform per setup, from the per-tile stage positions
+    (build_tile_layout), plus the usual z calibration transform.
+If the tiles carry no stage positions, an ideal snake grid from the montage rows/cols/overlap
+is used instead, the same ordering as live_preview_tiles_on_grid_annotated.py.
+
+The images are referenced through BigStitcher's Bio-Formats file-map loader
+(spimreconstruction.filemap2), one file per tile, channel = Bio-Formats channel.
+
+Usage:
+    python stitch_dataset_generator.py /Volumes/users/Hugo/HD71 -o /Volumes/users/Hugo/HD71/stitch-dataset.xml
+    python stitch_dataset_generator.py E:\\HD72 -m E:\\HD72\\HD72_metadata.txt --rows 29 --cols 35
+
+Dependencies:
+    pip install pydantic-bigstitcher h5py numpy
+"""
+
+import os
+import re
+import time
+import argparse
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from pydantic_bigstitcher import (
+    SpimData, BasePath, SequenceDescription, ViewSetups, ViewSetup, VoxelSize,
+    ViewSetupAttributes, Attribute, IlluminationAttribute, ChannelAttribute, TileAttribute,
+    AngleAttribute, PatternTimePoints, ViewRegistrations, ViewRegistration,
+)
+from pydantic_bigstitcher.transform import AffineViewTransform
+
+from DF_metadata_extractor import extract_folder_metadata, extract_image_metadata, build_tile_layout
+
+TILE_RE = re.compile(r"_F(\d+)\.ims$")
+
+
+def find_tiles(folder):
+    """Sorted (field index, filename) for every *_F<n>.ims tile in folder."""
+    tiles = []
+    for fname in os.listdir(folder):
+        match = TILE_RE.search(fname)
+        if match:
+            tiles.append((int(match.group(1)), fname))
+    return sorted(tiles)
+
+
+def snake_grid_positions(field_indices, rows, overlap_percent, tile_w_um, tile_h_um):
+    """Stage positions (µm) on an ideal column-wise snake grid, one row per field index."""
+    step_x = tile_w_um * (1 - overlap_percent / 100)
+    step_y = tile_h_um * (1 - overlap_percent / 100)
+    idx = np.asarray(field_indices)
+    col = idx // rows
+    row = np.where(col % 2 == 0, idx % rows, rows - 1 - idx % rows)
+    return np.stack([col * step_x, row * step_y, np.zeros(len(idx))], axis=1)
+
+
+def translation_affine(tx, ty, tz):
+    return f"1.0 0.0 0.0 {tx} 0.0 1.0 0.0 {ty} 0.0 0.0 1.0 {tz}"
+
+
+def build_spimdata(tiles, meta, layout, timepoint="0"):
+    """
+    Build the SpimData model.
+
+    Parameters:
+        tiles (list): (field index, filename), in the same order as layout.
+        meta (dict): extract_image_metadata() result shared by every tile.
+        layout (np.ndarray): build_tile_layout() table, one row per tile.
+
+    Returns:
+        SpimData
+    """
+    n_channels = meta["num_channels"]
+    channel_names = [ch["name"] for ch in meta["channels"]] or [str(c) for c in range(n_channels)]
+    px, py, pz = meta["pixel_size_x"], meta["pixel_size_y"], meta["z_step"] or meta["pixel_size_x"]
+    size = f"{meta['width']} {meta['height']} {meta['num_z'] or 1}"
+    voxel = VoxelSize(unit="µm", size=f"{px} {py} {pz}")
+    calibration = AffineViewTransform(typ="affine", name="calibration", affine=f"1.0 0.0 0.0 0.0 0.0 1.0 0.0 0.0 0.0 0.0 {pz / px} 0.0")
+
+    # translations in (x-)pixel units, relative to the first tile's z
+    tz = (layout["stage_z_um"] - np.nan_to_num(layout["stage_z_um"][0])) / px
+    tz = np.nan_to_num(tz)
+
+    setups, registrations = [], []
+    for t, (field_index, fname) in enumerate(tiles):
+        translation = AffineViewTransform(
+            typ="affine",
+            name="Translation from stage",
+            affine=translation_affine(layout["px_x"][t], layout["px_y"][t], tz[t]),
+        )
+        for c in range(n_channels):
+            setup_id = str(t * n_channels + c)
+            setups.append(ViewSetup(
+                ident=setup_id,
+                name=f"{os.path.splitext(fname)[0]}_ch{c}",
+                size=size,
+                voxel_size=voxel,
+                attributes=ViewSetupAttributes(illumination="0", channel=str(c), tile=str(t), angle="0"),
+            ))
+            registrations.append(ViewRegistration(timepoint=timepoint, setup=setup_id, view_transforms=[translation, calibration]))
+
+    attributes = [
+        IlluminationAttribute(name="illumination", illumination=[Attribute(id=0, name="0")]),
+        ChannelAttribute(name="channel", angle=[Attribute(id=c, name=channel_names[c] if c < len(channel_names) else str(c)) for c in range(n_channels)]),
+        TileAttribute(name="tile", tile=[Attribute(id=t, name=str(field_index)) for t, (field_index, _) in enumerate(tiles)]),
+        AngleAttribute(name="angle", angle=[Attribute(id=0, name="0")]),
+    ]
+    return SpimData(
+        version="0.2",
+        base_path=BasePath(type="relative", path="."),
+        sequence_description=SequenceDescription(
+            view_setups=ViewSetups(elements=setups, attributes=attributes),
+            time_points=PatternTimePoints(type="pattern", elements=[timepoint]),
+        ),
+        view_registrations=ViewRegistrations(elements=registrations),
+    )
+
+
+def filemap_image_loader(tiles, n_channels, timepoint="0"):
+    """BigStitcher's Bio-Formats file-map loader element: one FileMapping per view setup."""
+    loader = ET.Element("ImageLoader", format="spimreconstruction.filemap2")
+    ET.SubElement(loader, "imglib2container").text = "ArrayImgFactory"
+    ET.SubElement(loader, "ZGrouped").text = "false"
+    files = ET.SubElement(loader, "files")
+    for t, (_, fname) in enumerate(tiles):
+        for c in range(n_channels):
+            mapping = ET.SubElement(files, "FileMapping", view_setup=str(t * n_channels + c), timepoint=timepoint, series="0", channel=str(c))
+            ET.SubElement(mapping, "file", type="relative").text = fname
+    return loader
+
+
+def write_spimdata_xml(spim_data, image_loader, output_path):
+    """Serialize the model, splice in the image loader (pydantic-bigstitcher only models Zarr/N5 loaders) and write."""
+    root = ET.fromstring(spim_data.to_xml())
+    root.find("SequenceDescription").insert(0, image_loader)
+    ET.indent(root, space="  ")
+    tree = ET.ElementTree(root)
+    tree.write(output_path, encoding="UTF-8", xml_declaration=True)
+
+
+def generate(folder, output_path, metadata_file=None, rows=None, cols=None, overlap=None, workers=None):
+    t0 = time.perf_counter()
+    tiles = find_tiles(folder)
+    if not tiles:
+        raise SystemExit(f"No *_F<n>.ims tiles in {folder}")
+    print(f"Found {len(tiles)} tile(s) in {folder}")
+
+    per_tile = extract_folder_metadata(folder, workers)
+    tiles = [(i, fname) for i, fname in tiles if fname in per_tile]
+    meta = extract_image_metadata(metadata_file, verbose=False) if metadata_file else per_tile[tiles[0][1]]
+    for key in ("num_z", "z_step", "pixel_size_x", "pixel_size_y"):
+        if meta.get(key) is None:
+            meta[key] = per_tile[tiles[0][1]].get(key)
+
+    positions = [per_tile[fname]["stage_positions"][0] if per_tile[fname]["stage_positions"] else None for _, fname in tiles]
+    if all(p is not None for p in positions):
+        positions = np.array([[x, y, np.nan if z is None else z] for x, y, z in positions])
+        print("Tile positions: stage coordinates from the tiles")
+    else:
+        rows = rows or meta.get("montage_rows")
+        cols = cols or meta.get("montage_cols")
+        overlap = overlap if overlap is not None else (meta.get("tile_overlap") or 0)
+        if not rows or not cols:
+            raise SystemExit("Tiles have no stage positions; pass --rows/--cols (or -m with a montage layout)")
+        positions = snake_grid_positions(
+            [i for i, _ in tiles], rows, overlap,
+            meta["width"] * meta["pixel_size_x"], meta["height"] * meta["pixel_size_y"],
+        )
+        print(f"Tile positions: {cols}×{rows} snake grid, {overlap}% overlap")
+
+    layout = build_tile_layout(positions, meta["width"], meta["height"], meta["pixel_size_x"], meta["pixel_size_y"],
+                               field_index=np.arange(len(tiles)))
+    spim_data = build_spimdata(tiles, meta, layout)
+    loader = filemap_image_loader(tiles, meta["num_channels"])
+    write_spimdata_xml(spim_data, loader, output_path)
+    n_setups = len(tiles) * meta["num_channels"]
+    print(f"✅ Wrote {output_path}: {len(tiles)} tiles × {meta['num_channels']} channels = {n_setups} view setups "
+          f"in {time.perf_counter() - t0:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a BigStitcher SpimData XML for a folder of .ims tiles.")
+    parser.add_argument("folder", help="Folder of *_F<n>.ims tiles.")
+    parser.add_argument("-o", "--output", default=None, help="Output XML (default: <folder>/stitch-dataset.xml).")
+    parser.add_argument("-m", "--metadata", default=None, help="Exported metadata text file to take channels/voxel sizes from.")
+    parser.add_argument("--rows", type=int, default=None, help="Montage rows, only used when tiles have no stage positions.")
+    parser.add_argument("--cols", type=int, default=None, help="Montage columns, only used when tiles have no stage positions.")
+    parser.add_argument("--overlap", type=float, default=None, help="Tile overlap in percent, only used with the snake grid fallback.")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Processes used to read tile metadata.")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.folder, "stitch-dataset.xml")
+    generate(args.folder, output, args.metadata, args.rows, args.cols, args.overlap, args.workers)
+
+
+if __name__ == "__main__":
+    main()
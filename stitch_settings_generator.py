@@ -25,19 +25,55 @@ In the working XML:
   
 Optionally, a channel offset (an integer between 0 and 5) may be provided.
 If not provided, it defaults to 0.
+
+The settings are streamed element by element to the output file (write_settings_xml), which
+produces the same bytes as the old xmltodict.unparse + minidom pretty-print path without
+holding the document in memory; `--benchmark N` compares the two on N synthetic setups.
+
+The number of channels per tile is read from the SpimData channel attribute (or -n), so 4- and
+8-channel rounds work too; the "6" above is just the common case. With --generate_all the XML is
+parsed once and one file per offset is written in parallel.
+
+By default only the <ViewSetups> section is read (load_view_setups), so startup does not grow with
+the ViewRegistrations history and any ImageLoader format works; --full-model loads and validates
+the complete SpimData through pydantic-bigstitcher as before.
+
+With --auto-range the fixed min/max values are replaced by per-setup percentiles (default 1-99.9)
+sampled from the coarsest pyramid level of the bdv.hdf5 / bdv.n5 container the XML points at.
   
 Dependencies:
-    pip install pydantic-bigstitcher xmltodict
+    pip install pydantic-bigstitcher xmltodict numpy
+    pip install h5py        # --auto-range on HDF5 datasets
+    pip install "zarr<3"    # --auto-range on N5 datasets
 """
 
 import sys
 import os
+import glob
+import time
+import hashlib
 import xmltodict
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from types import SimpleNamespace
 from math import floor
 from pydantic_bigstitcher import SpimData
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from xml.dom.minidom import parseString
 
+import numpy as np
+
+try:
+    import h5py  # only needed for --auto-range on bdv.hdf5 datasets (pip install h5py)
+except ImportError:
+    h5py = None
+
+try:
+    import zarr  # only needed for --auto-range on bdv.n5 datasets (pip install "zarr<3")
+except ImportError:
+    zarr = None
+
 # Colors and calibration values (as strings)
 GREEN_COLOR = "65281"   # active channel in even tiles (green)
 MAGENTA_COLOR = "16596405"  # active channel in odd tiles (magenta)
@@ -59,219 +95,638 @@ def load_spimdata(xml_filename: str) -> SpimData:
     spim_data = SpimData.from_xml(xml_content)
     return spim_data
 
-def build_viewer_sources(view_setups, offset: int):
+# --- Fast view-setup loader ---
+# The settings only need the view setups and their attributes, which sit at the start of
+# <SequenceDescription>. Stream-parsing stops at the end of </ViewSetups>, so the (usually much
+# larger) <ViewRegistrations> history is never read or validated.
+
+ViewSetupRecord = namedtuple("ViewSetupRecord", "ident name size attributes")
+SetupAttributes = namedtuple("SetupAttributes", "illumination channel tile angle")
+AttributeList = namedtuple("AttributeList", "name entries")  # entries: [(id, name)]
+
+def load_view_setups(xml_filename: str):
     """
-    Build a list of Source dictionaries for the <ViewerState>/<Sources> section.
-    Each view setup gets a <Source> with <active> set to "true" only if its adjusted index is 0.
-    The adjusted index is defined as (raw_index - offset) mod 6.
+    Read only SequenceDescription/ViewSetups from a SpimData XML.
+
+    Returns:
+        SimpleNamespace(elements=[ViewSetupRecord], attributes=[AttributeList], base_path, image_loader),
+        shaped like SpimData.sequence_description.view_setups for the settings builders.
+        base_path is the resolved data directory and image_loader a dict with the loader's
+        "format" and, for HDF5/N5 loaders, the resolved "path" of the container.
     """
-    sources = []
-    # Assume view_setups are sorted by id
-    sorted_setups = sorted(view_setups, key=lambda vs: int(vs.ident))
-    for i, vs in enumerate(sorted_setups):
-        raw = i % 6
-        adjusted = (raw - offset) % 6
-        active_flag = "true" if adjusted == 0 else "false"
-        sources.append({"active": text_elem(active_flag)})
-    return sources
-
-def build_converter_setups(view_setups, offset: int):
+    elements, attributes = [], []
+    xml_dir = os.path.dirname(os.path.abspath(xml_filename))
+    base_path, image_loader = xml_dir, {"format": None, "path": None}
+
+    def resolve(elem, root):
+        if elem.get("type") == "relative":
+            return os.path.normpath(os.path.join(root, elem.text.strip()))
+        return elem.text.strip()
+
+    context = ET.iterparse(xml_filename, events=("start", "end"))
+    in_setups = False
+    for event, elem in context:
+        if event == "start":
+            if elem.tag == "ViewSetups":
+                in_setups = True
+            continue
+        if not in_setups:
+            if elem.tag == "BasePath":
+                base_path = resolve(elem, xml_dir)
+            elif elem.tag == "ImageLoader":
+                image_loader["format"] = elem.get("format")
+                container = elem.find("hdf5")
+                if container is None:
+                    container = elem.find("n5")
+                if container is not None:
+                    image_loader["path"] = resolve(container, base_path)
+                elem.clear()
+            elif elem.tag == "ViewRegistrations":
+                break
+            continue
+        if elem.tag == "ViewSetup":
+            attrs = elem.find("attributes")
+            values = {child.tag: child.text for child in attrs} if attrs is not None else {}
+            elements.append(ViewSetupRecord(
+                ident=elem.findtext("id"),
+                name=elem.findtext("name"),
+                size=elem.findtext("size"),
+                attributes=SetupAttributes(*(values.get(key) for key in SetupAttributes._fields)),
+            ))
+            elem.clear()
+        elif elem.tag == "Attributes":
+            entries = [(int(child.findtext("id")), child.findtext("name")) for child in elem]
+            attributes.append(AttributeList(elem.get("name"), entries))
+            elem.clear()
+        elif elem.tag == "ViewSetups":
+            break
+    del context
+    return SimpleNamespace(elements=elements, attributes=attributes, base_path=base_path, image_loader=image_loader)
+
+def minmax_group_values(n_groups=6, group_ranges=None):
     """
-    Build a list of ConverterSetup entries for each channel (view setup).
-    For each channel i (0-indexed):
-      - Let tile = i // 6 and raw = i % 6.
-      - Compute adjusted = (raw - offset) mod 6.
-      - If adjusted == 0 (active channel):
-          If tile is even, use min=100.0, max=125.0, color=GREEN_COLOR, groupId="0"
-          If tile is odd,  use min=100.0, max=150.0, color=MAGENTA_COLOR, groupId="1"
-      - Else (non-active):
-          Use min=90.0, max=130.0, color=16777215, groupId = str(adjusted)
-    Each entry’s fields are wrapped as elements.
+    Yield n_groups (one per channel, 6 by default) MinMaxGroup field dicts (as strings).
+      - Group 0 gets currentMin=0.0 and currentMax=65535.0.
+      - Groups 1 through n_groups-1 get currentMin=90.0 and currentMax=130.0.
+    Other fields are fixed. group_ranges ({group: (min, max)}, from --auto-range) overrides
+    currentMin/currentMax for the groups it contains.
     """
-    converter_setups = []
-    sorted_setups = sorted(view_setups, key=lambda vs: int(vs.ident))
-    for i, vs in enumerate(sorted_setups):
-        tile = i // 6
-        raw = i % 6
-        adjusted = (raw - offset) % 6
-        if adjusted == 0:
-            # Active channel in this tile
-            if tile % 2 == 0:
-                min_val = DEFAULT_MIN_ACTIVE_EVEN
-                max_val = DEFAULT_MAX_ACTIVE_EVEN
-                color = GREEN_COLOR
-                groupId = "0"
-            else:
-                min_val = DEFAULT_MIN_ACTIVE_ODD
-                max_val = DEFAULT_MAX_ACTIVE_ODD
-                color = MAGENTA_COLOR
-                groupId = "1"
-        else:
-            # Non-active channel: assign color in blocks of 5
-            chunk = i // 5
-            color = GREEN_COLOR if (chunk % 2 == 0) else MAGENTA_COLOR
-            min_val = DEFAULT_MIN_NONACTIVE
-            max_val = DEFAULT_MAX_NONACTIVE
-            groupId = str(adjusted)
-        entry = {
-            "id": text_elem(vs.ident),
-            "min": text_elem(min_val),
-            "max": text_elem(max_val),
-            "color": text_elem(color),
-            "groupId": text_elem(groupId)
+    for g in range(n_groups):
+        if group_ranges and g in group_ranges:
+            low, high = group_ranges[g]
+            yield {
+                "id": str(g),
+                "fullRangeMin": "-2.147483648E9",
+                "fullRangeMax": "2.147483647E9",
+                "rangeMin": "0.0",
+                "rangeMax": format_range_value(max(high, 65535.0)),
+                "currentMin": format_range_value(low),
+                "currentMax": format_range_value(high)
+            }
+            continue
+        yield {
+            "id": str(g),
+            "fullRangeMin": "-2.147483648E9",
+            "fullRangeMax": "2.147483647E9",
+            "rangeMin": "0.0",
+            "rangeMax": "65535.0",
+            "currentMin": "0.0" if g == 0 else "90.0",
+            "currentMax": "65535.0" if g == 0 else "130.0"
         }
-        converter_setups.append(entry)
-    return converter_setups
 
-def build_source_groups(view_setups, offset: int):
+MANUAL_TRANSFORM_TEXT = "1.0 0.0 0.0 0.0 0.0 1.0 0.0 0.0 0.0 0.0 1.0 0.0"
+
+# --- Streaming writer ---
+# Writes the same bytes as the xmltodict + minidom path (render_settings_legacy), but element by
+# element straight to the output file, so no dict, no serialized string and no DOM of the whole
+# settings ever exist.
+
+def _escape(text):
+    # same characters minidom escapes in text and attribute values
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class XmlStreamWriter:
+    """Minimal indented XML writer matching minidom's toprettyxml(indent="  ") layout."""
+
+    def __init__(self, f, indent="  "):
+        self.f = f
+        self.indent = indent
+        self.depth = 0
+        f.write('<?xml version="1.0" ?>\n')
+
+    def _tag(self, tag, attrs):
+        return tag + "".join(f' {key}="{_escape(str(value))}"' for key, value in attrs.items())
+
+    def start(self, tag, **attrs):
+        self.f.write(f"{self.indent * self.depth}<{self._tag(tag, attrs)}>\n")
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+        self.f.write(f"{self.indent * self.depth}</{tag}>\n")
+
+    def empty(self, tag, **attrs):
+        self.f.write(f"{self.indent * self.depth}<{self._tag(tag, attrs)}/>\n")
+
+    def leaf(self, tag, text):
+        if text == "":
+            self.empty(tag)
+        else:
+            self.f.write(f"{self.indent * self.depth}<{tag}>{_escape(str(text))}</{tag}>\n")
+
+    def leaves(self, fields):
+        pad = self.indent * self.depth
+        self.f.write("".join(f"{pad}<{tag}>{_escape(str(text))}</{tag}>\n" for tag, text in fields))
+
+# --- Setup table ---
+# The view setups are parsed and sorted once into a table of (setup id, tile, channel);
+# every offset is then a few array operations on that table.
+
+SETUP_TABLE_DTYPE = np.dtype([("ident", "i8"), ("tile", "i8"), ("channel", "i8")])
+
+def channel_count(view_setups):
+    """Number of channels per tile, from the SpimData channel attribute (None if it is missing)."""
+    for attribute in getattr(view_setups, "attributes", None) or []:
+        if attribute.name == "channel":
+            # pydantic-bigstitcher names the channel list "angle"; load_view_setups uses "entries"
+            entries = getattr(attribute, "angle", None) or getattr(attribute, "entries", None)
+            if entries:
+                return len(entries)
+    return None
+
+def build_setup_table(view_setups, channels_per_tile=None):
     """
-    Build the <SourceGroups> section.
-    We group active channels (those with adjusted index 0) into two groups:
-      - "green": if tile is even
-      - "magenta": if tile is odd
-    We loop over all channels, and for each channel i (sorted by id),
-    if its adjusted index is 0, we add its id to the corresponding group.
+    Sort the view setups by id once and tabulate their tile and channel.
+
+    Parameters:
+        view_setups: SpimData ViewSetups (elements + attributes).
+        channels_per_tile (int): overrides the channel attribute.
+
+    Returns:
+        (np.ndarray, int): SETUP_TABLE_DTYPE rows in setup id order, and the channel count.
     """
-    group_green = []
-    group_magenta = []
-    sorted_setups = sorted(view_setups, key=lambda vs: int(vs.ident))
-    for i, vs in enumerate(sorted_setups):
-        raw = i % 6
-        adjusted = (raw - offset) % 6
-        if adjusted == 0:
-            tile = i // 6
-            if tile % 2 == 0:
-                group_green.append(vs.ident)
-            else:
-                group_magenta.append(vs.ident)
-    groups = [
-        {
-            "active": text_elem("true"),
-            "name": text_elem("green"),
-            "id": [text_elem(id_) for id_ in group_green]
-        },
-        {
-            "active": text_elem("true"),
-            "name": text_elem("magenta"),
-            "id": [text_elem(id_) for id_ in group_magenta]
-        }
-    ]
-    return groups
+    elements = sorted(view_setups.elements, key=lambda vs: int(vs.ident))
+    table = np.zeros(len(elements), dtype=SETUP_TABLE_DTYPE)
+    table["ident"] = [int(vs.ident) for vs in elements]
+
+    attrs = [getattr(vs, "attributes", None) for vs in elements]
+    if elements and all(a is not None and a.channel is not None and a.tile is not None for a in attrs):
+        channel_ids = np.array([int(a.channel) for a in attrs])
+        tile_ids = np.array([int(a.tile) for a in attrs])
+        # channel = position of the channel id among all channels; tile = order of first appearance
+        _, table["channel"] = np.unique(channel_ids, return_inverse=True)
+        _, first_seen, tile_rank = np.unique(tile_ids, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first_seen))
+        table["tile"] = order[tile_rank]
+        n_channels = channels_per_tile or channel_count(view_setups) or len(np.unique(channel_ids))
+    else:
+        n_channels = channels_per_tile or channel_count(view_setups) or 6
+        index = np.arange(len(elements))
+        table["tile"] = index // n_channels
+        table["channel"] = index % n_channels
+    return table, n_channels
 
-def build_minmax_groups():
+def setup_values(table, n_channels: int, offset: int, ranges=None):
     """
-    Build 6 MinMaxGroup entries.
-      - Group 0 gets currentMin=0.0 and currentMax=65535.0.
-      - Groups 1 through 5 get currentMin=90.0 and currentMax=130.0.
-    Other fields are fixed.
+    Per-setup settings values for one channel offset, as arrays over the table rows.
+
+    Returns:
+        SimpleNamespace: ids, active, odd_tile, min_vals, max_vals, colors, group_ids (one entry per
+        table row) and group_ranges ({group: (min, max)}, the per-channel medians of ranges mapped onto
+        the groupIds; None without ranges).
     """
-    groups = []
-    # Group 0:
-    groups.append({
-        "id": text_elem("0"),
-        "fullRangeMin": text_elem("-2.147483648E9"),
-        "fullRangeMax": text_elem("2.147483647E9"),
-        "rangeMin": text_elem("0.0"),
-        "rangeMax": text_elem("65535.0"),
-        "currentMin": text_elem("0.0"),
-        "currentMax": text_elem("65535.0")
-    })
-    # Groups 1 to 5:
-    for g in range(1, 6):
-        groups.append({
-            "id": text_elem(str(g)),
-            "fullRangeMin": text_elem("-2.147483648E9"),
-            "fullRangeMax": text_elem("2.147483647E9"),
-            "rangeMin": text_elem("0.0"),
-            "rangeMax": text_elem("65535.0"),
-            "currentMin": text_elem("90.0"),
-            "currentMax": text_elem("130.0")
-        })
-    return groups
-
-def build_manual_source_transforms(num=4):
+    adjusted = (table["channel"] - offset) % n_channels
+    active = adjusted == 0
+    odd_tile = table["tile"] % 2 == 1
+    # non-active channels alternate colors in blocks of 5 setups
+    nonactive_color = np.where((np.arange(len(table)) // 5) % 2 == 0, GREEN_COLOR, MAGENTA_COLOR)
+    min_vals = np.where(active, np.where(odd_tile, DEFAULT_MIN_ACTIVE_ODD, DEFAULT_MIN_ACTIVE_EVEN), DEFAULT_MIN_NONACTIVE)
+    max_vals = np.where(active, np.where(odd_tile, DEFAULT_MAX_ACTIVE_ODD, DEFAULT_MAX_ACTIVE_EVEN), DEFAULT_MAX_NONACTIVE)
+    colors = np.where(active, np.where(odd_tile, MAGENTA_COLOR, GREEN_COLOR), nonactive_color)
+    group_ids = np.where(active, np.where(odd_tile, "1", "0"), adjusted.astype(str))
+    group_ranges = None
+    if ranges is not None:
+        # medians per channel (the active one, and each non-active adjusted index), not per groupId:
+        # group 1 holds both the active channel's odd tiles and non-active channel 1
+        channel_ranges = {}
+        for a in range(n_channels):
+            in_channel = (adjusted == a) & np.isfinite(ranges[:, 0])
+            if in_channel.any():
+                channel_ranges[a] = (float(np.median(ranges[in_channel, 0])), float(np.median(ranges[in_channel, 1])))
+        # groups 0 and 1 are the active channel's even/odd tiles, shown side by side on one range;
+        # the non-active setups in group 1 are hidden
+        group_ranges = {g: channel_ranges[0 if g < 2 else g] for g in range(n_channels)
+                        if (0 if g < 2 else g) in channel_ranges}
+        # setups missing from the container take their channel's median, else the fixed range
+        sampled = ranges.astype(float)
+        for row in np.flatnonzero(~np.isfinite(sampled[:, 0])):
+            sampled[row] = channel_ranges.get(int(adjusted[row]), (min_vals[row], max_vals[row]))
+        min_vals = [format_range_value(v) for v in sampled[:, 0]]
+        max_vals = [format_range_value(v) for v in sampled[:, 1]]
+    return SimpleNamespace(ids=table["ident"].astype(str), active=active, odd_tile=odd_tile, min_vals=min_vals,
+                           max_vals=max_vals, colors=colors, group_ids=group_ids, group_ranges=group_ranges)
+
+def write_settings_xml(f, table, n_channels: int, offset: int, ranges=None):
     """
-    Build exactly num SourceTransform entries.
-    We use an affine transform of "1.0 0.0 0.0 0.0 0.0 1.0 0.0 0.0 0.0 0.0 1.0 0.0".
-    Note: In the working XML there are 4 such entries.
+    Stream the BDV settings for one channel offset to the open text file f.
+    table/n_channels come from build_setup_table; the output is identical to
+    render_settings_legacy.
+    ranges (from sample_display_ranges, one (min, max) row per table row) replaces the
+    hard-coded display ranges.
     """
-    transform_text = "1.0 0.0 0.0 0.0 0.0 1.0 0.0 0.0 0.0 0.0 1.0 0.0"
-    return [{"@type": "affine", "affine": text_elem(transform_text)} for _ in range(num)]
+    v = setup_values(table, n_channels, offset, ranges)
+    ids, active, odd_tile = v.ids, v.active, v.odd_tile
+    min_vals, max_vals, colors, group_ids, group_ranges = v.min_vals, v.max_vals, v.colors, v.group_ids, v.group_ranges
 
-def build_settings_dict(spim_data: SpimData, offset: int) -> dict:
-    """Build the full settings dictionary for output."""
-    view_setups = spim_data.sequence_description.view_setups.elements
+    w = XmlStreamWriter(f)
+    w.start("Settings")
+    w.start("ViewerState")
+    if len(table):
+        w.start("Sources")
+        for flag in np.where(active, "true", "false"):
+            w.start("Source")
+            w.leaf("active", flag)
+            w.end("Source")
+        w.end("Sources")
+    else:
+        w.empty("Sources")
+    w.start("SourceGroups")
+    for name, ids_in_group in (("green", ids[active & ~odd_tile]), ("magenta", ids[active & odd_tile])):
+        w.start("SourceGroup")
+        w.leaves([("active", "true"), ("name", name)] + [("id", id_) for id_ in ids_in_group])
+        w.end("SourceGroup")
+    w.end("SourceGroups")
+    w.leaf("DisplayMode", "fs")
+    w.leaf("Interpolation", "nearestneighbor")
+    w.leaf("CurrentSource", ids[0] if len(ids) else "")
+    w.leaf("CurrentGroup", "0")
+    w.leaf("CurrentTimePoint", "0")
+    w.end("ViewerState")
 
-    sources = build_viewer_sources(view_setups, offset)
-    converter_setups = build_converter_setups(view_setups, offset)
-    source_groups = build_source_groups(view_setups, offset)
-    minmax_groups = build_minmax_groups()
-    manual_transforms = build_manual_source_transforms(4)
+    w.start("SetupAssignments")
+    if len(table):
+        w.start("ConverterSetups")
+        for ident, min_val, max_val, color, groupId in zip(ids, min_vals, max_vals, colors, group_ids):
+            w.start("ConverterSetup")
+            w.leaves([("id", ident), ("min", min_val), ("max", max_val), ("color", color), ("groupId", groupId)])
+            w.end("ConverterSetup")
+        w.end("ConverterSetups")
+    else:
+        w.empty("ConverterSetups")
+    w.start("MinMaxGroups")
+    for group in minmax_group_values(n_channels, group_ranges):
+        w.start("MinMaxGroup")
+        w.leaves(group.items())
+        w.end("MinMaxGroup")
+    w.end("MinMaxGroups")
+    w.end("SetupAssignments")
 
-    # For CurrentSource we use the id of the first view setup.
-    sorted_setups = sorted(view_setups, key=lambda vs: int(vs.ident))
-    current_source = sorted_setups[0].ident if sorted_setups else ""
+    w.start("ManualSourceTransforms")
+    for _ in range(4):
+        w.start("SourceTransform", type="affine")
+        w.leaf("affine", MANUAL_TRANSFORM_TEXT)
+        w.end("SourceTransform")
+    w.end("ManualSourceTransforms")
+    w.empty("Bookmarks")
+    w.end("Settings")
 
-    settings = {
+def build_settings_dict(table, n_channels: int, offset: int, ranges=None) -> dict:
+    """The settings as an xmltodict document, from the same setup_values as write_settings_xml."""
+    v = setup_values(table, n_channels, offset, ranges)
+    return {
         "Settings": {
             "ViewerState": {
-                "Sources": {"Source": sources},
-                "SourceGroups": {"SourceGroup": source_groups},
+                "Sources": {"Source": [{"active": text_elem(flag)} for flag in np.where(v.active, "true", "false")]},
+                "SourceGroups": {"SourceGroup": [
+                    {"active": text_elem("true"), "name": text_elem(name), "id": [text_elem(id_) for id_ in group]}
+                    for name, group in (("green", v.ids[v.active & ~v.odd_tile]), ("magenta", v.ids[v.active & v.odd_tile]))
+                ]},
                 "DisplayMode": text_elem("fs"),
                 "Interpolation": text_elem("nearestneighbor"),
-                "CurrentSource": text_elem(current_source),
+                "CurrentSource": text_elem(v.ids[0] if len(v.ids) else ""),
                 "CurrentGroup": text_elem("0"),
                 "CurrentTimePoint": text_elem("0")
             },
             "SetupAssignments": {
-                "ConverterSetups": {"ConverterSetup": converter_setups},
-                "MinMaxGroups": {"MinMaxGroup": minmax_groups}
+                "ConverterSetups": {"ConverterSetup": [
+                    {"id": text_elem(ident), "min": text_elem(min_val), "max": text_elem(max_val),
+                     "color": text_elem(color), "groupId": text_elem(group_id)}
+                    for ident, min_val, max_val, color, group_id in zip(v.ids, v.min_vals, v.max_vals, v.colors, v.group_ids)
+                ]},
+                "MinMaxGroups": {"MinMaxGroup": [
+                    {key: text_elem(value) for key, value in group.items()}
+                    for group in minmax_group_values(n_channels, v.group_ranges)
+                ]}
             },
-            "ManualSourceTransforms": {"SourceTransform": manual_transforms},
+            "ManualSourceTransforms": {"SourceTransform": [
+                {"@type": "affine", "affine": text_elem(MANUAL_TRANSFORM_TEXT)} for _ in range(4)
+            ]},
             "Bookmarks": ""
         }
     }
-    return settings
+
 def prettify_xml(xml_string):
     dom = parseString(xml_string)
     return dom.toprettyxml(indent="  ")
 
+def render_settings_legacy(table, n_channels: int, offset: int, ranges=None) -> str:
+    """The original dict -> xmltodict -> minidom path. Kept as the reference for --benchmark."""
+    return prettify_xml(xmltodict.unparse(build_settings_dict(table, n_channels, offset, ranges)))
+
+def write_settings_file(output_file, table, n_channels: int, offset: int, ranges=None):
+    with open(output_file, "w", encoding="utf-8", buffering=1024 * 1024) as f:
+        write_settings_xml(f, table, n_channels, offset, ranges)
+    return output_file
+
+def offset_output_path(output_file, offset):
+    return output_file.replace(".xml", f"_offset_{offset}.xml")
+
+def write_all_offsets(output_file, table, n_channels: int, workers=None, ranges=None):
+    """Write one settings file per channel offset, in parallel. Returns the written paths."""
+    outputs = [offset_output_path(output_file, offset) for offset in range(n_channels)]
+    with ProcessPoolExecutor(max_workers=workers or min(n_channels, os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(write_settings_file, out, table, n_channels, offset, ranges) for offset, out in enumerate(outputs)]
+        return [future.result() for future in futures]
+
+# --- Display ranges ---
+# --auto-range replaces the fixed min/max with percentiles of each setup's own intensities,
+# read from the coarsest pyramid level of the BDV HDF5/N5 container with strided sampling.
+
+DEFAULT_PERCENTILES = (1.0, 99.9)
+MAX_RANGE_SAMPLES = 1_000_000
+
+def format_range_value(value):
+    return f"{float(value):.1f}"
+
+def _strided(dataset, max_samples):
+    """Every k-th voxel along each axis so that at most ~max_samples voxels are read."""
+    n_voxels = int(np.prod(dataset.shape))
+    step = max(1, int(np.ceil((n_voxels / max_samples) ** (1 / len(dataset.shape)))))
+    return np.asarray(dataset[(slice(None, None, step),) * len(dataset.shape)])
+
+def _open_coarsest_level(container, image_format, setup_id):
+    """Coarsest pyramid level of one setup at the first timepoint, as an array-like."""
+    if image_format == "bdv.hdf5":
+        timepoint = sorted(name for name in container if name.startswith("t"))[0]
+        levels = container[f"{timepoint}/s{setup_id:02d}"]
+        return levels[str(max(int(level) for level in levels))]["cells"]
+    setup = container[f"setup{setup_id}"]
+    timepoint = sorted(name for name in setup if name.startswith("timepoint"))[0]
+    levels = setup[timepoint]
+    return levels[f"s{max(int(level[1:]) for level in levels if level.startswith('s'))}"]
+
+def _sample_setups(args):
+    """Worker: (container path, format, setup ids, percentiles, max samples) -> [(min, max)]."""
+    path, image_format, setup_ids, percentiles, max_samples = args
+    if image_format == "bdv.hdf5":
+        container = h5py.File(path, "r")
+    else:
+        container = zarr.open(zarr.N5Store(path), mode="r")
+    ranges = []
+    try:
+        for setup_id in setup_ids:
+            try:
+                sample = _strided(_open_coarsest_level(container, image_format, setup_id), max_samples)
+                if image_format == "bdv.hdf5" and sample.dtype == np.int16:
+                    sample = sample.view(np.uint16)  # BDV HDF5 stores uint16 voxels in int16 cells
+                ranges.append(tuple(float(v) for v in np.percentile(sample, percentiles)))
+            except KeyError:
+                ranges.append((np.nan, np.nan))
+    finally:
+        if image_format == "bdv.hdf5":
+            container.close()
+    return ranges
+
+def sample_display_ranges(view_setups, table, percentiles=DEFAULT_PERCENTILES, workers=None, max_samples=MAX_RANGE_SAMPLES):
+    """
+    Percentile display range for every setup in table, from the image loader of view_setups
+    (as returned by load_view_setups). Setups are split across a process pool, each worker
+    opening the container once.
+
+    Returns:
+        np.ndarray: (len(table), 2) float, min/max per setup; NaN for setups missing from the container
+        (write_settings_xml gives those their group's median range).
+    """
+    loader = getattr(view_setups, "image_loader", None) or {}
+    image_format, path = loader.get("format"), loader.get("path")
+    if image_format not in ("bdv.hdf5", "bdv.n5") or not path:
+        raise ValueError(f"--auto-range needs a bdv.hdf5 or bdv.n5 image loader, found {image_format!r}")
+    if image_format == "bdv.hdf5" and h5py is None:
+        raise ImportError("h5py is required for --auto-range on HDF5 datasets (pip install h5py)")
+    if image_format == "bdv.n5" and zarr is None:
+        raise ImportError("zarr is required for --auto-range on N5 datasets (pip install \"zarr<3\")")
+
+    t0 = time.perf_counter()
+    setup_ids = [int(i) for i in table["ident"]]
+    n_workers = workers or os.cpu_count() or 1
+    n_chunks = min(len(setup_ids), n_workers * 4) or 1
+    chunks = [chunk.tolist() for chunk in np.array_split(setup_ids, n_chunks)]
+    jobs = [(path, image_format, chunk, list(percentiles), max_samples) for chunk in chunks]
+    if n_workers == 1:
+        results = [_sample_setups(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_sample_setups, jobs))
+    ranges = np.array([r for chunk_ranges in results for r in chunk_ranges], dtype=float).reshape(-1, 2)
+    missing = int(np.isnan(ranges[:, 0]).sum())  # left as NaN: write_settings_xml fills them after the group medians
+    print(f"Sampled display ranges (p{percentiles[0]}-p{percentiles[1]}) for {len(setup_ids)} setups "
+          f"in {time.perf_counter() - t0:.1f} s" + (f", {missing} missing" if missing else ""))
+    return ranges
+
+# --- Batch mode ---
+# One settings file (or one per offset with -g) next to every stitch-dataset XML under a root,
+# named <dataset>.settings.xml so BigDataViewer picks it up automatically. A <settings>.hash
+# stamp records the XML content hash and options; unchanged datasets are skipped.
+
+DATASET_PATTERNS = ["stitch-dataset*.xml", "stitcher-dataset*.xml"]
+
+def find_dataset_xmls(root_or_glob, patterns=DATASET_PATTERNS):
+    """Every SpimData XML under a directory (recursively), or matching a glob."""
+    if os.path.isdir(root_or_glob):
+        paths = [p for pattern in patterns for p in glob.glob(os.path.join(root_or_glob, "**", pattern), recursive=True)]
+    else:
+        paths = glob.glob(root_or_glob, recursive=True)
+    return sorted({os.path.abspath(p) for p in paths if ".settings" not in os.path.basename(p)})
+
+def settings_output_path(xml_path):
+    return os.path.splitext(xml_path)[0] + ".settings.xml"
+
+def file_digest(path, block_size=4 * 1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def generate_dataset_settings(xml_path, offset=0, generate_all=False, channels=None, force=False, percentiles=None):
+    """
+    Batch worker: write the settings for one dataset XML unless its stamp says it is up to date.
+    With percentiles, display ranges are sampled from the data (in this worker only, the batch
+    pool already runs datasets in parallel).
+
+    Returns:
+        dict: xml, status (regenerated/unchanged/failed), setups, files, seconds, error.
+    """
+    t0 = time.perf_counter()
+    record = {"xml": xml_path, "status": "failed", "setups": None, "files": 0, "seconds": 0.0, "error": None}
+    try:
+        output = settings_output_path(xml_path)
+        stamp_path = output + ".hash"
+        stamp = f"{file_digest(xml_path)} offset={offset} all={generate_all} channels={channels} percentiles={percentiles}"
+        if not force and os.path.exists(stamp_path):
+            # stamp file: the stamp line, then the outputs it produced
+            with open(stamp_path) as f:
+                lines = f.read().splitlines()
+            if lines and lines[0] == stamp and all(os.path.exists(o) for o in lines[1:]):
+                record["status"] = "unchanged"
+                return record
+
+        view_setups = load_view_setups(xml_path)
+        table, n_channels = build_setup_table(view_setups, channels)
+        record["setups"] = len(table)
+        ranges = sample_display_ranges(view_setups, table, percentiles, workers=1) if percentiles else None
+        outputs = [offset_output_path(output, o) for o in range(n_channels)] if generate_all else [output]
+        for i, out in enumerate(outputs):
+            write_settings_file(out, table, n_channels, i if generate_all else offset % n_channels, ranges)
+        with open(stamp_path, "w") as f:
+            f.write("\n".join([stamp] + outputs) + "\n")
+        record["status"] = "regenerated"
+        record["files"] = len(outputs)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        record["seconds"] = time.perf_counter() - t0
+    return record
+
+def run_batch(root_or_glob, offset=0, generate_all=False, channels=None, force=False, workers=None, percentiles=None):
+    """Generate settings for every dataset XML found, in a process pool, and print a summary table."""
+    t0 = time.perf_counter()
+    xml_paths = find_dataset_xmls(root_or_glob)
+    print(f"=== Batch: {len(xml_paths)} dataset XML(s) under {root_or_glob} ===")
+    records = []
+    if xml_paths:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(generate_dataset_settings, p, offset, generate_all, channels, force, percentiles) for p in xml_paths]
+            records = [future.result() for future in futures]
+
+    common = os.path.commonpath(xml_paths) if len(xml_paths) > 1 else os.path.dirname(xml_paths[0]) if xml_paths else ""
+    print(f"{'dataset':<60} {'status':<12} {'setups':>7} {'files':>5} {'time (s)':>9}")
+    for r in records:
+        name = os.path.relpath(r["xml"], common) if common else r["xml"]
+        setups = "" if r["setups"] is None else r["setups"]
+        print(f"{name:<60} {r['status']:<12} {setups:>7} {r['files']:>5} {r['seconds']:>9.2f}")
+        if r["error"]:
+            print(f"    [FAILED] {r['error']}")
+    counts = {status: sum(r["status"] == status for r in records) for status in ("regenerated", "unchanged", "failed")}
+    print(f"✅ {counts['regenerated']} regenerated, {counts['unchanged']} unchanged, {counts['failed']} failed "
+          f"in {time.perf_counter() - t0:.1f} s")
+    return records
+
+# --- Benchmark ---
+
+def synthetic_view_setups(n_setups, n_channels=6):
+    """Stand-in view setups shaped like load_view_setups' output, with tile/channel attributes."""
+    elements = [ViewSetupRecord(str(i), None, None, SetupAttributes("0", str(i % n_channels), str(i // n_channels), "0"))
+                for i in range(n_setups)]
+    channels = AttributeList("channel", [(c, str(c)) for c in range(n_channels)])
+    return SimpleNamespace(elements=elements, attributes=[channels], base_path=None, image_loader={})
+
+def benchmark_writers(n_setups=12000, offset=0, n_channels=6):
+    """
+    Time and peak memory of the xmltodict/minidom and streaming writers on synthetic view setups
+    (setup table built from their channel/tile attributes in both); checks the bytes match.
+    """
+    import io
+    import tracemalloc
+
+    view_setups = synthetic_view_setups(n_setups, n_channels)
+    results = {}
+    outputs = {}
+    for name in ("legacy", "streaming"):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        table, n = build_setup_table(view_setups)
+        if name == "legacy":
+            outputs[name] = render_settings_legacy(table, n, offset % n).encode("utf-8")
+        else:
+            buf = io.StringIO()
+            write_settings_xml(buf, table, n, offset % n)
+            outputs[name] = buf.getvalue().encode("utf-8")
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = (elapsed, peak)
+
+    print(f"=== Settings writer benchmark: {n_setups} view setups, {n_channels} channels, offset {offset} ===")
+    for name, (elapsed, peak) in results.items():
+        print(f"{name:<10} {elapsed:8.3f} s   peak {peak / 1e6:8.1f} MB")
+    print(f"speedup {results['legacy'][0] / max(results['streaming'][0], 1e-9):.1f}x, "
+          f"peak memory {results['legacy'][1] / max(results['streaming'][1], 1):.1f}x lower "
+          f"(streaming peak includes the in-memory output buffer used for the comparison)")
+    identical = outputs["legacy"] == outputs["streaming"]
+    print("Output byte-identical:", identical)
+    return identical
+
 def main():
     parser = argparse.ArgumentParser(description="Generate BDV settings.xml from BigStitcher/SpimData XML.")
-    parser.add_argument("spimdata_file", help="Path to the input SpimData XML file.")
+    parser.add_argument("spimdata_file", nargs="?", help="Path to the input SpimData XML file (with --batch: a root directory or glob).")
     parser.add_argument("-o", "--output_settings_file", default ="stitch-dataset2.settings.xml", help="Path to the output settings XML file.")
     parser.add_argument("-c", "--channel_offset", type=int, default=0, help="Channel offset (default: 0).")
-    parser.add_argument("-g","--generate_all", action="store_true", default=False, help="Generate a settings file for each channel offset (0-5).")
+    parser.add_argument("-g","--generate_all", action="store_true", default=False, help="Generate a settings file for each channel offset (0 to channels-1).")
+    parser.add_argument("-n", "--channels", type=int, default=None, help="Channels per tile (default: from the SpimData channel attribute).")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Processes used by --generate_all / --batch.")
+    parser.add_argument("-b", "--batch", action="store_true", default=False, help="Treat spimdata_file as a root directory or glob and write <dataset>.settings.xml next to every stitch-dataset XML found.")
+    parser.add_argument("--force", action="store_true", default=False, help="With --batch, regenerate even if the XML is unchanged.")
+    parser.add_argument("-r", "--auto-range", action="store_true", default=False, help="Display ranges from percentiles of each setup's data (bdv.hdf5/bdv.n5 loaders) instead of the fixed values.")
+    parser.add_argument("--percentiles", type=float, nargs=2, metavar=("LOW", "HIGH"), default=DEFAULT_PERCENTILES, help=f"Percentiles used by --auto-range (default: {DEFAULT_PERCENTILES[0]} {DEFAULT_PERCENTILES[1]}).")
+    parser.add_argument("--full-model", action="store_true", default=False, help="Load and validate the whole SpimData with pydantic-bigstitcher instead of only reading the view setups.")
+    parser.add_argument("--benchmark", type=int, metavar="N_SETUPS", default=None, help="Compare the streaming writer against the xmltodict/minidom path on N synthetic view setups and exit.")
 
     args = parser.parse_args()
+    if args.spimdata_file is None and args.benchmark is None:
+        parser.error("spimdata_file is required")
 
     if args.channel_offset < 0 or args.channel_offset > 7:
         print("channel_offset must be between 0 and 7")
         sys.exit(1)
     
+    if args.benchmark is not None:
+        identical = benchmark_writers(args.benchmark, args.channel_offset, args.channels or 6)
+        sys.exit(0 if identical else 1)
+
+    percentiles = tuple(args.percentiles) if args.auto_range else None
+    if args.batch:
+        records = run_batch(args.spimdata_file, args.channel_offset, args.generate_all, args.channels, args.force, args.workers, percentiles)
+        sys.exit(1 if any(r["status"] == "failed" for r in records) else 0)
+
+    t0 = time.perf_counter()
+    if args.full_model:
+        view_setups = load_spimdata(args.spimdata_file).sequence_description.view_setups
+    else:
+        view_setups = load_view_setups(args.spimdata_file)
+    print(f"Loaded view setups in {time.perf_counter() - t0:.2f} s")
+    table, n_channels = build_setup_table(view_setups, args.channels)
+    print(f"{len(table)} view setups, {n_channels} channels per tile")
+    ranges = None
+    if percentiles:
+        # the pydantic model does not keep the image loader path
+        loader_source = view_setups if hasattr(view_setups, "image_loader") else load_view_setups(args.spimdata_file)
+        ranges = sample_display_ranges(loader_source, table, percentiles, args.workers)
+
     if args.generate_all:
-        for offset in range(6):
-            output_file = args.output_settings_file.replace(".xml", f"_offset_{offset}.xml")
-            print(f"Generating settings for channel offset: {offset}")
-            spim_data = load_spimdata(args.spimdata_file)
-            settings_dict = build_settings_dict(spim_data, offset)
-            settings_xml = xmltodict.unparse(settings_dict)
-            pretty_xml = prettify_xml(settings_xml)
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(pretty_xml)
+        print(f"Generating settings for channel offsets 0-{n_channels - 1}")
+        for output_file in write_all_offsets(args.output_settings_file, table, n_channels, args.workers, ranges):
             print(f"Settings XML written to {output_file}")
     else:
         print(f"Using channel offset: {args.channel_offset}")
-        spim_data = load_spimdata(args.spimdata_file)
-        settings_dict = build_settings_dict(spim_data, args.channel_offset)
-        settings_xml = xmltodict.unparse(settings_dict)
-        pretty_xml = prettify_xml(settings_xml)
-        with open(args.output_settings_file, "w", encoding="utf-8") as f:
-            f.write(pretty_xml)
+        write_settings_file(args.output_settings_file, table, n_channels, args.channel_offset % n_channels, ranges)
         print(f"Settings XML written to {args.output_settings_file}")
 
 if __name__ == "__main__":
     main()
 
 #  /shared/s3/e11-hpc/compute/RP022_i1264_cpd/gel2/fov1/round2/stitcher-dataset.xml
-# python formatter.py /shared/s3/e11-hpc/compute/RP022_i1264_cpd/gel3/fov1/round8/stitch-dataset.xml -o gel3round8.xml  
\ No newline at end of file
+# python formatter.py /shared/s3/e11-hpc/compute/RP022_i1264_cpd/gel3/fov1/round8/stitch-dataset.xml -o gel3round8.xml
+# every gel/fov/round at once, skipping datasets whose XML has not changed:
+# python stitch_settings_generator.py --batch /shared/s3/e11-hpc/compute/RP022_i1264_cpd -g
+# python stitch_settings_generator.py --batch "/shared/s3/e11-hpc/compute/RP022_i1264_cpd/gel3/fov*/round*/stitch-dataset.xml"
@@ -0,0 +1,92 @@
+# Page-by-page access to compressed TIFF stacks for the plain-Python montage scripts.
+#
+# An uncompressed TIFF can be memory-mapped, so indexing it only reads the bytes asked for. A
+# compressed one can't, and tifffile.imread() decodes the whole stack. But TIFF pages are compressed
+# independently, so TiffPlanes gives an (N, C, Y, X) view whose indexing decodes only the pages
+# (one per slice/channel plane) it touches; a worker then holds a few planes, never the stack.
+#
+#   stack = TiffPlanes(path, stack_axes="Z")      # roi_montages: N is Z, other axes at index 0
+#   crop = stack[z0:z1, :, top:bottom, left:right]  # decodes (z1 - z0) x C pages
+#
+# Used by roi_montages.py and screening_montages.py when tifffile.memmap() refuses the file.
+
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import tifffile  # pip install tifffile
+except ImportError:
+    tifffile = None
+
+
+class TiffPlanes(object):
+    """
+    Lazily-decoded (N, C, Y, X) view of the first series of a TIFF, one page per plane.
+
+    Parameters:
+        path (str): The TIFF.
+        stack_axes (str): Candidate axes for N, in order of preference; the first one with more than
+            one plane is used (Z for a z-stack, "PTZQ" for a screening series). Other axes are read at index 0.
+        cache_pages (int): Decoded pages kept (least recently used dropped), for callers that index
+            the same planes repeatedly (overlapping ROIs).
+    """
+
+    def __init__(self, path, stack_axes="Z", cache_pages=0):
+        if tifffile is None:
+            raise ImportError("tifffile is required for TIFF images (pip install tifffile)")
+        self._tif = tifffile.TiffFile(path)
+        series = self._tif.series[0]
+        axes = series.axes.upper()
+        y = axes.index("Y")
+        self._lead, self._lead_shape = axes[:y], series.shape[:y]
+        # RGB(A) samples live inside each page; without a C axis they are the channels
+        self._samples = "S" in axes[y:]
+        sizes = dict(zip(axes, series.shape))
+        self._stack_axis = next((ax for ax in stack_axes if sizes.get(ax, 1) > 1 and ax in self._lead), None)
+        self._channel_axis = "C" if "C" in self._lead else None
+        n_channels = sizes.get("C", 1) if self._channel_axis else sizes.get("S", 1) if self._samples else 1
+        self.shape = (sizes[self._stack_axis] if self._stack_axis else 1, n_channels, sizes["Y"], sizes["X"])
+        self.dtype = series.dtype
+        self.ndim = 4
+        self._pages = series.pages
+        if len(self._pages) != int(np.prod(self._lead_shape)):
+            raise ValueError("{}: {} pages for a {} series; not one page per plane".format(
+                path, len(self._pages), series.shape))
+        self._cache = OrderedDict()
+        self._cache_pages = cache_pages
+
+    def _page(self, n, c):
+        index = {ax: 0 for ax in self._lead}
+        if self._stack_axis:
+            index[self._stack_axis] = n
+        if self._channel_axis:
+            index[self._channel_axis] = c
+        k = int(np.ravel_multi_index([index[ax] for ax in self._lead], self._lead_shape)) if self._lead else 0
+        data = self._cache.pop(k, None)
+        if data is None:
+            data = self._pages[k].asarray()
+        if self._cache_pages:
+            self._cache[k] = data
+            while len(self._cache) > self._cache_pages:
+                self._cache.popitem(last=False)
+        return data[..., c] if self._samples and not self._channel_axis else data
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),) * (4 - len(key))
+        ns, cs = range(self.shape[0])[key[0]], range(self.shape[1])[key[1]]
+        n_list = ns if isinstance(ns, range) else [ns]
+        c_list = cs if isinstance(cs, range) else [cs]
+        plane_shape = np.broadcast_to(np.empty((), dtype=bool), self.shape[2:])[key[2], key[3]].shape
+        out = np.empty((len(n_list), len(c_list)) + plane_shape, dtype=self.dtype)
+        for i, n in enumerate(n_list):
+            for j, c in enumerate(c_list):
+                out[i, j] = self._page(n, c)[key[2], key[3]]
+        return out[(slice(None) if isinstance(ns, range) else 0, slice(None) if isinstance(cs, range) else 0)]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def close(self):
+        self._tif.close()